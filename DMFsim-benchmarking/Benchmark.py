@@ -1,5 +1,7 @@
 import sys              # exiting
-import os               # forking and waiting
+import os               # reading /proc and waiting
+import re               # matching legacy csv names
+import shlex            # splitting cmds
 import subprocess       # running cmds
 import time             # sleeping
 import pandas           # csv exporting/importing
@@ -7,29 +9,36 @@ import numpy            # nan values
 import argparse
 import configparser
 import json
+import hashlib          # hashing the config
+import sqlite3          # the results store
+import queue            # handing out cores
+import threading        # running simulations concurrently
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
 
 # ================ CONSTANTS ================ 
 
-""" The target metrics, a list of strings corresponding to top metric headers.
-When benchmarking an independent variable the specified target metrics will be obtained
-per ping from top. "time+": runtime, "res": RAM usage, "%cpu": cpu usage. """
+""" The target metrics, a list of strings corresponding to the metric names below.
+When benchmarking an independent variable the specified target metrics will be sampled
+per ping from /proc. "time+": cpu time, "res": RAM usage, "%cpu": cpu usage. """
 g_target_metrics = ['time+', 'res', '%cpu']
-""" possible target metrics, the ordering depends on the user's top configuration
-these indexes will not be accurate if the given toprc is not used! """
-g_targets = {   # see https://man7.org/linux/man-pages/man1/top.1.html for explanation
-    'pid': 1,
-    'virt': 2,
-    'res': 3,
-    'shr': 4,
-    '%cpu': 5,
-    '%mem': 6,
-    'time+': 7,
-    'command': 8,
-    'swap': 9,
-    'data': 10
-}
-g_memory_targets = ['virt', 'res', 'shr', 'swap', 'data']
+""" possible target metrics, named after the matching top columns. They are all read
+straight from /proc/<pid>/stat, statm and status (see https://man7.org/linux/man-pages/man5/proc.5.html)
+"time+": cpu time in seconds, "%cpu": cpu usage since the last ping, "%mem": share of physical memory,
+"virt", "res", "shr", "swap", "data": memory in GiB, "peak": the peak resident memory so far (VmHWM) in GiB """
+g_targets = ['pid', 'virt', 'res', 'shr', '%cpu', '%mem', 'time+', 'swap', 'data', 'peak']
+""" Columns added to every ping after the target metrics: the core the simulation ran on,
+and how many simulations the benchmarker was running at the time """
+g_schedule_columns = ['core', 'concurrency']
+""" The file name prefixes of each independent variable, for the files a run leaves in raw-data """
+g_prefixes = {'hardware': 'hw', 'gridsize': 'gs', 'gene-length': 'gl', 'problem-size': 'ps'}
+g_memory_targets = ['virt', 'res', 'shr', 'swap', 'data', 'peak']
+
+""" Conversion factors for the raw /proc values """
+g_clock_ticks = os.sysconf('SC_CLK_TCK')        # cpu time units per second
+g_page_gib = os.sysconf('SC_PAGE_SIZE') / 2**30 # statm pages to GiB
+g_kib_gib = 1 / 2**20                           # status kB to GiB
 
 
 # ================ PARAMETERS ================ 
@@ -38,6 +47,7 @@ config.read('./config.ini')
 
 g_rounds = int(config['Benchmarking']['Rounds'])
 g_ping_interval = float(config['Benchmarking']['PingInterval'])
+g_store_path = config['Benchmarking'].get('Store', 'raw-data/benchmark.sqlite')
 
 g_const_machine = config['Constant Variables']['Machine']
 g_const_gridsize = int(config['Constant Variables']['Gridsize'])
@@ -45,189 +55,239 @@ g_const_gene_length = int(config['Constant Variables']['GeneLength'])
 
 g_gridsizes = json.loads(config['Independent Variables']['Gridsizes'])
 g_gene_lengths = json.loads(config['Independent Variables']['GeneLengths'])
+""" (gridsize, gene-length) pairs for the problem-size call profiles, by default the gridsizes at the constant gene-length """
+g_problem_sizes = json.loads(config['Independent Variables'].get('ProblemSizes', json.dumps([[gridsize, g_const_gene_length] for gridsize in g_gridsizes])))
+
+""" Identifies the configuration a run was made under, recorded with every run """
+g_config_hash = hashlib.sha256(json.dumps({section: dict(config[section]) for section in config.sections()}, sort_keys=True).encode()).hexdigest()[:12]
+
+""" The results store: one row per run in runs, with the pings, congestion and call profiles of each run in their own tables.
+The runs are only ever appended to, the formatters read the latest run of each variable, value and round. """
+g_schema = f'''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, host TEXT, variable TEXT, value, round INTEGER,
+    config_hash TEXT, command TEXT, finished REAL, total_runtime REAL, source TEXT
+);
+CREATE TABLE IF NOT EXISTS pings (run INTEGER, seq INTEGER, {', '.join(f'"{column}" REAL' for column in g_targets + g_schedule_columns)});
+CREATE INDEX IF NOT EXISTS pings_run ON pings (run);
+CREATE TABLE IF NOT EXISTS congestion (run INTEGER, total_droplets INTEGER, max_droplets INTEGER, max_congestion REAL);
+CREATE TABLE IF NOT EXISTS calls (run INTEGER, id TEXT, grp TEXT, calls INTEGER, time REAL);
+CREATE INDEX IF NOT EXISTS calls_run ON calls (run);
+'''
+g_store_lock = threading.Lock()
+
+""" The number of simulations currently running, recorded with every ping """
+g_running = 0
+g_running_lock = threading.Lock()
 
 
 # ================ PINGING ================ 
-def get_pings(full_cmd, target_metrics):
-    # organizing simple state machine
-    simulation_states = ['waiting', 'running', 'done']
-    sim_state = simulation_states[0]
-
-    sim_pid = ''    # string representation of the simulations pid
-    pings = []      # list of pings; (cpu_run_time, target_metric_0, ... target_metric_N)
-
-    while sim_state == 'waiting' or sim_state == 'running':
-
-        if sim_state == 'waiting':
-            # check if the simulation process started running
-            completed_process = subprocess.run(f'pgrep -a python3', shell=True, capture_output=True)
-            if f'{full_cmd}' in completed_process.stdout.decode().strip():
-                # parse pgrep stdout for simulation's pid
-                lines = completed_process.stdout.decode().strip().split('\n')
-                sim_pid = ''
-                for line in lines:
-                    if full_cmd in line:
-                        sim_pid = line.split(' ')[0]
-                # set sim_state to running
-                sim_state = simulation_states[1]
-
-        elif sim_state == 'running':
-            ping = ping_top(sim_pid, target_metrics) 
-            if ping:    # if ping succeeds add it to the list of pings
-                pings.append(ping)
-            # check if the simulation process stopped running
-            completed_process = subprocess.run(f'pgrep -a python3', shell=True, capture_output=True)
-            if f'{full_cmd}' not in completed_process.stdout.decode().strip():
-                sim_state = simulation_states[2]
-        
-        time.sleep(g_ping_interval)     # don't spam pings
-    
-    return pings
-
-def ping_top(sim_pid, target_metrics):
-    ping = None
-    awk_cmd = (             # format awk portion of ping command
-        'awk \'{print ' +
-        # '$target_index_0, ... $target_index_N'
-        ', '.join(['${0}'.format(g_targets[target]) for target in target_metrics]) +
-        '}\''
-    )
-    ping_cmd = (            # format ping command
-        'top -b '           # run top in batch mode
-        '-n 2 '             # run 2 iterations
-        '-d 0.1 '           # dt = .1 sec
-        f'-p {sim_pid} | '  # only show data for sim process id
-        'tail -1 | ' +      # get the last line of the output
-        awk_cmd
-    )
-
-    completed_process = subprocess.run(ping_cmd, shell=True, capture_output=True)
-    string_metric = completed_process.stdout.decode().strip()
-
-    """ If you ping top with a dead pid it does not error, nor print to stderr,
-        afaik the only way to detect when this happens is to check if the
-        grabbed strings are the column headers, i.e., contain no digits """
-    if any(char.isdigit() for char in string_metric):
-        string_list_metric = string_metric.split(' ')
-
-        # ensure memory metrics are in Gibibytes
-        for i, target_metric in enumerate(target_metrics):
-            if target_metric in g_memory_targets:
-                string_mem_metric = string_list_metric[i]
-                suffix = string_mem_metric[-1]
-                
-                if suffix.isdigit():      # no suffix: kibi
-                    string_list_metric[i] = str(round((float(string_mem_metric) * 9.5367431640625e-7), 3))
-                elif suffix == 'm':       # m: mebi
-                    string_list_metric[i] = str(round((float(string_mem_metric[:-1]) * 0.000976563), 3))
-                elif suffix == 'g':       # g: gibi
-                    string_list_metric[i] = string_list_metric[i][:-1]
-                elif suffix == 't':       # t: tebi
-                    string_list_metric[i] = str(round((float(string_mem_metric[:-1]) * 1023.99737856), 3))
-                elif suffix == 'p':       # p: pebi
-                    string_list_metric[i] = str(round((float(string_mem_metric[:-1]) * 1048573.315645), 3))
-                elif suffix == 'e':       # e: exbi (lol)
-                    string_list_metric[i] = str(round((float(string_mem_metric[:-1]) * 1.074e+9), 3))
-
-        # parse the runtime in seconds from the top
-        run_time = string_list_metric[0]
-        string_list_metric[0] = str(
-            int(run_time.split(':')[0]) * 60 +
-            int(run_time.split(':')[1][:2]) +
-            float(run_time.split(':')[1][2:])
-        )
-
-        ping = tuple(string_list_metric)                # construct ping: (cpu_run_time, target_metric_0, ... target_metric_N)
-        assert len(ping) == len(target_metrics)         # ensure expected ping format 
- 
-    return ping
+def read_status(pid):
+    # the memory fields of /proc/<pid>/status, in kB
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.endswith('kB\n'):
+                status[name] = int(value.split()[0])
+    return status
+
+def read_mem_total():
+    # the machine's physical memory, in kB
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1])
+
+def ping_proc(pid, target_metrics, last, mem_total):
+    # sample the process's counters straight from /proc, returns None if it has exited
+    # last is the (wall time, cpu time) of the previous ping, for the cpu usage
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+        with open(f'/proc/{pid}/statm') as f:
+            statm = [int(x) for x in f.read().split()]
+        status = read_status(pid) if any(target in ('swap', 'data', 'peak') for target in target_metrics) else {}
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    wall_time = time.monotonic()
+    fields = stat[stat.rindex(')') + 2:].split()   # skip past the command name, which may contain spaces
+    if fields[0] == 'Z':                            # exited, but not yet reaped
+        return None
+    cpu_time = (int(fields[11]) + int(fields[12])) / g_clock_ticks     # utime + stime
+
+    values = {
+        'pid': pid,
+        'virt': statm[0] * g_page_gib,
+        'res': statm[1] * g_page_gib,
+        'shr': statm[2] * g_page_gib,
+        '%cpu': 100 * (cpu_time - last[1]) / max(wall_time - last[0], 1e-9),
+        '%mem': 100 * statm[1] * g_page_gib / (mem_total * g_kib_gib),
+        'time+': cpu_time,
+        'swap': status.get('VmSwap', 0) * g_kib_gib,
+        'data': status.get('VmData', 0) * g_kib_gib,
+        'peak': status.get('VmHWM', 0) * g_kib_gib,
+        'core': int(fields[36]),       # the cpu core the process last ran on, always recorded
+    }
+    last[0], last[1] = wall_time, cpu_time
+    # ping: (cpu_run_time, target_metric_1, ... target_metric_N), memory in GiB to 3 decimals like before
+    return tuple(round(values[target], 3) if target in g_memory_targets else values[target] for target in target_metrics)
+
+def get_pings(full_cmd, target_metrics, core=None, silent=False):
+    # launch the simulation and sample it every g_ping_interval seconds until it exits
+    # if core is given the simulation is pinned to it, if silent its output is discarded
+    # returns the pings, the total cpu time of the run, as reported when it is reaped, and its return code
+    global g_running
+    process = subprocess.Popen(shlex.split(full_cmd), stdout=subprocess.DEVNULL if silent else None)
+    if core is not None:
+        os.sched_setaffinity(process.pid, {core})
+    with g_running_lock:
+        g_running += 1
+    mem_total = read_mem_total()
+    last = [time.monotonic(), 0.0]
+    pings = []      # list of pings; (cpu_run_time, target_metric_1, ... target_metric_N, core, concurrency)
+
+    next_ping = time.monotonic()
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid != 0:    # the simulation has exited
+            # like Popen.returncode, minus the signal number if a signal killed it
+            process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            break
+        ping = ping_proc(process.pid, target_metrics + ['core'], last, mem_total)
+        if ping:        # if ping succeeds add it to the list of pings
+            pings.append(ping + (g_running, ))
+
+        # keep to a fixed schedule, so the time spent pinging doesn't stretch the interval
+        next_ping += g_ping_interval
+        time.sleep(max(0, next_ping - time.monotonic()))
+
+    with g_running_lock:
+        g_running -= 1
+    return pings, rusage.ru_utime + rusage.ru_stime, process.returncode
+
+def run_stem(run):
+    # the path, without extension, for files belonging to a run, e.g. raw-data/<host>/gs-40-0
+    host_string, variable, value, j = run
+    value = '' if value is None else f'-{value}'
+    return f'raw-data/{host_string}/{g_prefixes[variable]}{value}-{j}'
+
+def profile_cmd(full_cmd, target_metrics, run, core=None, silent=False):
+    # run the simulation while pinging it, then store the pings
+    # a run that failed is reported and left out of the store, so it can't pass for a valid measurement
+    pings, total_cpu_time, returncode = get_pings(full_cmd, target_metrics, core, silent)
+    if returncode != 0:
+        print(f'[PROFILING] --> \'{full_cmd}\' failed with return code {returncode}, run not stored')
+    elif pings:
+        save_run(run, full_cmd, pings, target_metrics, total_cpu_time)
+    else:
+        print(f'[PROFILING] --> no pings taken, \'{full_cmd}\' exited too quickly')
+
+
+# ================ SCHEDULING ================ 
+def pick_cores(jobs, quiet):
+    # choose the cores to pin simulations to, one per concurrent simulation
+    # when there are cores to spare the benchmarker moves to a core of its own, so its pinging stays out of the way
+    available = sorted(os.sched_getaffinity(0))
+    if quiet:
+        jobs = 1
+    if jobs > len(available):
+        print(f'[PROFILING] --> only {len(available)} cores available, running {len(available)} simulations at a time')
+        jobs = len(available)
+    if len(available) > jobs:
+        os.sched_setaffinity(0, {available[0]})
+        return available[1:jobs + 1]
+    if quiet:
+        print('[PROFILING] --> no core to spare for the benchmarker, the simulation will share its core')
+    return available[:jobs]
+
+def run_jobs(job_list, target_metrics, jobs=1, quiet=False, sample=False):
+    # run the profiling jobs, each a (progress message, command, run), where run is (host, variable, value, round)
+    # with sample the simulations also write collapsed stacks to raw-data, see the simulation's --sample option
+    if sample:
+        job_list = [(message, f'{full_cmd} --sample={run_stem(run)}.collapsed', run) for message, full_cmd, run in job_list]
+    # with jobs > 1 up to that many simulations run at once, each pinned to its own core and with its output discarded
+    # with quiet the simulations run one at a time, pinned to a core that the benchmarker stays off
+    # otherwise the simulations run one at a time wherever the system puts them, as they always have
+    if not (quiet or jobs > 1):
+        for message, full_cmd, run in job_list:
+            print(message)
+            profile_cmd(full_cmd, target_metrics, run)
+        return
 
-def write_pings(pings, target_metrics, path):
-    # last recorded cpu time of simulation, off by a max of +- g_ping_interval
-    last_cpu_time = pings[-1][0]
-    # add last cpu time to end of first tuple
-    pings[0] = tuple(list(pings[0]) + [last_cpu_time])
-    # add column headers
-    csv_data = [tuple(target_metrics + ['total-runtime'])] + pings
-    # export data
-    pandas.DataFrame(csv_data).to_csv(path, index=False, header=False)
+    # pick_cores may move the benchmarker onto a core of its own, so its affinity is put back once the jobs are done
+    affinity = os.sched_getaffinity(0)
+    cores = queue.Queue()
+    for core in pick_cores(jobs, quiet):
+        cores.put(core)
+    workers = cores.qsize()
+
+    def run(job):
+        message, full_cmd, run = job
+        core = cores.get()
+        try:
+            print(f'{message}, core: {core}')
+            profile_cmd(full_cmd, target_metrics, run, core, silent=workers > 1)
+        finally:
+            cores.put(core)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run, job_list))   # list() surfaces any errors
+    finally:
+        os.sched_setaffinity(0, affinity)
 
 
 # ================ Profiling ================ 
-def profile_hardware(variable_count, ith_variable, cmd, target_metrics, host_string):
+def profile_hardware(variable_count, ith_variable, cmd, target_metrics, host_string, jobs=1, quiet=False, sample=False):
     if target_metrics == []:
         return
 
+    job_list = []
     for i in range(g_rounds):
-        print(f'[PROFILING] --> variable: system hardware ({ith_variable}/{variable_count}), round: {i+1} ({i+1}/{g_rounds})')
+        message = f'[PROFILING] --> variable: system hardware ({ith_variable}/{variable_count}), round: {i+1} ({i+1}/{g_rounds})'
 
-        pid = os.fork()                                 # fork process
         full_cmd = (
             f'{cmd} '
             f'--gridsize={g_const_gridsize} '
             f'--gene-length={g_const_gene_length}'
         )
+        job_list.append((message, full_cmd, (host_string, 'hardware', None, i)))
+    run_jobs(job_list, target_metrics, jobs, quiet, sample)
 
-        if pid == 0:                                    # child process
-            # ping active simulation
-            pings = get_pings(full_cmd, target_metrics)
-            write_pings(                                # export data
-                pings,
-                target_metrics,
-                f'raw-data/{host_string}/hw-{i}.csv'
-            )
-            sys.exit(0)                                 # kill child
-
-        else:                                           # parent process
-            # run simulation
-            subprocess.run(full_cmd, shell=True)
-            os.wait()                                   # wait for child process to complete
-
-def profile_gridsize(variable_count, ith_variable, cmd, target_metrics, host_string):
+def profile_gridsize(variable_count, ith_variable, cmd, target_metrics, host_string, jobs=1, quiet=False, sample=False):
     if target_metrics == []:
         return
 
     # only profile on desired constant machine
     if host_string == g_const_machine:
+        job_list = []
         for i, gridsize in enumerate(g_gridsizes):
             for j in range(g_rounds):
                 # FIXME:
-                print(f'[PROFILING] --> variable: gridsize ({ith_variable}/{variable_count}), gridsize: {gridsize} ({i+1}/{len(g_gridsizes)}), round: {j+1} ({j+1}/{g_rounds})')
+                message = f'[PROFILING] --> variable: gridsize ({ith_variable}/{variable_count}), gridsize: {gridsize} ({i+1}/{len(g_gridsizes)}), round: {j+1} ({j+1}/{g_rounds})'
 
-                pid = os.fork()                                 # fork process
                 full_cmd = (
                     f'{cmd} '
                     f'--gridsize={gridsize} '
                     f'--gene-length={g_const_gene_length}'
                 )
+                job_list.append((message, full_cmd, (host_string, 'gridsize', gridsize, j)))
+        run_jobs(job_list, target_metrics, jobs, quiet, sample)
 
-                if pid == 0:                                    # child process
-                    # ping active simulation
-                    pings = get_pings(full_cmd, target_metrics)
-                    write_pings(                                # export data
-                        pings,
-                        target_metrics,
-                        f'raw-data/{host_string}/gs-{gridsize}-{j}.csv'
-                    )
-                    sys.exit(0)                                 # kill child
-
-                else:                                           # parent process
-                    # run simulation
-                    subprocess.run(full_cmd, shell=True)
-                    os.wait()                                   # wait for child process to complete
-
-def profile_gene_length(variable_count, ith_variable, cmd, target_metrics, host_string):
+def profile_gene_length(variable_count, ith_variable, cmd, target_metrics, host_string, jobs=1, quiet=False, sample=False):
     if target_metrics == []:
         return
     
     # only profile on desired constant machine
     if host_string == g_const_machine:
+        job_list = []
         for i, gene_length in enumerate(g_gene_lengths):
             for j in range(g_rounds):
                 # FIXME:
-                print(f'[PROFILING] --> variable: gene length ({ith_variable}/{variable_count}), gene length: {gene_length} ({i+1}/{len(g_gene_lengths)}), round: {j+1} ({j+1}/{g_rounds})')
+                message = f'[PROFILING] --> variable: gene length ({ith_variable}/{variable_count}), gene length: {gene_length} ({i+1}/{len(g_gene_lengths)}), round: {j+1} ({j+1}/{g_rounds})'
 
-                pid = os.fork()                                 # fork process
                 full_cmd = (
                     f'{cmd} '
                     f'--host-string={host_string} '
@@ -235,279 +295,276 @@ def profile_gene_length(variable_count, ith_variable, cmd, target_metrics, host_
                     f'--gene-length={gene_length} '
                     f'--round={j}'
                 )
+                job_list.append((message, full_cmd, (host_string, 'gene-length', gene_length, j)))
+        run_jobs(job_list, target_metrics, jobs, quiet, sample)
+
+def profile_problem_size(variable_count, ith_variable, cmd, host_string):
+    # run the simulation under its --profile option, which writes the time spent in each subroutine
+    # these runs are timed by cProfile rather than pinged, so they are not part of 'all'
+    if host_string == g_const_machine:
+        for i, (gridsize, gene_length) in enumerate(g_problem_sizes):
+            for j in range(g_rounds):
+                print(f'[PROFILING] --> variable: problem size ({ith_variable}/{variable_count}), gridsize: {gridsize}, gene length: {gene_length} ({i+1}/{len(g_problem_sizes)}), round: {j+1} ({j+1}/{g_rounds})')
 
-                if pid == 0:                                    # child process
-                    # ping active simulation
-                    pings = get_pings(full_cmd, target_metrics)
-                    write_pings(                                # export data
-                        pings,
-                        target_metrics,
-                        f'raw-data/{host_string}/gl-{gene_length}-{j}.csv'
-                    )
-                    sys.exit(0)                                 # kill child
-
-                else:                                           # parent process
-                    # run simulation
-                    subprocess.run(full_cmd, shell=True)
-                    os.wait()                                   # wait for child process to complete
-
-
-# ================ FORMATTING ================ 
-def import_data(raw_data_path, matcher, labeler, sorter):
-    # get paths of raw-data and append them to their corresponding list
-    label_file_pairs = []
-    for machine in os.listdir(raw_data_path):
+                run = (host_string, 'problem-size', f'{gridsize}-{gene_length}', j)
+                path = f'{run_stem(run)}.csv'
+                full_cmd = (
+                    f'{cmd} '
+                    f'--gridsize={gridsize} '
+                    f'--gene-length={gene_length} '
+                    f'--profile={path}'
+                )
+                returncode = subprocess.run(shlex.split(full_cmd), stdout=subprocess.DEVNULL).returncode
+
+                # move the call table into the store, a failed run is reported and its partial call table discarded
+                if returncode != 0 or not os.path.exists(path):
+                    print(f'[PROFILING] --> \'{full_cmd}\' failed with return code {returncode}, run not stored')
+                    if os.path.exists(path):
+                        os.remove(path)
+                    continue
+                with closing(open_store()) as store, store:
+                    store_calls(store, store_run(store, run, full_cmd), path)
+                os.remove(path)
+
+
+# ================ STORE ================
+def open_store(path=None):
+    # open the results store, creating its tables if they don't exist yet
+    store = sqlite3.connect(path or g_store_path)
+    store.executescript(g_schema)
+    # stores made before runs had a source column get one
+    if 'source' not in [column[1] for column in store.execute('PRAGMA table_info(runs)')]:
+        store.execute('ALTER TABLE runs ADD COLUMN source TEXT')
+    return store
+
+def store_run(store, run, full_cmd, total_cpu_time=None, source=None):
+    # append a run's metadata, returns its id
+    # a run imported from the csv at source has no known config and is dated by when the file was last written
+    host_string, variable, value, j = run
+    if source is None:
+        config_hash, finished = g_config_hash, time.time()
+    else:
+        config_hash, finished = None, os.path.getmtime(source)
+    return store.execute(
+        'INSERT INTO runs (host, variable, value, round, config_hash, command, finished, total_runtime, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (host_string, variable, value, j, config_hash, full_cmd, finished, total_cpu_time, source)
+    ).lastrowid
+
+def store_pings(store, run_id, pings, columns):
+    # append a run's pings, columns names the metrics each ping holds in order
+    names = ', '.join(f'"{column}"' for column in columns)
+    store.executemany(
+        f'INSERT INTO pings (run, seq, {names}) VALUES (?, ?{", ?" * len(columns)})',
+        [(run_id, seq) + tuple(ping) for seq, ping in enumerate(pings)]
+    )
+
+def store_congestion(store, run_id, path):
+    # append the droplet counts the simulation exported for a gene-length run
+    d = pandas.read_csv(path).to_dict('records')[0]
+    store.execute(
+        'INSERT INTO congestion (run, total_droplets, max_droplets, max_congestion) VALUES (?, ?, ?, ?)',
+        (run_id, d['total droplets'], d['max droplets'], d['max congestion'])
+    )
+
+def store_calls(store, run_id, path):
+    # append the call table the simulation's --profile option wrote
+    rows = pandas.read_csv(path).to_dict('records')
+    store.executemany(
+        'INSERT INTO calls (run, id, grp, calls, time) VALUES (?, ?, ?, ?, ?)',
+        [(run_id, row['Id'], row['group'], row['calls'], row['time']) for row in rows]
+    )
+
+def save_run(run, full_cmd, pings, target_metrics, total_cpu_time):
+    # store a pinged run; a gene-length run also picks up the congestion csv the simulation wrote, which is then removed
+    host_string, variable, value, j = run
+    congestion_path = f'raw-data/{host_string}/cg-{value}-{j}.csv'
+    with g_store_lock, closing(open_store()) as store, store:
+        run_id = store_run(store, run, full_cmd, total_cpu_time)
+        store_pings(store, run_id, pings, target_metrics + g_schedule_columns)
+        if variable == 'gene-length' and os.path.exists(congestion_path):
+            store_congestion(store, run_id, congestion_path)
+    if variable == 'gene-length' and os.path.exists(congestion_path):
+        os.remove(congestion_path)
+
+def import_raw_data(store, raw_data_path):
+    # load the csvs of earlier versions of the benchmarker, one file per run, into the store
+    # the files are left where they are, and files imported before are skipped, so importing again adds nothing twice
+    pattern = re.compile(r'(hw|gs|gl|ps)-?(.*)-(\d+)\.csv$')
+    variables = {prefix: variable for variable, prefix in g_prefixes.items()}
+    count = 0
+    for machine in sorted(os.listdir(raw_data_path)):
         machine_path = os.path.join(raw_data_path, machine)
-        if os.path.isdir(machine_path):
-            for file in os.listdir(machine_path):
-                if matcher(machine, file):
-                    label = labeler(machine, file)
-                    label_file_pairs.append(
-                        (label, os.path.join(machine_path, file))
-                    )
-
-    # prepare sorter by first sorting on round number
-    label_file_pairs.sort(key=lambda ele: ele[0].split('.csv')[0][-1])
-
-    # sort files
-    if sorter:
-        label_file_pairs.sort(key=sorter)
-
-    # import data
-    label_data_pairs = []
-    for label_file_pair in label_file_pairs:
-        label = label_file_pair[0]
-        label_file = label_file_pair[1]
-        label_data = pandas.read_csv(label_file).to_dict('records')
-        label_data_pairs.append((label, label_data))
-
-    return label_data_pairs
-
-def format_runtime_data(title, header, data, path):
-    # format data
-    formatted_data = header
-    runtimes = []
-    for d in data:
-        runtimes.append(d[0]['total-runtime'])
-    formatted_data.append(tuple(runtimes))
+        if not os.path.isdir(machine_path):
+            continue
+        for file in sorted(os.listdir(machine_path)):
+            match = pattern.match(file)
+            if not match:
+                continue
+            prefix, value, j = match.groups()
+            value = int(value) if value.isdigit() else (value or None)
+            run = (machine, variables[prefix], value, int(j))
+            path = os.path.join(machine_path, file)
+            if store.execute('SELECT 1 FROM runs WHERE source = ?', (path, )).fetchone():
+                continue
+            if prefix == 'ps':
+                store_calls(store, store_run(store, run, None, source=path), path)
+            else:
+                data = pandas.read_csv(path)
+                total_cpu_time = float(data.pop('total-runtime')[0])
+                run_id = store_run(store, run, None, total_cpu_time, source=path)
+                store_pings(store, run_id, data.to_dict('split')['data'], list(data.columns))
+                congestion_path = os.path.join(machine_path, f'cg-{value}-{j}.csv')
+                if prefix == 'gl' and os.path.exists(congestion_path):
+                    store_congestion(store, run_id, congestion_path)
+            count += 1
+    store.commit()
+    return count
+
+
+# ================ FORMATTING ================
+def latest_runs(store, variable, host_string=None):
+    # the latest run of the variable for every value and round, as (label, run id, total runtime), in plotting order
+    # runs are only ever appended, so an earlier run of the same value and round is superseded like an overwritten file
+    # latest goes by when the run finished, not by when it was added, so importing old csvs can't supersede newer runs
+    query = (
+        'SELECT host, value, round, id, total_runtime FROM ('
+        'SELECT *, ROW_NUMBER() OVER (PARTITION BY host, variable, value, round ORDER BY finished DESC, id DESC) AS recency '
+        'FROM runs) WHERE recency = 1 AND variable = ?'
+    )
+    parameters = [variable]
+    if host_string is not None:
+        query += ' AND host = ?'
+        parameters.append(host_string)
+    if variable == 'hardware':
+        query += ' ORDER BY round, host'
+        labeler = lambda host, value, j : f'{host}-{j}'
+    else:
+        query += ' ORDER BY CAST(value AS INTEGER), value, round'
+        labeler = lambda host, value, j : f'{value}-{j}'
+    return [ (labeler(host, value, j), run_id, runtime) for host, value, j, run_id, runtime in store.execute(query, parameters) ]
+
+def per_run(store, runs, aggregate):
+    # an aggregate over the pings of each run, e.g. 'MAX(res)'
+    return tuple(
+        store.execute(f'SELECT {aggregate} FROM pings WHERE run = ?', (run_id, )).fetchone()[0]
+        for _, run_id, _ in runs
+    )
 
-    # export data
+def export(formatted_data, path, title):
     pandas.DataFrame(formatted_data).to_csv(
         f'{path+title}.csv',
         index=False,
         header=False
     )
 
-def format_mem_data(title, header, data, path, mem_label):
-    # format data
+def format_runtime_data(title, header, runs, path):
+    formatted_data = header
+    formatted_data.append(tuple(runtime for _, _, runtime in runs))
+    export(formatted_data, path, title)
+
+def format_mem_data(title, header, store, runs, path, mem_label):
+    # one row per ping, holding its time and its run's memory in that run's column
     formatted_data = header
     labels = header[1]
     mems = []
-    for i, d in enumerate(data):
-        for row in d:
+    for i, (_, run_id, _) in enumerate(runs):
+        for time_plus, mem in store.execute(f'SELECT "time+", "{mem_label}" FROM pings WHERE run = ? ORDER BY seq', (run_id, )):
             nan_list = [numpy.nan for _ in range(len(labels))]
-            nan_list[0] = row['time+']
-            nan_list[i+1] = row[mem_label]
+            nan_list[0] = time_plus
+            nan_list[i+1] = mem
             mems.append(tuple(nan_list))
 
     # sort runtime-memory pairs by runtime
     mems.sort(key=lambda ele: ele[0])
 
     formatted_data += mems
+    export(formatted_data, path, title)
 
-    # export data
-    pandas.DataFrame(formatted_data).to_csv(
-        f'{path+title}.csv',
-        index=False,
-        header=False
-    )
-
-def format_peak_mem_data(title, header, data, path, mem_label):
-     # format data
+def format_peak_mem_data(title, header, store, runs, path, mem_label):
     formatted_data = header
-    peak_mems = []
-    for d in data:
-        mems = []
-        for row in d:
-            mems.append(row[mem_label])
-        peak_mems.append(max(mems))
-    formatted_data.append(tuple(peak_mems))
-
-    # export data
-    pandas.DataFrame(formatted_data).to_csv(
-        f'{path+title}.csv',
-        index=False,
-        header=False
-    )
+    formatted_data.append(per_run(store, runs, f'MAX("{mem_label}")'))
+    export(formatted_data, path, title)
 
-def format_avg_cpu_data(title, header, data, path):
-    # format data
+def format_avg_cpu_data(title, header, store, runs, path):
     formatted_data = header
-    avg_cpus = []
-    for d in data:
-        cpus = []
-        for row in d:
-            cpus.append(row['%cpu'])
-        avg_cpus.append(sum(cpus)/len(cpus))
-    formatted_data.append(tuple(avg_cpus))
-
-    # export data
-    pandas.DataFrame(formatted_data).to_csv(
-        f'{path+title}.csv',
-        index=False,
-        header=False
-    )
-
-def format_hardware_data(raw_data_path, formatted_data_path, target_metrics):
-    matcher = lambda _, file: 'hw' in file
-    labeler = lambda machine, file: f"{machine}-{file.split('.csv')[0][-1]}"
-    sorter = None
-
-    machine_data_pairs = import_data(raw_data_path, matcher, labeler, sorter)
+    formatted_data.append(per_run(store, runs, 'AVG("%cpu")'))
+    export(formatted_data, path, title)
 
-    # format and export data
-    labels = tuple([ pair[0] for pair in machine_data_pairs ])
-    data = [ pair[1] for pair in machine_data_pairs ]
-    path = formatted_data_path+'hardware/'
+def format_variable_data(store, variable, description, path, target_metrics, host_string=None):
+    # format the runs of one independent variable, description is e.g. 'gridsize vs. {} (hw=...)'
+    runs = latest_runs(store, variable, host_string)
+    labels = tuple(label for label, _, _ in runs)
     if 'time+' in target_metrics:
         format_runtime_data(
-            'hardware-v-runtime', 
-            [ (f'hardware vs. runtime (gs={g_const_gridsize})', ), labels ],
-            data, path
+            f'{variable}-v-runtime',
+            [ (description.format('runtime'), ), labels ],
+            runs, path
         )
     if any(metric in g_memory_targets for metric in target_metrics):
         mem_label = next(metric for metric in target_metrics if metric in g_memory_targets)
         format_mem_data(
-            'hardware-v-mem', 
+            f'{variable}-v-mem',
             [
-                (f'hardware vs. memory (gs={g_const_gridsize})', ),
+                (description.format('memory'), ),
                 ('time+', ) + labels
             ],
-            data, path, mem_label
+            store, runs, path, mem_label
         )
         format_peak_mem_data(
-            'hardware-v-peak-mem', 
-            [ (f'hardware vs. peak memory (gs={g_const_gridsize})', ), labels ],
-            data, path, mem_label
+            f'{variable}-v-peak-mem',
+            [ (description.format('peak memory'), ), labels ],
+            store, runs, path, mem_label
         )
     if '%cpu' in target_metrics:
         format_avg_cpu_data(
-            'hardware-v-avg-cpu', 
-            [ (f'hardware vs. avg cpu % (gs={g_const_gridsize})', ), labels ],
-            data, path
+            f'{variable}-v-avg-cpu',
+            [ (description.format('avg cpu %'), ), labels ],
+            store, runs, path
         )
 
-def format_gridsize_data(raw_data_path, formatted_data_path, target_metrics, host_string):
-    matcher = lambda machine, file : machine == g_const_machine and 'gs' in file
-    labeler = lambda _, file : f"{file.split('-')[1]}-{file.split('.csv')[0][-1]}"
-    sorter = lambda ele : int(ele[0].split('-')[0])
-
-    gridsize_data_pairs = import_data(raw_data_path, matcher, labeler, sorter)
-
-    # format and export data
-    labels = tuple([ pair[0] for pair in gridsize_data_pairs ])
-    data = [ pair[1] for pair in gridsize_data_pairs ]
-    path = f'{formatted_data_path+host_string}/'
-    if 'time+' in target_metrics:
-        format_runtime_data(
-            'gridsize-v-runtime', 
-            [ (f'gridsize vs. runtime (hw={g_const_machine})', ), labels ],
-            data, path
-        )
-    if any(metric in g_memory_targets for metric in target_metrics):
-        mem_label = next(metric for metric in target_metrics if metric in g_memory_targets)
-        format_mem_data(
-            'gridsize-v-mem', 
-            [
-                (f'gridsize vs. memory (hw={g_const_machine})', ),
-                ('time+', ) + labels
-            ],
-            data, path, mem_label
-        )
-        format_peak_mem_data(
-            'gridsize-v-peak-mem', 
-            [ (f'gridsize vs. peak memory (hw={g_const_machine})', ), labels ],
-            data, path, mem_label
-        )
-    if '%cpu' in target_metrics:
-        format_avg_cpu_data(
-            'gridsize-v-avg-cpu', 
-            [ (f'gridsize vs. avg cpu % (hw={g_const_machine})', ), labels ],
-            data, path
-        )
-
-def format_gene_length_data(raw_data_path, formatted_data_path, target_metrics, host_string):
-    matcher = lambda machine, file : machine == g_const_machine and 'gl' in file
-    labeler = lambda _, file : f"{file.split('-')[1]}-{file.split('.csv')[0][-1]}"
-    sorter = lambda ele : int(ele[0].split('-')[0])
+def format_hardware_data(store, formatted_data_path, target_metrics):
+    format_variable_data(
+        store, 'hardware', f'hardware vs. {{}} (gs={g_const_gridsize})',
+        formatted_data_path+'hardware/', target_metrics
+    )
 
-    gene_length_data_pairs = import_data(raw_data_path, matcher, labeler, sorter)
+def format_gridsize_data(store, formatted_data_path, target_metrics, host_string):
+    format_variable_data(
+        store, 'gridsize', f'gridsize vs. {{}} (hw={g_const_machine})',
+        f'{formatted_data_path+host_string}/', target_metrics, g_const_machine
+    )
 
-    # format and export data
-    labels = tuple([ pair[0] for pair in gene_length_data_pairs ])
-    data = [ pair[1] for pair in gene_length_data_pairs ]
-    path = f'{formatted_data_path+host_string}/'
-    if 'time+' in target_metrics:
-        format_runtime_data(
-            'gene-length-v-runtime', 
-            [ (f'gene length vs. runtime (hw={g_const_machine})', ), labels ],
-            data, path
-        )
-    if any(metric in g_memory_targets for metric in target_metrics):
-        mem_label = next(metric for metric in target_metrics if metric in g_memory_targets)
-        format_mem_data(
-            'gene-length-v-mem', 
-            [
-                (f'gene length vs. memory (hw={g_const_machine})', ),
-                ('time+', ) + labels
-            ],
-            data, path, mem_label
-        )
-        format_peak_mem_data(
-            'gene-length-v-peak-mem', 
-            [ (f'gene length vs. peak memory (hw={g_const_machine})', ), labels ],
-            data, path, mem_label
-        )
-    if '%cpu' in target_metrics:
-        format_avg_cpu_data(
-            'gene-length-v-avg-cpu', 
-            [ (f'gene length vs. avg cpu % (hw={g_const_machine})', ), labels ],
-            data, path
-        )
+def format_gene_length_data(store, formatted_data_path, target_metrics, host_string):
+    format_variable_data(
+        store, 'gene-length', f'gene length vs. {{}} (hw={g_const_machine})',
+        f'{formatted_data_path+host_string}/', target_metrics, g_const_machine
+    )
 
-def format_congestion_data(raw_data_path, formatted_data_path, host_string):
-    matcher = lambda machine, file : machine == g_const_machine and 'cg' in file
-    labeler = lambda _, file : f"{file.split('-')[1]}-{file.split('.csv')[0][-1]}"
-    sorter = lambda ele : int(ele[0].split('-')[0])
-    
-    congestion_data_pairs = import_data(raw_data_path, matcher, labeler, sorter)
-    
-    # format data
-    labels = ('total droplets', 'max droplets', 'max congestion')
-    data = [ pair[1] for pair in congestion_data_pairs ]
-    path = f'{formatted_data_path+host_string}/'
-    title = 'gene-length-v-congestion'
-    header = [
+def format_congestion_data(store, formatted_data_path, host_string):
+    runs = latest_runs(store, 'gene-length', g_const_machine)
+    formatted_congestion_data = [
         (f'gene length vs. congestion (hw={g_const_machine}, gs={g_const_gridsize})', ),
-        labels
+        ('total droplets', 'max droplets', 'max congestion')
     ]
-    
-    formatted_congestion_data = header
-    for d in data:
-        congestion = (
-            d[0]['total droplets'],
-            d[0]['max droplets'],
-            d[0]['max congestion']
-        )
-        formatted_congestion_data.append(congestion)
-    formatted_congestion_data = tuple(formatted_congestion_data)
-
-    # export data
-    pandas.DataFrame(formatted_congestion_data).to_csv(
-        f'{path+title}.csv',
-        index=False,
-        header=False
-    )
+    for _, run_id, _ in runs:
+        congestion = store.execute('SELECT total_droplets, max_droplets, max_congestion FROM congestion WHERE run = ?', (run_id, )).fetchone()
+        if congestion:
+            formatted_congestion_data.append(congestion)
+    export(tuple(formatted_congestion_data), f'{formatted_data_path+host_string}/', 'gene-length-v-congestion')
+
+def format_problem_size_data(store, formatted_data_path, host_string):
+    # split the total time like the paper: the lab advancing, routing, and everything else
+    formatted_data = [
+        (f'problem size vs. subroutine time (hw={g_const_machine})', ),
+        ('gridsize', 'gene length', 'round', 'Total', 'Advance', 'Route Droplets', 'Other')
+    ]
+    for label, run_id, _ in latest_runs(store, 'problem-size', g_const_machine):
+        times = dict(store.execute('SELECT id, time FROM calls WHERE run = ?', (run_id, )))
+        total = times.get('Tutorial.Run_Scenario', max(times.values()))
+        advance = times.get('Lab.Lab.Advance', 0)
+        route = times.get('Scheduler.Scheduler.Route_Droplets', 0)
+        formatted_data.append(tuple(label.split('-')) + (total, advance, route, round(total - advance - route, 6)))
+    export(formatted_data, f'{formatted_data_path+host_string}/', 'problem-size-v-subroutine-time')
 
 # ================ MAIN ================ 
 def main():
@@ -515,15 +572,33 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'option',
-        choices=['all', 'hardware', 'gridsize', 'gene-length'],
+        choices=['all', 'hardware', 'gridsize', 'gene-length', 'problem-size', 'import'],
         type=str,
-        help='benchmark all independent variables, hardware, gridsize, or gene-length',
+        help='benchmark all independent variables, hardware, gridsize, or gene-length, profile subroutines across problem sizes, '
+             'or import the csvs of earlier versions from raw-data into the store',
     )
     parser.add_argument(
         'cmd',
         type=str,
+        nargs='?',
         help='the command to be benchmarked',
     )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='run up to this many simulations at once, each pinned to its own core',
+    )
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        help='run the simulations one at a time on a core of their own, for timing-critical measurements',
+    )
+    parser.add_argument(
+        '--sample',
+        action='store_true',
+        help='have the simulations sample their own stacks, writing collapsed stacks next to the raw data',
+    )
     args = parser.parse_args()
 
 
@@ -531,9 +606,6 @@ def main():
     cmd = args.cmd
     option = args.option
 
-    # memory type to use as memory metric
-    mem_label = g_targets
-
     # data paths
     raw_data_path = 'raw-data/'
     formatted_data_path = 'formatted-data/'
@@ -562,6 +634,21 @@ def main():
         shell=True
     )
 
+    store = open_store()
+
+    if option == 'import':
+        count = import_raw_data(store, raw_data_path)
+        print(f'\nImported {count} runs into \'{g_store_path}\'.\n')
+        format_hardware_data(store, formatted_data_path, g_target_metrics)
+        format_gridsize_data(store, formatted_data_path, g_target_metrics, host_string)
+        format_gene_length_data(store, formatted_data_path, g_target_metrics, host_string)
+        format_congestion_data(store, formatted_data_path, host_string)
+        format_problem_size_data(store, formatted_data_path, host_string)
+        return
+
+    if cmd is None:
+        parser.error('the command to be benchmarked is required')
+
     print(f'\nProfiling \'{cmd}\'.\n')
 
     variable_count = 0
@@ -569,28 +656,31 @@ def main():
     # option handling
     if option == 'all':
         variable_count = 3
-        profile_hardware(variable_count, 1, cmd, g_target_metrics, host_string)
-        profile_gridsize(variable_count, 2, cmd, g_target_metrics, host_string)
-        profile_gene_length(variable_count, 3, cmd, g_target_metrics, host_string)
-
-        format_hardware_data(raw_data_path, formatted_data_path, g_target_metrics)
-        format_gridsize_data(raw_data_path, formatted_data_path, g_target_metrics, host_string)
-        format_gene_length_data(raw_data_path, formatted_data_path, g_target_metrics, host_string)
-        format_congestion_data(raw_data_path, formatted_data_path, host_string)
+        profile_hardware(variable_count, 1, cmd, g_target_metrics, host_string, args.jobs, args.quiet, args.sample)
+        profile_gridsize(variable_count, 2, cmd, g_target_metrics, host_string, args.jobs, args.quiet, args.sample)
+        profile_gene_length(variable_count, 3, cmd, g_target_metrics, host_string, args.jobs, args.quiet, args.sample)
+
+        format_hardware_data(store, formatted_data_path, g_target_metrics)
+        format_gridsize_data(store, formatted_data_path, g_target_metrics, host_string)
+        format_gene_length_data(store, formatted_data_path, g_target_metrics, host_string)
+        format_congestion_data(store, formatted_data_path, host_string)
     else:
         variable_count = 1
         if option == 'hardware':
-          profile_hardware(variable_count, 1, cmd, g_target_metrics, host_string)
-          format_hardware_data(raw_data_path, formatted_data_path, g_target_metrics)
+          profile_hardware(variable_count, 1, cmd, g_target_metrics, host_string, args.jobs, args.quiet, args.sample)
+          format_hardware_data(store, formatted_data_path, g_target_metrics)
         if option == 'gridsize':
-          profile_gridsize(variable_count, 1, cmd, g_target_metrics, host_string)
-          format_gridsize_data(raw_data_path, formatted_data_path, g_target_metrics, host_string)
+          profile_gridsize(variable_count, 1, cmd, g_target_metrics, host_string, args.jobs, args.quiet, args.sample)
+          format_gridsize_data(store, formatted_data_path, g_target_metrics, host_string)
         if option == 'gene-length':
-          profile_gene_length(variable_count, 1, cmd, g_target_metrics, host_string)
-          format_gene_length_data(raw_data_path, formatted_data_path, g_target_metrics, host_string)
-          format_congestion_data(raw_data_path, formatted_data_path, host_string)
-
-    print('\nProfiling done. See \'raw-data\' for raw output. See \'formatted-data\' for formatted output.\n')
+          profile_gene_length(variable_count, 1, cmd, g_target_metrics, host_string, args.jobs, args.quiet, args.sample)
+          format_gene_length_data(store, formatted_data_path, g_target_metrics, host_string)
+          format_congestion_data(store, formatted_data_path, host_string)
+        if option == 'problem-size':
+          profile_problem_size(variable_count, 1, cmd, host_string)
+          format_problem_size_data(store, formatted_data_path, host_string)
+
+    print(f'\nProfiling done. See \'{g_store_path}\' for raw output. See \'formatted-data\' for formatted output.\n')
 
 
 if __name__ == '__main__':      # entry point
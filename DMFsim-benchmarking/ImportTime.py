@@ -0,0 +1,100 @@
+import os               # finding the simulation modules
+import ast              # reading the simulation's imports
+import sys              # exiting
+import subprocess       # running the import in a fresh interpreter
+import time             # timing
+import json             # reading the child's report
+import argparse
+import statistics
+
+
+# ================ CONSTANTS ================
+
+""" The script whose top-level imports of simulation modules make up a headless run's imports. """
+g_entry_script = 'Tutorial.py'
+""" Modules that only the GUI should ever need. If a headless import pulls any of
+these in, the visualization is no longer being loaded lazily. """
+g_gui_modules = ['matplotlib', 'tkinter']
+
+""" Script run in a fresh interpreter: times the core imports and reports which
+GUI modules ended up loaded. """
+g_child_script = (
+    'import sys, time, json\n'
+    'sys.path.insert(0, sys.argv[1])\n'
+    'start = time.perf_counter()\n'
+    'for module in sys.argv[2].split(","):\n'
+    '    __import__(module)\n'
+    'elapsed = time.perf_counter() - start\n'
+    'loaded = [m for m in sys.argv[3].split(",") if m in sys.modules]\n'
+    'print(json.dumps({"time": elapsed, "gui": loaded}))\n'
+)
+
+
+# ================ BENCHMARKING ================
+def core_modules(sim_path):
+    # the simulation modules the entry script imports at the top level, read from its source so the list can't go stale
+    # the modules those import in turn, e.g. AStar, are loaded and timed along with them
+    with open(os.path.join(sim_path, g_entry_script)) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        modules += [name for name in names if os.path.exists(os.path.join(sim_path, f'{name}.py'))]
+    return modules
+
+def time_import(sim_path, modules):
+    # run the imports in a fresh interpreter so nothing is cached
+    completed_process = subprocess.run(
+        [sys.executable, '-c', g_child_script, sim_path, ','.join(modules), ','.join(g_gui_modules)],
+        capture_output=True
+    )
+    if completed_process.returncode != 0:
+        print(completed_process.stderr.decode())
+        sys.exit(1)
+    return json.loads(completed_process.stdout.decode().strip().split('\n')[-1])
+
+def time_interpreter():
+    # time a bare interpreter launch, for reference
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    return time.perf_counter() - start
+
+
+# ================ MAIN ================
+def main():
+
+    parser = argparse.ArgumentParser(description='time the headless simulation imports and check that no GUI modules are loaded')
+    parser.add_argument('--sim-path', type=str, default='DMFsim', help='the directory containing the simulation modules')
+    parser.add_argument('--rounds', type=int, default=10, help='the number of fresh interpreters to time')
+    parser.add_argument('--limit', type=float, help='fail if the median import time exceeds this many seconds')
+    args = parser.parse_args()
+
+    modules = core_modules(args.sim_path)
+    print(f'core modules: {", ".join(modules)}')
+    reports = [time_import(args.sim_path, modules) for _ in range(args.rounds)]
+    import_times = [report['time'] for report in reports]
+    launch_times = [time_interpreter() for _ in range(args.rounds)]
+    gui_loaded = sorted(set(module for report in reports for module in report['gui']))
+
+    print(f'interpreter launch (median): {statistics.median(launch_times):.4f} s')
+    print(f'core import (median):        {statistics.median(import_times):.4f} s')
+    print(f'core import (min, max):      {min(import_times):.4f} s, {max(import_times):.4f} s')
+
+    failed = False
+    if gui_loaded:
+        print(f'FAIL: headless import loaded GUI modules: {", ".join(gui_loaded)}')
+        failed = True
+    if args.limit is not None and statistics.median(import_times) > args.limit:
+        print(f'FAIL: median import time exceeds the limit of {args.limit} s')
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':      # entry point
+    main()
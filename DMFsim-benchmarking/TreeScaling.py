@@ -0,0 +1,64 @@
+import sys              # exiting, module path
+import os               # module path
+import time             # timing
+import random           # random genes
+import argparse
+import statistics
+
+
+# ================ CONSTANTS ================
+
+""" The symbols that the random genes are drawn from, in the same form that Tutorial.py uses. """
+g_symbols = ['_S{}_'.format(i) for i in range(16)]
+""" The gene lengths timed when none are given on the command line. """
+g_default_lengths = [1000, 2000, 4000, 8000, 16000, 32000]
+
+
+# ================ BENCHMARKING ================
+def time_build(Int, length, gibson_limit, linkernum, rounds):
+    # build the tree for a fresh random gene of the given length, keeping the fastest round
+    times = []
+    for _ in range(rounds):
+        data = [random.choice(g_symbols) for _ in range(length)]
+        start = time.perf_counter()
+        Int.Build_Tree(data, gibson_limit, linkernum=linkernum)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# ================ MAIN ================
+def main():
+
+    parser = argparse.ArgumentParser(description='time assembly tree construction for increasingly long genes and check that it scales linearly')
+    parser.add_argument('--sim-path', type=str, default='DMFsim', help='the directory containing the simulation modules')
+    parser.add_argument('--gene-lengths', type=int, nargs='+', default=g_default_lengths, help='the gene lengths to time')
+    parser.add_argument('--gibson-limit', type=int, default=3, help='the number of strands attached at a time')
+    parser.add_argument('--linkernum', type=int, default=50, help='the number of linkers available')
+    parser.add_argument('--rounds', type=int, default=3, help='the number of trees built per gene length')
+    parser.add_argument('--seed', type=int, default=42, help='the seed for the random genes')
+    parser.add_argument('--max-growth', type=float, help='fail if the time per symbol of the longest gene exceeds that of the shortest by more than this factor')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.sim_path))
+    import Interpreter as Int
+    random.seed(args.seed)
+
+    per_symbol = []
+    for length in sorted(args.gene_lengths):
+        elapsed = time_build(Int, length, args.gibson_limit, args.linkernum, args.rounds)
+        per_symbol.append(elapsed / length)
+        print(f'gene length {length:>8}: {elapsed:.4f} s, {1e6 * elapsed / length:.2f} us/symbol')
+
+    growth = per_symbol[-1] / per_symbol[0]
+    print(f'per-symbol growth (longest / shortest): {growth:.2f}')
+    print(f'per-symbol time (median):               {1e6 * statistics.median(per_symbol):.2f} us')
+
+    failed = args.max_growth is not None and growth > args.max_growth
+    if failed:
+        print(f'FAIL: per-symbol time grew by more than a factor of {args.max_growth}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':      # entry point
+    main()
@@ -19,19 +19,32 @@ import copy
 import time
 dist_weight = 2
 
+class Route_Limit_Exceeded(AssertionError):
+    #Raised when a route search takes more steps than its step limit allows.
+    #Records how many steps were spent, so that callers can charge them against a routing budget.
+    def __init__(self, message, steps):
+        super().__init__(message)
+        self.steps = steps
 
 def Get_Route(grid_shape, start, end, dp_radius, blocked, prior_radius=0, perm_blocked=[], start_time=0, delay=0, limit=0):
     #Finds a route for a droplet with a given radius from start to end while avoiding blocks.
     #Instead of directly calculating a 3D route through timespace, calculates two 2D routes in succesion.
     
+    #The limit caps the total number of search steps taken by both searches together. A limit of 0 means no limit.
+    #If the limit is reached, Route_Limit_Exceeded is raised.
+    step_limit = limit if limit else float('inf')
+    
     #First, calculate a 2D route ignoring transient blocks and only avoiding the permanent blocks.
     #This iteration ignores the time dimension and moves freely in two spatial dimensions.
-    path, endpoint, visit_count = Single_Route_Without_Time(grid_shape=grid_shape, start=start, end=end, dp_radius=dp_radius, perm_blocked=perm_blocked)
+    path, endpoint, visit_count = Single_Route_Without_Time(grid_shape=grid_shape, start=start, end=end, dp_radius=dp_radius, perm_blocked=perm_blocked, step_limit=step_limit)
     
     #Now use that route as a reference path for a time-dependent route.
     #This iteration is allowed to move along one spatial dimension (progress along the route)
     #and one time dimension.
-    route, endpoint, more_visits = Single_Route_With_Time(grid_shape=grid_shape, start=start, end=end, dp_radius=dp_radius, blocked=blocked, prior_radius=prior_radius, perm_blocked=perm_blocked, start_time=start_time, delay=delay, reference_path=path)
+    try:
+        route, endpoint, more_visits = Single_Route_With_Time(grid_shape=grid_shape, start=start, end=end, dp_radius=dp_radius, blocked=blocked, prior_radius=prior_radius, perm_blocked=perm_blocked, start_time=start_time, delay=delay, step_limit=step_limit - visit_count, reference_path=path)
+    except Route_Limit_Exceeded as e:
+        raise Route_Limit_Exceeded(str(e), e.steps + visit_count)
 
     #Return a boolean indicating if the droplet could not route
     #plus the route itself, its endpoint, and the number of A* visits performed for data analysis purposes.
@@ -87,8 +100,8 @@ def Single_Route_With_Time(grid_shape, start, end, dp_radius, blocked, prior_rad
         if (steps + 1) % 100 == 0:
             # print(steps)
             pass
-        if steps >= step_limit:
-            raise AssertionError("Step limit reached during Dijkstra route after searching up to time = {}!".format(max([x[0] for x in visited])) + str(reference_path))
+        if steps > step_limit:
+            raise Route_Limit_Exceeded("Step limit reached during Dijkstra route after searching up to time = {}!".format(max([x[0] for x in visited], default=t)) + str(reference_path), steps - 1)
             
         #Find the minimum-scoring coordinate pair in the unvisited list
         #Use an A*-type ranking that incorporates an estimate of the distance from each point to the destination
@@ -210,9 +223,10 @@ def Single_Route_With_Time(grid_shape, start, end, dp_radius, blocked, prior_rad
     # print(steps)
     return path, endpoint, len(visited)
 
-def Single_Route_Without_Time(grid_shape, start, end, dp_radius, perm_blocked = [], prior_radius = 0):
+def Single_Route_Without_Time(grid_shape, start, end, dp_radius, perm_blocked = [], prior_radius = 0, step_limit = float('inf')):
     #Similar to the route with time function. Calculates a route from 'start' to 'end' while ignoring transient time-dependent blocks. Only avoids permanent blocks.
     #Uses an A* method with Manhattan-distance as a point selection heuristic to speed up the discovery of a valid route.
+    #Raises Route_Limit_Exceeded if more than step_limit points would have to be visited.
     
     endpoint = end
     visit_count = 0
@@ -239,6 +253,8 @@ def Single_Route_Without_Time(grid_shape, start, end, dp_radius, perm_blocked =
         
         #Select a point from the unvisited list that has the minimum combined score,
         #calculated from lapsed time and estimated distance from destination heuristic.
+        if visit_count >= step_limit:
+            raise Route_Limit_Exceeded("Step limit reached during static route from {} to {}!".format(start, end), visit_count)
         try:
             x,y = min(unvisited, key = lambda Q: Get_Score(Q, inf, scores)  + dist_weight*Dist(Q,end))
             visit_count += 1
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Saving and restoring the full state of a running simulation.
+
+A checkpoint is a versioned state record with one section for each part of the simulation:
+    'random'     the state of the random number generator, so a resumed run makes the same choices
+    'lab'        the settings the Lab was created with, and its time, droplets, history and counters
+    'grid'       the occupied gridpoints, i.e. those holding droplets, running instructions or claimed by a node
+    'scheduler'  the assembly tree's nodes, the Scheduler's progress through them and its counters
+    'parking'    the parking slots that shunting droplets have claimed
+The record is written as a gzipped pickle, so droplets and nodes that refer to each other are stored once.
+Gridpoints only keep the fields that differ from a fresh gridpoint.
+
+Nothing that can be worked out from the rest is stored. On loading, a fresh Lab is built from its settings and the
+occupied gridpoints are put back into its grid. The neighbor lists, the sets of active gridpoints, the route
+footprint counts, the site indexes and the parking slot lattices are then rebuilt. The blocks each droplet faced
+on its last routing are dropped too, since they are worked out anew before each droplet is routed.
+
+Checkpoints are written by Scheduler.Compile_Instructions when it is given a checkpoint interval. To resume
+or branch off a variant experiment, load a checkpoint and call Compile_Instructions again with resume = True:
+
+    sch = Load_Checkpoint('run-200.ckpt')
+    sch.Compile_Instructions(resume = True)
+
+"""
+import gzip
+import os
+import pickle
+import random
+
+from Lab import Lab, Gridpoint
+
+format_version = 5
+
+#The arguments the Lab was created with. A fresh Lab is built from these when a checkpoint is loaded.
+lab_settings = ['grid_dim', 'grid_spacing', 'inst_capable_locations', 'pull_data', 'record_congestion', 'alpha', 'beta', 'verbose',
+                'keep_history', 'reactions']
+
+#The parts of the Lab that are rebuilt rather than stored. The outbox and the tick timing belong to
+#the run in progress and are set again by the Scheduler when it carries on.
+lab_derived = ['grid', 'route_footprint', 'energized', 'processing', 'outbox', 'timing']
+
+#The parts of the Scheduler that are rebuilt from its lab and inputs rather than stored.
+scheduler_derived = ['lab', 'grid_dim', 'all_sites', 'parking', 'sites', 'debug']
+
+#The gridpoint fields that change as the simulation runs. A gridpoint is occupied if any of them differs from a fresh gridpoint.
+occupancy_fields = ['state_inst', 'runtime', 'droplets', 'residues', 'in_process', 'potential', 'reactions',
+                    'occluded_by', 'is_forbidden', 'selected_by', 'pulled_by', 'targeted_by']
+
+def Is_Occupied(gp):
+    #Returns True if the gridpoint is in any way different from an idle one.
+    if Gridpoint.defaults is None:
+        Gridpoint.defaults = Gridpoint(1, (0, 0)).__dict__
+    return any(getattr(gp, field) != Gridpoint.defaults[field] for field in occupancy_fields)
+
+def Save_Checkpoint(sch, path):
+    #Writes the state record of the scheduler, its lab and node tree, and the random number generator to the given path.
+    #The file is written to a temporary name first so that a crash mid-write never destroys the previous checkpoint.
+    lab = sch.lab
+    state = {
+        'version': format_version,
+        'random': random.getstate(),
+        'lab': {
+            'settings': dict((field, getattr(lab, field)) for field in lab_settings),
+            'state': dict((field, value) for field, value in lab.__dict__.items() if field not in lab_settings + lab_derived),
+        },
+        'grid': [gp for gp in lab.grid.values() if Is_Occupied(gp)],
+        'scheduler': dict((field, value) for field, value in sch.__dict__.items() if field not in scheduler_derived),
+        'parking': sch.parking.parked,
+    }
+    temp_path = path + '.tmp'
+    with gzip.open(temp_path, 'wb', compresslevel = 6) as f:
+        pickle.dump(state, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+def Load_Checkpoint(path, restore_random = True):
+    #Reads a checkpoint and returns its scheduler. The lab is available as the scheduler's lab attribute.
+    #Unless restore_random is False, the random number generator is put back into its state at the time of the checkpoint.
+    with gzip.open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != format_version:
+        raise ValueError('Checkpoint {} has format version {}, expected {}.'.format(path, state.get('version'), format_version))
+
+    #The Scheduler module saves checkpoints itself, so it is only imported once both modules are loaded
+    from Scheduler import Scheduler
+    lab = Restore_Lab(state['lab'], state['grid'])
+
+    #The scheduler's indexes are built from the lab exactly as they were for the original run
+    sch = Scheduler.__new__(Scheduler)
+    sch.__dict__.update(state['scheduler'])
+    sch.lab = lab
+    sch.grid_dim = lab.grid_dim
+    sch.debug = None
+    sch.Index_Sites()
+    sch.parking.parked = state['parking']
+
+    if restore_random:
+        random.setstate(state['random'])
+    return sch
+
+def Restore_Lab(record, grid):
+    #Builds a fresh lab from the recorded settings and fills in the recorded state and occupied gridpoints.
+    lab = Lab(**record['settings'])
+    lab.__dict__.update(record['state'])
+
+    #The stored gridpoints are the ones the droplets and nodes refer to, so they replace the fresh ones
+    for gp in grid:
+        lab.grid[gp.indices] = gp
+    for gp in lab.grid.values():
+        gp.Initialize_Neighbors(lab.grid)
+    lab.energized = set(gp for gp in grid if gp.potential != 0)
+    lab.processing = set(gp for gp in grid if gp.runtime is not None)
+
+    #Recount the planned routes of the droplets still on the lab
+    for dp in lab.droplets:
+        dp.footprint = lab.route_footprint
+        lab.route_footprint.Add(dp.footprint_steps, dp.footprint_offsets)
+    return lab
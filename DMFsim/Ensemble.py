@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Runs many simulation scenarios in parallel within a single Python session.
+
+Each scenario is a gridsize, gene length and seed. The scenarios are handed out to a pool of worker
+processes, each of which imports the simulation modules once and then calls Tutorial.Run_Scenario for
+every scenario it is given, so a sweep pays for interpreter startup and module imports once per worker
+rather than once per run. The per-scenario summaries are collected into a pandas DataFrame.
+With --tree-cache, the workers share one directory of assembly trees, so each distinct gene's tree is only built once.
+With --symbolic-chemistry, the runs skip the DNA chemistry. --verify-fraction then picks a share of the scenarios to
+run a second time with the full chemistry, and the 'verified' column says whether both runs came out the same.
+
+Example:
+    python Ensemble.py --gridsizes 40 50 --gene-lengths 3 5 --seeds 1 2 3 --output ensemble.csv
+
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#The workers import the simulation modules by their top-level names, same as Tutorial.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def Init_Worker():
+    #Runs once in each worker process. Loads the simulation modules up front so that
+    #the first scenario given to the worker doesn't pay for the imports.
+    import Tutorial
+
+def Run_One(scenario):
+    #Runs a single scenario in a worker process with all printing turned off.
+    import Tutorial
+    options = {'verbose': False, 'record_congestion': True}
+    options.update(scenario)
+    try:
+        #Scenarios marked for verification are run again with the full chemistry by Run_Scenario
+        return Tutorial.Run_Scenario(**options)
+    except Exception as e:
+        #Report the failure alongside the other results instead of losing the whole sweep
+        return {'gridsize': options.get('gridsize'), 'gene length': options.get('gene_length'),
+                'seed': options.get('seed'), 'success': False, 'error': repr(e)}
+
+def Make_Scenarios(gridsizes, gene_lengths, seeds, verify_fraction = 0, **options):
+    #Returns the list of scenarios covering every combination of the given gridsizes, gene lengths and seeds.
+    #With symbolic chemistry, about verify_fraction of the scenarios are marked to be checked against the full chemistry.
+    #The choice is seeded, so the same sweep always verifies the same scenarios.
+    scenarios = [dict(gridsize=g, gene_length=n, seed=s, **options) for g, n, s in itertools.product(gridsizes, gene_lengths, seeds)]
+    if options.get('symbolic_chemistry') and verify_fraction > 0:
+        rng = random.Random(0)
+        for scenario in scenarios:
+            scenario['verify'] = rng.random() < verify_fraction
+    return scenarios
+
+def Run_Ensemble(scenarios, workers = None, progress = False):
+    #Runs the scenarios across a pool of worker processes and returns a DataFrame with one row per scenario,
+    #in the same order as the scenarios were given.
+    import pandas
+
+    results = [None]*len(scenarios)
+    with ProcessPoolExecutor(max_workers=workers, initializer=Init_Worker) as pool:
+        futures = {pool.submit(Run_One, scenario): i for i, scenario in enumerate(scenarios)}
+        for done, future in enumerate(as_completed(futures)):
+            i = futures[future]
+            results[i] = future.result()
+            if progress:
+                print('Finished {} of {}: gridsize {}, gene length {}, seed {}'.format(
+                    done + 1, len(scenarios), results[i]['gridsize'], results[i]['gene length'], results[i]['seed']))
+    return pandas.DataFrame(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run a sweep of simulation scenarios across worker processes')
+    parser.add_argument('--gridsizes', type=int, nargs='+', default=[50], help='the gridsizes to simulate')
+    parser.add_argument('--gene-lengths', type=int, nargs='+', default=[5], help='the gene lengths to simulate')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[42], help='the seeds for the random lab layouts and genes')
+    parser.add_argument('--workers', type=int, help='the number of worker processes (defaults to the number of CPUs)')
+    parser.add_argument('--fast-forward', action='store_true', help='lets the lab run through time-steps that need no scheduling decisions in bulk')
+    parser.add_argument('--tree-cache', type=str, help='a directory of assembly trees shared by the workers')
+    parser.add_argument('--symbolic-chemistry', action='store_true', help='looks reaction outcomes up in the assembly tree instead of simulating the DNA')
+    parser.add_argument('--verify-fraction', type=float, default=0, help='the share of symbolic chemistry scenarios to check against the full chemistry')
+    parser.add_argument('--output', type=str, help='a CSV file to write the results to')
+    args = parser.parse_args()
+
+    scenarios = Make_Scenarios(args.gridsizes, args.gene_lengths, args.seeds, verify_fraction=args.verify_fraction,
+                               fast_forward=args.fast_forward, tree_cache=args.tree_cache, symbolic_chemistry=args.symbolic_chemistry)
+    df = Run_Ensemble(scenarios, workers=args.workers, progress=True)
+
+    if args.output:
+        df.to_csv(args.output, index=False)
+    else:
+        print(df.to_string(index=False))
@@ -17,7 +17,10 @@ can be compiled in parallel by the Scheduler. But a given node cannot be compile
 
 
 """
-from functools import reduce
+
+from contextlib import contextmanager
+import gc
+import heapq
 
 version = 1
 
@@ -31,12 +34,17 @@ def Linkers(linkernum = None):
         
 class Node():
     #This is the building-block of the assembly tree. Contains instructions for assembling one subset of the data.
+    #Nodes use slots rather than a per-node dictionary, since long genes make for very large trees.
+    __slots__ = ('data', 'children', 'depth', 'parent', 'inst_list', 'products',
+                 'droplets', 'timer', 'selected_sites', 'pulling_sites', 'inst_i', 'waiting', 'record', 'active_droplets', 'last_cleared')
+    
     def __init__(self, data = None, parent = None, inst_list = None):
         self.data = data
         self.children = []
         self.depth = 0
         self.parent = parent
         self.inst_list = inst_list
+        self.products = None    #The product of each Gibson instruction, keyed by its sorted reactant species
         
         #The variables below here are for future use by the router, not the interpreter
         self.droplets = {}  #Keeps track of the locations of the species used in this node
@@ -52,9 +60,10 @@ class Node():
         if parent is not None:
             parent.Add_Child(self)
             
-    def Set_Data(self, data, inst_list):
+    def Set_Data(self, data, inst_list, products = None):
         self.data = data
         self.inst_list = inst_list
+        self.products = products
         
     def Add_Child(self, child):
         self.children.append(child)
@@ -156,6 +165,20 @@ def Partition(arg,n):
     return output
 
             
+@contextmanager
+def Collection_Paused():
+    #Pauses the cyclic garbage collector for the duration of a with block.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+#Building a long gene's tree creates a great many linked objects that all stay in use. The garbage collector
+#would keep rescanning them as the tree grows, making construction superlinear, so collection is paused meanwhile.
+@Collection_Paused()
 def Build_Tree(data, n, linkernum=None):
     #Builds assembly tree and fills in the Node data, assembly instructions, etc.
     #This yields a data structure that encodes the dependency (or lack thereof) between
@@ -183,7 +206,6 @@ def Build_Tree(data, n, linkernum=None):
         for partition in node_partition:
             
             #Instantiate the parent node
-            parent_data = []
             parent = Node()
             
             #If there is only one node in the partition, just pass the data
@@ -195,10 +217,8 @@ def Build_Tree(data, n, linkernum=None):
             
             else:
                 for node in partition:
-                    #Compile the child's data for the parent
-                    parent_data += node.data
-                    
-                    #Add the child to the parent node
+                    #Add the child to the parent node.
+                    #Assemble reads the children's data directly, so it doesn't need to be copied up here.
                     parent.Add_Child(node)
                     
                 #Set the parent's data
@@ -227,7 +247,13 @@ def Build_Tree(data, n, linkernum=None):
     #Correct the depths in the tree
     root.Correct_Depths()
     
-    #Now we will assemble the nodelist
+    #Return the root node and the nodelist
+    return root, Level_List(root)
+    
+def Level_List(root):
+    #Returns the nodes of the tree grouped by depth, with the leaf nodes at index 0 and the root at the end.
+    #All of the leaves must be at the same depth.
+    
     #Start by getting the depth
     node = root
     while node.children != []:
@@ -244,9 +270,170 @@ def Build_Tree(data, n, linkernum=None):
         
     #Reverse the nodelist so that the leaf nodes are at index 0
     nodes.reverse()
+    return nodes
+            
+#Estimated time-steps for each instruction type, used by Build_Shaped_Tree to weigh different tree shapes.
+#The reactions run for 2 time-steps in the Scheduler. The moves include pulling fresh droplets from the
+#reservoirs and routing everything to a free site, so they take considerably longer.
+default_durations = {'Gibson_Move': 12, 'Gibson': 2, 'Purify_Move': 12, 'Purify': 2, 'PCR_Move': 12, 'PCR': 2}
+
+def Node_Duration(k, durations):
+    #Estimated time-steps for a node with k children to get through its instructions, which it runs one at a time.
+    node = Node()
+    for i in range(k):
+        node.Add_Child(Node(['']))
+    _, instructions, _ = Assemble(node, Linkers(2*k))
+    return sum(durations.get(inst[0], 0) for inst in instructions)
+
+def Split(m, k):
+    #Splits m consecutive symbols into k groups that are as even as possible, larger groups first.
+    return [m//k + (1 if i < m%k else 0) for i in range(k)]
+
+def Shape_Plan(m, n, cost):
+    #For every subtree size up to m, picks how many children (2 to n) the subtree's top node should have.
+    #The choice minimizes the subtree's critical path, i.e. its longest chain of dependent nodes, with ties
+    #going to the choice with the least total work. cost[k] is the duration of a node with k children.
+    #Returns the plan, indexed by size, and the total work of the whole tree.
+    best = [(0, 0)]*(m + 1)    #(critical path, total work) for each size. Single symbols are leaves and cost nothing.
+    plan = [0]*(m + 1)
+    for size in range(2, m + 1):
+        options = []
+        for k in range(2, min(n, size) + 1):
+            parts = Split(size, k)
+            options.append((cost[k] + best[parts[0]][0], cost[k] + sum(best[part][1] for part in parts), k))
+        path, work, plan[size] = min(options)
+        best[size] = (path, work)
+    return plan, best[m][1]
+
+def Estimate_Makespan(m, plan, cost, sites):
+    #Estimates when the tree given by the plan would be finished if at most `sites` nodes can work at once.
+    duration = []
+    parent = []
+    stack = [(m, -1)]
+    while stack:
+        size, par = stack.pop()
+        i = len(duration)
+        duration.append(cost[plan[size]])
+        parent.append(par)
+        stack += [(part, i) for part in Split(size, plan[size]) if part > 1]
+    return Schedule_Makespan(duration, parent, sites)
+
+def Estimate_Default_Makespan(m, n, cost, sites):
+    #Estimates, like Estimate_Makespan, when the tree Build_Tree makes for m symbols would be finished.
+    #Build_Tree groups each level's nodes n at a time from the left until n or fewer are left for the root.
+    #A group of one just passes its data up, which takes no time.
+    levels = []     #The number of children of each node, level by level from the bottom
+    width = m
+    while width > n:
+        levels.append([n]*(width//n) + ([width%n] if width%n else []))
+        width = len(levels[-1])
+    levels.append([width])
+    
+    duration = []
+    parent = []
+    parents = [-1]
+    for level in reversed(levels):
+        below = []
+        for k, par in zip(level, parents):
+            below += [len(duration)]*k
+            duration.append(cost.get(k, 0))
+            parent.append(par)
+        parents = below
+    return Schedule_Makespan(duration, parent, sites)
+
+def Schedule_Makespan(duration, parent, sites):
+    #Returns when a tree of nodes with the given durations would be finished if at most `sites` can work at once.
+    #parent[i] is the index of node i's parent, which always comes before it, or -1 for the root.
+    #Whenever a site is free, it goes to the ready node with the longest remaining path to the root.
+    outstanding = [0]*len(duration)
+    priority = []
+    for i, par in enumerate(parent):
+        if par >= 0:
+            outstanding[par] += 1
+        priority.append(duration[i] + (priority[par] if par >= 0 else 0))
+    priority = [-path for path in priority]
     
-    #Return the root node
-    return root, nodes    
+    ready = [(priority[i], i) for i in range(len(duration)) if outstanding[i] == 0]
+    heapq.heapify(ready)
+    running = []
+    time = 0
+    while ready or running:
+        while ready and len(running) < sites:
+            _, i = heapq.heappop(ready)
+            heapq.heappush(running, (time + duration[i], i))
+        time, i = heapq.heappop(running)
+        if parent[i] >= 0:
+            outstanding[parent[i]] -= 1
+            if outstanding[parent[i]] == 0:
+                heapq.heappush(ready, (priority[parent[i]], parent[i]))
+    return time
+
+def Build_Shaped_Tree(data, n, sites = 5, durations = None, linkernum = None):
+    #An alternative to Build_Tree that shapes the tree for the lab it will run in.
+    #Build_Tree always fills nodes with n children from left to right. Here each candidate limit on the number
+    #of children (2 to n) gets a tree that splits the symbols evenly so as to keep the critical path short,
+    #and the candidate that would finish soonest on the given number of reaction sites is built.
+    #If none is expected to finish sooner than Build_Tree's tree, that tree is built instead. The estimates ignore
+    #routing and congestion, so the shaped tree usually, but not always, shortens the simulated run.
+    #durations gives the estimated time-steps for each instruction type, see default_durations.
+    #Like Build_Tree, it returns the root node and the nodelist, with all of the leaves at the same depth.
+    if len(data) <= 1:
+        return Build_Tree(data, n, linkernum = linkernum)
+    if durations is None:
+        durations = default_durations
+    
+    with Collection_Paused():
+        m = len(data)
+        cost = {k: Node_Duration(k, durations) for k in range(2, n + 1)}
+        
+        #Pick the shape that is expected to finish first, and of those, the one with the least work
+        candidates = []
+        for limit in range(2, n + 1):
+            plan, work = Shape_Plan(m, limit, cost)
+            candidates.append((Estimate_Makespan(m, plan, cost, sites), work, limit, plan))
+        makespan, _, _, plan = min(candidates)
+        if makespan >= Estimate_Default_Makespan(m, n, cost, sites):
+            return Build_Tree(data, n, linkernum = linkernum)
+        
+        #Find the height of each subtree size, so that shorter subtrees can be padded to keep the leaves level
+        height = [0]*(m + 1)
+        for size in range(2, m + 1):
+            height[size] = 1 + max(height[part] for part in set(Split(size, plan[size])))
+        
+        #Lay out the tree from the root down
+        root = Node()
+        stack = [(root, m, 0, height[m])]
+        while stack:
+            node, size, offset, h = stack.pop()
+            for part in Split(size, plan[size]):
+                if part == 1:
+                    #Single symbols are lifted to the leaf level through nodes that just pass the data up the tree
+                    child = Node([data[offset]])
+                    for i in range(h - 1):
+                        passing = Node()
+                        passing.Add_Child(child)
+                        passing.Set_Data(child.data, [])
+                        child = passing
+                    node.Add_Child(child)
+                else:
+                    child = Node(parent = node)
+                    stack.append((child, part, offset, h - 1))
+                offset += part
+        root.Correct_Depths()
+        nodes = Level_List(root)
+        
+        #Write the instructions from the leaves up, a level at a time, as Build_Tree does
+        linkers = Linkers(linkernum)
+        for level in nodes[1:]:
+            for node in level:
+                if node.inst_list is None:
+                    try:
+                        node.Set_Data(*Assemble(node, linkers))
+                    except StopIteration:
+                        linkers = Linkers(linkernum)
+                        node.Set_Data(*Assemble(node, linkers))
+        
+        return root, nodes
             
 def Assemble(node, linkers, include_extras = True):    
 #This is where the specific chemical protocol is hard-coded.
@@ -265,6 +452,7 @@ def Assemble(node, linkers, include_extras = True):
 #references to the overhanging ends, which may be linker or symbol ends. 
     
     instructions = []
+    products = {}
     arglist = [child.data for child in node.children]
     n = len(arglist)
     species_sets = []
@@ -306,20 +494,22 @@ def Assemble(node, linkers, include_extras = True):
         
         #Add this species set to the total list
         z = l1 + arglist[i] + l2
-        species_sets.append([reduce((lambda x, y: x + y), z[:])])
+        species_sets.append([''.join(z)])
         
         z.sort()    #Then sort z
         
-        #Build the gibson command
+        #Build the gibson command, and record what it makes
         instructions.append(['Gibson'] + [z + ['gibson_mix']])
+        products[tuple(z)] = species_sets[-1][0]
         
     #Now generate commands merging the resultsd
-    pre_net = reduce((lambda x,y: x + y), species_sets) #This will be for the 'data' output
+    pre_net = [species for species_set in species_sets for species in species_set] #This will be for the 'data' output
     species_sets.sort()     #Sort the species sets for preserve referencing consistency
-    net = reduce((lambda x, y: x + y), species_sets) #This will be for the instructions
+    net = [species for species_set in species_sets for species in species_set] #This will be for the instructions
     
     instructions.append(['Gibson_Move'] + species_sets + [['gibson_mix']])
     instructions.append(['Gibson', net + ['gibson_mix']])
+    products[tuple(net)] = ''.join(pre_net)
     
     #Add the PCR and purify commands
     if include_extras:
@@ -330,4 +520,9 @@ def Assemble(node, linkers, include_extras = True):
         instructions.append(['PCR_Move', 0, ['PCR_mix']])
         instructions.append(['PCR', 0])
     
-    return [reduce((lambda x, y: x + y), pre_net)], instructions
\ No newline at end of file
+    return [''.join(pre_net)], instructions, products
+
+def Reaction_Table(nodes):
+    #Collects the Gibson products of every node in the nodelist into one table, keyed by the sorted reactant species.
+    #A Lab given this table works out reactions by looking them up rather than by matching DNA overhangs.
+    return {reactants: product for level in nodes for node in level if node.products for reactants, product in node.products.items()}
\ No newline at end of file
@@ -21,15 +21,14 @@ It's just there so that you can use it in the future.
 """
 import numpy as np
 import copy
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
 
 class Lab():
     #This object represents a single 2D chip. 
     #It curates a set of Droplet and Gridpoint objects, determining how the
     #Droplets move and change, and allowing external code to control the Gridpoints.
     #Has methods for looping through all droplets and updating their locations/contents, updating gridpoint commands, etc.
-    def __init__(self, grid_dim, grid_spacing, inst_capable_locations, pull_data, record_congestion = False, alpha = 1/3, beta = 2, verbose=False):
+    def __init__(self, grid_dim, grid_spacing, inst_capable_locations, pull_data, record_congestion = False, alpha = 1/3, beta = 2, verbose=False, keep_history = True,
+                 reactions = None):
         #Note that the input inst_capable_locations should be a list of lists,
         #and each sublist should contain first a string identifying the instruction type,
         #and then a group of tuples identifying the gridpoint indices that can execute that instruction.
@@ -45,12 +44,19 @@ class Lab():
         self.time = -1
         self.comm_dicts = [] #Set of individual command dictionaries that will be compiled into one command.
         self.history = [] #Tracks all of the compiled command dictionaries
+        self.keep_history = keep_history #Whether the compiled command dictionaries are kept in the history
+        self.outbox = None #If this is a list, each compiled command dictionary is also put here, along with its time, for streaming
+        self.timing = None #If this is a Timing.Tick_Log, the phases of each time-step are timed in it. The Scheduler sets it while it runs.
         self.n_drops = [] #Tracks how many droplets are on the lab at a given time
         self.record_congestion = record_congestion #Whether the lab should calculate congestion values or not
         self.congestion_tracker = []
         self.alpha = alpha
         self.beta = beta
         self.verbose = verbose
+        
+        #If given a reaction table (see Interpreter.Reaction_Table), the lab runs symbolic chemistry: species are
+        #just their names, and Gibson reactions are looked up in the table instead of matching DNA overhangs.
+        self.reactions = reactions
 
         #Initialize the Gridpoint array
         rows, cols = grid_dim
@@ -58,12 +64,21 @@ class Lab():
         for gp in self.grid.values():
             gp.Initialize_Neighbors(self.grid)
 
+        #Initialize the route footprint counters used for on-path checks
+        self.route_footprint = Route_Footprint(grid_dim)
+        
+        #Track the gridpoints that are doing anything, so that each time-step only has to visit those
+        #rather than the whole grid. All other gridpoints have zero potential and no running instructions.
+        self.energized = set() #Gridpoints given a potential since the last reset
+        self.processing = set() #Gridpoints with instructions under execution
+
         #Initialize the Droplet list and instructions
         self.droplets = []
         self.Initialize_Insts()
 
         # Variables for benchmarking purposes
         self.n_total_droplets = 0
+        self.n_reactions = 0 #Tracks how many reactions have completed on the lab
         
     def Initialize_Insts(self):
         #Add the instructions to the relevant Gridpoints
@@ -89,12 +104,18 @@ class Lab():
         #Indices should be passed as a list of tuples [(row, col)]
         if index_list is not None:
             for i in range(len(index_list)):
-                self.grid[index_list[i]].Update_Inst(inst_list[i])
+                gp = self.grid[index_list[i]]
+                gp.Update_Inst(inst_list[i])
+                if gp.in_process:
+                    self.processing.add(gp)
 
     def Advance(self, inst_indices=None, insts=None, pot_indices=None, pots=None, pull_indices=None, keys=None, nodes=None):
-        #Reset all of the gridpoint potentials to 0
-        for gp in self.grid.values():
+        timing = self.timing
+        
+        #Reset all of the gridpoint potentials to 0. Only the energized ones can be nonzero.
+        for gp in self.energized:
             gp.Set_Potential(0)
+        self.energized = set()
             
         self.time += 1
 
@@ -103,9 +124,13 @@ class Lab():
         
         #Update the Gridpoint potentials
         self.Set_Potentials(pot_indices, pots)
+        if timing is not None:
+            timing.Lap('lab potentials')
         
         #Pull droplets
         self.Pull_Droplets(pull_indices, keys, nodes)
+        if timing is not None:
+            timing.Lap('lab pulls')
         
         #Move Droplets according to electrostatic control points.
         #Check that no droplets are outside the bounds of the grid.
@@ -116,15 +141,23 @@ class Lab():
                 droplet.Verbose_Move(self.grid, self.time)
             else:
                 droplet.Move(self.grid, self.time)
+        if timing is not None:
+            timing.Lap('lab moves')
             
         #Advance Gridpoint instructions by one step.
         #Convert droplets according to mixing and heating controls, etc.
-        for gridpoint in self.grid.values():
+        #Only gridpoints with running instructions have anything to do. They go in the same order as the grid dictionary.
+        for gridpoint in sorted(self.processing, key = lambda gp: (gp.indices[1], gp.indices[0])):
             try:
-                gridpoint.Advance()
+                if gridpoint.Advance(self.reactions):
+                    self.n_reactions += 1
             except ValueError as e:
                 print(gridpoint.indices)
                 raise e
+            if gridpoint.runtime is None:
+                self.processing.discard(gridpoint)
+        if timing is not None:
+            timing.Lap('lab reactions')
             
         #Delete all droplets marked for removal.
         self.Delete_Droplets()
@@ -135,9 +168,13 @@ class Lab():
         #Update the droplets' step trackers
         for dp in self.droplets:
             dp.steps.append((self.time, *dp.Get_Loc()))
+        if timing is not None:
+            timing.Lap('lab cleanup')
           
         if self.record_congestion:
             self.congestion_tracker.append(self.Get_Congestion(self.alpha, self.beta))
+            if timing is not None:
+                timing.Lap('lab congestion')
             
     def Get_Congestion(self, alpha, beta):
         #Calculate congestion value and report it
@@ -150,23 +187,17 @@ class Lab():
         the gridpoints containing droplets, and the occluded gridpoints, divided
         by the total number of gridpoints
         """
-        coords = []
+        coords = set()
         for i, droplet in enumerate(self.droplets):
             route = droplet.Get_Route()
-            for coord_3d in route:
-                # where coord_3d takes the format
-                # (time, x, y)
-                coord_2d = (coord_3d[1], coord_3d[2])
-
-                area_gridpoints = [gridpoint.indices for gridpoint in droplet.gridpoints]
-                area_gridpoints += [gridpoint.indices for gridpoint in droplet.occluded]
-
-                if coord_2d not in coords:
-                    coords.append(coord_2d)
-
-                for gridpoint in area_gridpoints:
-                    if gridpoint not in coords:
-                        coords.append(gridpoint)
+            if route == []:
+                continue
+            
+            # where each step takes the format
+            # (time, x, y)
+            coords.update((coord_3d[1], coord_3d[2]) for coord_3d in route)
+            coords.update(gridpoint.indices for gridpoint in droplet.gridpoints)
+            coords.update(gridpoint.indices for gridpoint in droplet.occluded)
 
 
         congestion = 100 * (len(coords)/(self.grid_dim[0] ** 2))
@@ -190,7 +221,8 @@ class Lab():
                 node = None
             #Indices should be passed as a list of tuples
             droplet_index = len(self.droplets)
-            droplet = self.grid[ind].Pull_Droplet(droplet_index, key = key, node = node, grid = self.grid)
+            droplet = self.grid[ind].Pull_Droplet(droplet_index, key = key, node = node, grid = self.grid, footprint = self.route_footprint,
+                                                  symbolic = self.reactions is not None)
 
             # SS2
             self.n_total_droplets += 1
@@ -201,6 +233,7 @@ class Lab():
         if index_list is not None:
             for i, index_pair in enumerate(index_list):
                 self.grid[index_pair].Set_Potential(potential_list[i])
+                self.energized.add(self.grid[index_pair])
             
     def Delete_Droplets(self):
         #It's important to loop through the list in reverse, otherwise the removal process
@@ -210,6 +243,9 @@ class Lab():
             if dp.to_delete:
                 self.droplets.remove(dp)
                 
+                #Its planned route no longer blocks anything
+                dp.Clear_Footprint()
+                
                 #Reset the collision group
                 self.Reset_Collision_Group(dp)
                 
@@ -270,19 +306,46 @@ class Lab():
     def Compile_Commands(self, status_update = False, makeplot = False, saveplot = False, wait_time = 2, ax = None):
         #Combine the dictionaries into one
         comms = self.Combine_Dicts(*self.comm_dicts)
-        self.history.append(comms)
+        if self.keep_history:
+            self.history.append(comms)
         
         #Clear the command holding-list
         self.comm_dicts = []
+        if self.timing is not None:
+            self.timing.Lap('movement')
         
         #Advance the lab
         self.Advance(**comms)
         
+        if self.outbox is not None:
+            self.outbox.append((self.time, comms))
+        
         if status_update:
             self.Status_Update()
         
         if makeplot:
+            #Only load the plotting libraries when plotting is actually requested
+            from Visualization import Plot_Droplets
             Plot_Droplets(self, ax, wait_time = wait_time, step = self.time, saveplot=saveplot)
+        if self.timing is not None:
+            self.timing.Lap('status')
+
+    def Advance_Many(self, n, status_update = False):
+        #Advances the lab by up to n time-steps without any outside commands. Every droplet steps along its planned route,
+        #or holds still if it has none, exactly as the Scheduler's movement commands would have it do.
+        #Stops early after a step in which droplets merged, were removed or finished a reaction, since the Scheduler
+        #needs to look at those events. Returns the number of time-steps actually taken.
+        for i in range(n):
+            n_droplets = len(self.droplets)
+            n_reactions = self.n_reactions
+            
+            coords = [pair for dp in self.droplets for pair in dp.Get_Activation()]
+            self.Add_Commands({'pot_indices':coords, 'pots':len(coords)*[1]})
+            self.Compile_Commands(status_update=status_update)
+            
+            if len(self.droplets) != n_droplets or self.n_reactions != n_reactions:
+                return i + 1
+        return n
 
     def Combine_Dicts(self, *args):
         #Convenience function for combining multiple dictionaries
@@ -310,7 +373,9 @@ class Lab():
     def Get_Congestion_History(self):
         if self.record_congestion:
             return self.congestion_tracker
-                
+
+    #### CHECKPOINTING ####
+
 class Droplet():
     #This object represents a single droplet of liquid on the chip.
     #It has state variables such as coordinates, area and chemical species and various routing data.
@@ -318,7 +383,7 @@ class Droplet():
     #tracking the chemical species contained within it and updating DNA strands based on Gibson assembly and Watson-Crick pairing.
 
     
-    def __init__(self, coords, species, area, gridpoints, index, dest = None, key = None, node = None, time = None):
+    def __init__(self, coords, species, area, gridpoints, index, dest = None, key = None, node = None, time = None, footprint = None):
         self.coords = coords #numpy array with the coordinates of the droplet's center
         if type(species) is not list:
             self.species = [species]
@@ -334,7 +399,7 @@ class Droplet():
         self.following = None #The droplet that this droplet is chasing, if any
         self.dest = dest #The destination of this droplet, if any. Should be passed as a tuple to __init__
         self.sub_dest = None #The sub-destination of the droplet, used for simulations where the droplets don't necessarily move exactly one grid-step in exactly one time-step.
-        self.collision_group = [self] #The allowed-collision group of this droplet, if any
+        self.collision_group = Collision_Group([self]) #The allowed-collision group of this droplet, if any
         self.steps = [] #Tracks the history of this droplet's movements
         self.key = key  #records the key associated with this droplet
         self.node = node #records the node that pulled this droplet
@@ -358,6 +423,22 @@ class Droplet():
         self.reference_path = [] #Reference path for path heuristic
         self.cannot_route = False #If it can't currently route
         self.prev_perm_blocked = [] #Last time's perm blocked, for comparing routability
+        self.footprint = footprint #The lab's Route_Footprint counters, if any
+        self.footprint_steps = [] #The route locations currently counted in the footprint
+        self.footprint_offsets = [] #The shape and shell offsets they were counted with
+    
+    def __getstate__(self):
+        #Checkpoints leave out the blocks the droplet faced on its last routing, which are worked out anew before it is routed again,
+        #and the lab's footprint counters, which the lab reattaches when it is loaded.
+        state = self.__dict__.copy()
+        del state['blocked'], state['perm_blocked'], state['footprint']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.blocked = []
+        self.perm_blocked = []
+        self.footprint = None
     
     #### ROUTING METHODS ####    
 
@@ -380,6 +461,29 @@ class Droplet():
         self.route = route
         self.routed = True
         self.last_routed = time
+        self.Refresh_Footprint()
+        
+    def Pop_Step(self):
+        #Removes and returns the first step of the route, along with its footprint.
+        step = self.route.pop(0)
+        if self.footprint is not None and self.footprint_steps:
+            self.footprint.Add([self.footprint_steps.pop(0)], self.footprint_offsets, sign = -1)
+        return step
+    
+    def Refresh_Footprint(self):
+        #Recounts this droplet's route in the lab's footprint counters using its current route and shape.
+        if self.footprint is None:
+            return
+        self.Clear_Footprint()
+        self.footprint_steps = [step[1:3] for step in self.route]
+        self.footprint_offsets = self.Get_Shape() + self.Get_Shell()
+        self.footprint.Add(self.footprint_steps, self.footprint_offsets)
+        
+    def Clear_Footprint(self):
+        #Removes this droplet's route from the lab's footprint counters.
+        if self.footprint is not None and self.footprint_steps:
+            self.footprint.Add(self.footprint_steps, self.footprint_offsets, sign = -1)
+        self.footprint_steps = []
         
     def Set_Blocks(self, blocked=[], perm_blocked=[]):
         #Record the blocks this droplet faces on its route.
@@ -393,7 +497,9 @@ class Droplet():
         self.routed = False
         
     def Set_Collision_Group(self, group):
-        #Set the collision group.
+        #Set the collision group. A plain list of droplets is turned into a new group.
+        if not isinstance(group, Collision_Group):
+            group = Collision_Group(group)
         self.collision_group = group
     
     def Set_Follow(self, dp):
@@ -465,6 +571,19 @@ class Droplet():
             return [x.indices for x in out]
         return out
 
+    def Get_Activation(self):
+        #Determines which gridpoints to activate in order to move the droplet to the first position on its route.
+        #If the droplet has no route, activate all its currently-occupied gridpoints, excluding edges, to hold it in place.
+        gp_indices = self.Get_Shadow(region='interior', asindex=True)
+        if not self.route:
+            return gp_indices
+        
+        #Find the direction the droplet is moving
+        target = self.route[0][1:3]
+        X,Y = target - np.array(self.Get_Loc())
+            
+        return [(x + X, y + Y) for (x,y) in gp_indices]
+
     #### MOVEMENT AND CHEMISTRY METHODS ####
     def Get_Radius(self):
         #Returns the radius of the droplet
@@ -473,8 +592,9 @@ class Droplet():
     def Get_Loc(self, asindex = False):
         return tuple(np.floor(self.coords).astype('int'))
         
-    def React(self, inst):
+    def React(self, inst, reactions = None):
         #Instructions are passed as a dictionary.
+        #If a reaction table is given, the chemistry is symbolic and the outcome is looked up in the table.
         #Instruction dictionaries have three keys: 
             #'inst_type' - the name of the instruction, which also encodes its expected outcome
             #'reactants' - the necessary non-DNA reactants
@@ -492,7 +612,9 @@ class Droplet():
                     self.species.remove(x)
             
             #Now check the reaction type and act accordingly.
-            if inst['inst_type'] == 'Gibson':
+            if reactions is not None:
+                self.React_Symbolic(inst, reactions)
+            elif inst['inst_type'] == 'Gibson':
                 self.Gibson(inst['args'])
                 #Temporarily, I"ll add Purify to the Gibson commands just to simply debugging
                 self.Purify('longest')
@@ -501,20 +623,40 @@ class Droplet():
             elif inst['inst_type'] == 'Purify':
                 self.Purify(inst['args'])
                 
+    def React_Symbolic(self, inst, reactions):
+        #In symbolic chemistry the species are their names. A Gibson reaction turns the droplet's species into the product
+        #the assembly tree planned for them. Purify and PCR leave a correctly assembled product as it is, so they do nothing.
+        if inst['inst_type'] == 'Gibson':
+            reactants = tuple(sorted(self.species))
+            if reactants not in reactions:
+                raise ValueError('No Gibson reaction in the assembly tree for species {}'.format(reactants))
+            self.species[:] = [reactions[reactants]]
+                
     def Gibson(self, args = None):
         #Attempts to assemble the DNA strands in this droplet by hybridizing their overhanging strands.
+        #The strands are indexed by their overhangs, so each strand is only compared with the strands it can pair with.
+        present = set(x for x in self.species if type(x) is not str)
         counter = 0
         no_match_found = False
         while (counter < 3) and (not no_match_found):
             #Get the DNA objects in this droplet's species list
             dna_list = [x for x in self.species if type(x) is not str]
             
+            #Index their positions in the list by overhang
+            by_left = {}
+            by_right = {}
+            for j, dna in enumerate(dna_list):
+                by_left.setdefault(dna.left, []).append(j)
+                by_right.setdefault(dna.right, []).append(j)
+            
             no_match_found = True #Update the end conditions
             counter += 1
             
-            #Attempt to match them.
+            #Attempt to match each strand with itself and the strands after it, in list order.
             for i, dna1 in enumerate(dna_list):
-                for dna2 in dna_list[i:]:
+                partners = by_right.get(dna1.left_partner, []) + by_left.get(dna1.right_partner, [])
+                for j in sorted(set(j for j in partners if j >= i)):
+                    dna2 = dna_list[j]
                     match = dna1.Match(dna2)
                     
                     #If they have a match, make a new combined strand and add it to this Droplet.
@@ -522,8 +664,9 @@ class Droplet():
                         no_match_found = False #Since a match was found, reset the end condition
                         new_dna_list = dna1.Combine(dna2, side=match)
                         for new_dna in new_dna_list:
-                            if new_dna not in self.species:
+                            if new_dna not in present:
                                 # print("Adding {} to species list: {}".format(new_dna, self.species))
+                                present.add(new_dna)
                                 self.species.append(new_dna)
 
     def PCR(self, args = None):
@@ -572,7 +715,7 @@ class Droplet():
                 
         try:
             if self.route != []:
-                step = self.route.pop(0)[1:]
+                step = self.Pop_Step()[1:]
             # assert self.route == [] or self.Get_Loc() == step
         except AssertionError as e:
             print("Droplet number {} carrying {} strayed from its route onto site {} instead of {}.".format(self.index, self.species, self.Get_Loc(), step))
@@ -742,65 +885,149 @@ class Droplet():
         if self.route[0][0] == time:
             self.route.pop(0)
         
+        #The merged droplet has a new area and possibly a new route, so recount its footprint
+        self.Refresh_Footprint()
+        
         return self
             
-    def Get_Circle(self, zorder = 10):
-        #Returns a matplotlib Circle artist representing this droplet.
-        circ = plt.Circle(self.coords, self.Get_Radius(), edgecolor = (0,0,0), zorder = zorder)
-        if self.shunting or (self.route != [] and self.route[-1][1:] != self.Get_Dest()):
-            circ.set_color((0.3, 0.05, 0.65))
-        return circ
-            
-        #The color varies depending on the status of the droplet.
-            #If it's a mixed droplet, red.
-            #If it's a non-DNA singlet, green.
-            #If it's a DNA singlet, black.
-            #If it's not at its destination, a lighter version of its base color.
+class Collision_Group():
+    #The group of droplets that are allowed to collide and merge with each other.
+    #Droplets in the same group share the same group object, so two droplets are in the same group exactly when their groups are identical.
+    #Groups compare and hash by identity, which lets the Scheduler collect the distinct groups of many droplets with a dict.
+    #The members are kept both in order and as a set, so iterating, indexing and membership checks are all cheap.
+    def __init__(self, members = ()):
+        self.members = list(members)
+        self.member_set = set(self.members)
+        
+    def __iter__(self):
+        return iter(self.members)
+    
+    def __len__(self):
+        return len(self.members)
+    
+    def __getitem__(self, i):
+        return self.members[i]
+    
+    def __contains__(self, dp):
+        return dp in self.member_set
+    
+    def __repr__(self):
+        return 'Collision_Group({})'.format(self.members)
+    
+    def remove(self, dp):
+        #Removes a droplet from the group
+        self.members.remove(dp)
+        self.member_set.discard(dp)
 
-        
-        if len(self.species) > 1:
-            if self.At_Dest():
-                circ.set_color((1, 0, 0))
-            else:
-                circ.set_color((1, 0.8, 0.8))
-        elif type(self.species[0]) == str:
-            if self.At_Dest():
-                circ.set_color((0, 1, 0))
-            else:
-                circ.set_color((0.8, 1, 0.8))
+class Sequence():
+    #The sequence of a DNA strand, stored as a rope: either a piece of text, or the concatenation of two shorter sequences.
+    #Combining two strands then takes constant time instead of copying both sequences, which matters as the strands
+    #grow up the assembly tree. The length and a polynomial hash of the text are kept up to date as sequences are joined.
+    #The full text is only put together when something asks for it, e.g. printing or droplet keys, and is kept from then on.
+    __slots__ = ('text', 'left', 'right', 'length', 'digest', 'shift')
+    base = 131
+    modulus = (1 << 61) - 1
+    
+    def __init__(self, text = '', left = None, right = None):
+        if left is None:
+            self.text = text
+            self.left = self.right = None
+            self.length = len(text)
+            self.digest = 0
+            for x in text:
+                self.digest = (self.digest*Sequence.base + ord(x)) % Sequence.modulus
+            self.shift = pow(Sequence.base, self.length, Sequence.modulus)
         else:
-            if self.At_Dest():
-                circ.set_color((0, 0, 0))
-            else:
-                circ.set_color((0.5, 0.5, 0.5))
-            
-        return circ
-   
+            self.text = None
+            self.left = left
+            self.right = right
+            self.length = left.length + right.length
+            self.digest = (left.digest*right.shift + right.digest) % Sequence.modulus
+            self.shift = (left.shift*right.shift) % Sequence.modulus
+    
+    @staticmethod
+    def Of(seq):
+        #Returns seq as a Sequence, wrapping it if it's a plain string.
+        return seq if type(seq) is Sequence else Sequence(seq)
+    
+    def __add__(self, other):
+        return Sequence(left = self, right = Sequence.Of(other))
+    
+    def __radd__(self, other):
+        return Sequence(left = Sequence.Of(other), right = self)
+    
+    def __len__(self):
+        return self.length
+    
+    def __str__(self):
+        if self.text is None:
+            #Walk the rope from left to right without recursing, since chains of joins can be long
+            pieces = []
+            stack = [self]
+            while stack:
+                seq = stack.pop()
+                if seq.text is not None:
+                    pieces.append(seq.text)
+                else:
+                    stack.append(seq.right)
+                    stack.append(seq.left)
+            self.text = ''.join(pieces)
+            self.left = self.right = None   #The text replaces the pieces
+        return self.text
+    
+    def __repr__(self):
+        return str(self)
+    
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not Sequence:
+            return NotImplemented
+        if self.length != other.length or self.digest != other.digest:
+            return False
+        return str(self) == str(other)
+    
+    def __hash__(self):
+        return self.digest
+    
+    def __reduce__(self):
+        #Checkpoints store the text, since pickling a long chain of joins would recurse too deeply
+        return (Sequence, (str(self),))
+        
 class DNA():
     #A chemical species consisting of a double-strand of DNA,
     #and overhangs on the left and right.
     
+    match_dict = {'A':'T', 'T':'A', 'G':'C', 'C':'G', '1':'1', '0':'0'} #Watson-Crick pairing dict
+    complements = {}    #The complement of every overhang seen so far, shared by all DNA objects
+    
     def __init__(self, seq, left, right):
-        self.seq = seq   #The sequence of this DNA as a string (only the 'top' strand for simplicity)
+        self.seq = Sequence.Of(seq)   #The sequence of this DNA (only the 'top' strand for simplicity)
         self.left = left #The left overhang string
         self.right = right#The right overhang string
-        self.match_dict = {'A':'T', 'T':'A', 'G':'C', 'C':'G', '1':'1', '0':'0'} #Watson-Crick pairing dict
+        self.left_partner = DNA.Complement(left)    #The right overhang that pairs with this left overhang
+        self.right_partner = DNA.Complement(right)  #The left overhang that pairs with this right overhang
         self.to_delete = False   #In case this needs to be marked for deletion later
         
+    @staticmethod
+    def Complement(end):
+        #Returns the Watson-Crick complement of an overhang, or None if it contains anything unpairable.
+        #Overhangs come from a small set of linker and symbol ends, so each complement is only worked out once.
+        try:
+            return DNA.complements[end]
+        except KeyError:
+            try:
+                comp = ''.join(DNA.match_dict[x] for x in end)
+            except KeyError:
+                comp = None
+            DNA.complements[end] = comp
+            return comp
+        
     def Match(self, DNA):
         #Checks to see if this object's overhangs match with another's.
         #Returns either None, 'left', 'right' or 'both' indicating no match, or a match on the left and/or right of this object's overhangs.
-        #Check for a left match
-        try:
-            left = all([self.match_dict[self.left[i]] == DNA.right[i] for i in range(max(len(DNA.right),len(self.left)))])
-        except IndexError:
-            left = False
-            
-        #Check for a right match
-        try:
-            right = all([self.match_dict[self.right[i]] == DNA.left[i] for i in range(max(len(DNA.left),len(self.right)))])
-        except IndexError:
-            right = False
+        left = self.left_partner == DNA.right
+        right = self.right_partner == DNA.left
             
         #Return the outcome
         if left and right:
@@ -838,11 +1065,17 @@ class DNA():
         return str(self.seq)
     
     def __eq__(self, other):
+        if self is other:
+            return True
         if type(self) == type(other):
             return (self.left == other.left) and (self.seq == other.seq) and (self.right == other.right)
         else:
             return False
         
+    def __hash__(self):
+        #Consistent with __eq__, so strands can be kept in sets and looked up by content.
+        return hash((self.left, self.seq, self.right))
+        
 class Gridpoint():
     #This object represents a single Gridpoint.
     #It may be only an electrostatic control point, or it may have mixing
@@ -850,6 +1083,8 @@ class Gridpoint():
     #Has methods for updating current commands, creating droplets, checking for droplets that are 
     #moving over this gridpoint or colliding on it, setting the electric potential, etc.
     
+    defaults = None #The fields of a fresh gridpoint, used to store gridpoints compactly in checkpoints
+
     def __init__(self, gridpoint_size, indices, pull_type = None, pull_data = None, grid_dim = None, neighbors = None):
         #Variables that store information about the gridpoint
         self.state_inst = None #These are the instructions currently under execution.
@@ -967,8 +1202,11 @@ class Gridpoint():
             if self.droplets is []:
                 print('Warning: Empty Gridpoint has begun executing instructions!')
         
-    def Advance(self):
+    def Advance(self, reactions = None):
         #Decrement the runtime variable.
+        #Returns True if a reaction was completed during this step.
+        #The reaction table, if any, is passed on to the droplet for symbolic chemistry.
+        reacted = False
         if self.runtime is not None:
             self.runtime -= 1
             #If runtime has completed, Convert the Droplet and clear the instructions
@@ -978,11 +1216,13 @@ class Gridpoint():
                 if self.droplets != []:
                     if len(self.droplets) != 1:
                         raise ValueError('Gridpoint {} executed instructions while containing multiple separate droplets!'.format(self.indices))
-                    self.droplets[0].React(self.state_inst)
+                    self.droplets[0].React(self.state_inst, reactions)
                     self.reactions += 1
+                    reacted = True
                 else:
                     print('Warning: Empty Gridpoint finished executing instructions!')
                 self.Update_Inst(None)
+        return reacted
     
     def Set_Inst_Types(self, inst_types):
         self.inst_types = inst_types
@@ -991,14 +1231,14 @@ class Gridpoint():
         if inst_type not in self.inst_types:
             self.inst_types.append(inst_type)
         
-    def Pull_Droplet(self, index, node = None, key = None, grid = None):
-        if self.pull_data['type'] == 'DNA':
+    def Pull_Droplet(self, index, node = None, key = None, grid = None, footprint = None, symbolic = False):
+        if self.pull_data['type'] == 'DNA' and not symbolic:
             species = DNA(seq = self.pull_data['species'], left = self.pull_data['ends'][0], right = self.pull_data['ends'][1])
         else:
             species = self.pull_data['species']
         
         #Instantiate a new Droplet
-        droplet = Droplet(self.coords, species, self.pull_data['area'], gridpoints = [], index = index, key = key, node = node)
+        droplet = Droplet(self.coords, species, self.pull_data['area'], gridpoints = [], index = index, key = key, node = node, footprint = footprint)
         
         #Add the new Droplet to this Gridpoint and any others it touches
         droplet.Update_Gridpoints(grid = grid, moving = False)
@@ -1068,12 +1308,49 @@ class Gridpoint():
     def Add_Residue(self, species):
         if species not in self.residues:
             self.residues.append(species)
+
+    def __getstate__(self):
+        #Only the fields that differ from a fresh gridpoint are stored. The coordinates follow from the indices
+        #and the Lab reattaches the neighbors, so that checkpoints stay small and pickling never recurses across the grid.
+        if Gridpoint.defaults is None:
+            Gridpoint.defaults = Gridpoint(1, (0, 0)).__dict__
+        state = {'indices': self.indices, 'gridpoint_size': self.gridpoint_size}
+        for field, value in self.__dict__.items():
+            if field in ('coords', 'neighbors') or field in state:
+                continue
+            if type(value) is not type(Gridpoint.defaults[field]) or value != Gridpoint.defaults[field]:
+                state[field] = value
+        return state
+    
+    def __setstate__(self, state):
+        self.__init__(state['gridpoint_size'], state['indices'])
+        self.__dict__.update(state)
             
-    def Get_Square(self, color = (0, 0, 1), zorder = 1):
-        #Returns a pyplot Rectangle object representing this gridpoint. Default color is blue.
-        center = np.array(self.coords) - 2*[float(self.gridpoint_size)/2]
-        square = plt.Rectangle(center, self.gridpoint_size, self.gridpoint_size, fc = color, ec = 'black', zorder = zorder)
-        return square
+class Route_Footprint():
+    #Counts, for every gridpoint, how many planned route steps of the lab's droplets touch it through their shape or shell.
+    #Droplets update the counts whenever their routes are set, stepped along or cleared,
+    #so that checking whether a gridpoint lies on any planned path is a single lookup.
+    def __init__(self, grid_dim):
+        self.grid_dim = tuple(grid_dim)
+        self.counts = np.zeros(self.grid_dim, dtype=int)
+        
+    def Add(self, steps, offsets, sign = 1):
+        #Adds (or with sign = -1, removes) the footprint of each step location, given as (x, y) pairs.
+        if not steps or not offsets:
+            return
+        cells = (np.array(steps, dtype=int)[:, None, :] + np.array(offsets, dtype=int)[None, :, :]).reshape(-1, 2)
+        
+        #Footprint cells that hang off the edge of the grid can never be queried, so skip them
+        inside = (cells[:, 0] >= 0) & (cells[:, 0] < self.grid_dim[0]) & (cells[:, 1] >= 0) & (cells[:, 1] < self.grid_dim[1])
+        cells = cells[inside]
+        np.add.at(self.counts, (cells[:, 0], cells[:, 1]), sign)
+        
+    def Covers(self, indices):
+        #Returns True if the gridpoint at the given indices lies on any droplet's planned route footprint.
+        x, y = indices
+        if not (0 <= x < self.grid_dim[0] and 0 <= y < self.grid_dim[1]):
+            return False
+        return self.counts[x, y] > 0
 
 def Get_Neighbors(indices_or_coords, grid_dim, include_loc = False, astuple = False, include_extremes = False):
     #Returns neighboring coordinates in a list
@@ -1103,61 +1380,12 @@ def Get_Neighbors(indices_or_coords, grid_dim, include_loc = False, astuple = Fa
         
     return out #Return a list of coords surrounding the given coords.
 
-def Plot_Droplets(lab, ax=None, wait_time = 0, step=None, saveplot = False, name_str = 'Fig'):    
-    if ax == None:
-        fig, ax = plt.subplots()
-        
-    ax.clear() #Clear the axes object, then we'll repopulate it
-    ax.set_xlim([0, lab.grid_dim[0]])
-    ax.set_ylim([0, lab.grid_dim[1]])
-
-    if step is not None:
-        ax.set_title(f'Lab time: {step}, Congestion: {round(lab.Get_Congestion(0, 0), 3)}')
-        
-    #Loop through the droplets and plot all the occlusion boxes
-    for dp in lab.droplets:
-        #Add a circle representing the droplet itself
-        ax.add_artist(dp.Get_Circle(zorder = 20))
-        x,y = dp.coords
-        ax.text(x-0.5,y+0.7,dp.species,color='red', zorder = 100)
-        
-        #Add the droplet's route in gray boxes
-        if dp.Is_Routed():
-            [ax.add_artist(lab.grid[x[1:3]].Get_Square(color=(0.5, 0.5, 0.5), zorder=1)) for x in dp.route]
-       
-        #Add the occupied and occluded gridpoints as yellow and blue boxes, respectively.
-        [ax.add_artist(gp.Get_Square(color = (1,1,0), zorder = 10)) for gp in dp.gridpoints];
-        [ax.add_artist(gp.Get_Square(zorder = 15)) for gp in dp.occluded];
-        
-        #If it has a destination, draw that as a red box and an arrow pointing to it.
-        if dp.Get_Dest():
-            ax.add_artist(lab.grid[dp.Get_Dest()].Get_Square(color=(1,0,0), zorder = 1))
-            ax.add_artist(plt.arrow(*dp.coords, *(np.array(dp.Get_Dest()) - dp.Get_Loc()), zorder = 25))
-            
-    #For any active gridpoints, color them orange.
-    for gp in lab.grid.values():
-        if gp.is_forbidden:
-            ax.add_artist(gp.Get_Square(color=(0,0,0), zorder=30))
-            continue
-        if gp.potential > 0:
-            # ax.add_artist(gp.Get_Square(color=(1, 0.64, 0), zorder = 18))
-            # ax.add_artist(gp.Get_Square(color=(1, 0.64, 0), zorder = 50))
-            pass
-        
-        
-    if saveplot:
-        plt.savefig('Figures/' + name_str + str(step) + '.png')
-
-    if wait_time > 0:
-        plt.pause(wait_time)
-    return ax
-        
 class Dummy():
     def __init__(self, coords = None, dest = None, targets = [], area = 1):
         self.coords = coords
         self.dest = dest
         self.targets = targets
-        self.collision_group = []
+        self.collision_group = Collision_Group()
         self.area = area
         self.route = []
         
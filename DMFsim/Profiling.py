@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Timing the simulation's subroutines.
+
+Profile_Call runs a function under cProfile and writes one row per profiled function to a CSV file, in the
+Id,Label,group,calls,time layout of the Gephi exports in data/gephi, so runs can be compared with the published
+problem-size data without pycallgraph or Gephi:
+
+    Id, Label   the function's module and qualified name, e.g. Lab.Lab.Advance
+    group       the function's top-level module or package, e.g. Lab
+    calls       the number of calls, including recursive ones
+    time        the time spent in the function and everything it called, in seconds
+
+Builtins and C methods are included, grouped under their module (or builtins for methods of builtin types).
+The rows are sorted by time, longest first.
+
+    results = Profile_Call('profile.csv', Run_Scenario, 50, 5)
+
+Deterministic profiling slows every call down by about the same amount, which distorts the times of small, hot
+functions such as Gridpoint.Set_Potential. The Sampler instead looks at the running stack at a fixed rate from
+a background thread, which costs next to nothing, and writes collapsed stacks for flame graphs.
+
+"""
+import cProfile
+import csv
+import inspect
+import os
+import pstats
+import re
+import sys
+import threading
+
+comprehensions = ('<listcomp>', '<setcomp>', '<dictcomp>', '<genexpr>')
+
+def Code_Names(filename):
+    #Returns a dictionary from (first line, name) to qualified name for every function defined in a source file.
+    #cProfile only records a function's bare name, so the qualified names are read from the compiled file instead.
+    names = {}
+    try:
+        with open(filename, 'rb') as f:
+            code = compile(f.read(), filename, 'exec', dont_inherit = True)
+    except (OSError, SyntaxError, ValueError):
+        return names
+    #Code objects only carry their qualified name from Python 3.11 on, so it is built up from the nesting instead:
+    #functions and classes at module level keep their name, those in a class body are prefixed with the class,
+    #and those in a function with the function and <locals>, like __qualname__. Comprehensions don't add <locals>.
+    stack = [(const, '') for const in code.co_consts if isinstance(const, type(code))]
+    while stack:
+        code, parent = stack.pop()
+        qualname = getattr(code, 'co_qualname', parent + code.co_name)
+        names[(code.co_firstlineno, code.co_name)] = qualname
+        local = code.co_flags & inspect.CO_NEWLOCALS and code.co_name not in comprehensions
+        prefix = qualname + ('.<locals>.' if local else '.')
+        stack.extend((const, prefix) for const in code.co_consts if isinstance(const, type(code)))
+    return names
+
+def Module_Names():
+    #Returns a dictionary from source file to module name for every loaded module.
+    #The script being run is named after its file, e.g. Tutorial, rather than __main__.
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if filename:
+            path = os.path.abspath(filename)
+            modules[path] = os.path.splitext(os.path.basename(path))[0] if name == '__main__' else name
+    return modules
+
+def Function_Id(key, modules, code_names):
+    #Returns the (Id, group) pair for a profiler key of (filename, first line, name).
+    filename, line, name = key
+    if filename == '~':
+        #A builtin, named like <built-in method time.sleep> or <method 'append' of 'list' objects>
+        method = re.match(r"<method '(.+)' of '(.+)' objects>", name)
+        if method:
+            return method.group(2) + '.' + method.group(1), 'builtins'
+        name = re.sub(r'^<built-in (method|function) (.+)>$', r'\2', name)
+        return name, name.split('.')[0] if '.' in name else 'builtins'
+
+    path = os.path.abspath(filename)
+    module = modules.get(path, os.path.splitext(os.path.basename(filename))[0])
+    if path not in code_names:
+        code_names[path] = Code_Names(filename)
+    qualname = code_names[path].get((line, name), name)
+    if name == '<module>':
+        qualname = name
+    return module + '.' + qualname, module.split('.')[0]
+
+def Call_Table(profile):
+    #Returns the rows of the call table for a finished cProfile.Profile, longest first.
+    #Functions that end up with the same Id, e.g. two lambdas in one class, are merged.
+    stats = pstats.Stats(profile).stats
+    modules = Module_Names()
+    code_names = {}
+    rows = {}
+    for key, (primitive_calls, calls, own_time, total_time, callers) in stats.items():
+        function_id, group = Function_Id(key, modules, code_names)
+        if function_id in rows:
+            rows[function_id][1] += calls
+            rows[function_id][2] += total_time
+        else:
+            rows[function_id] = [group, calls, total_time]
+    table = [(function_id, function_id, group, calls, round(time, 6)) for function_id, (group, calls, time) in rows.items()]
+    table.sort(key = lambda row: row[4], reverse = True)
+    return table
+
+def Write_Call_Table(table, path):
+    #Writes the rows of a call table to a CSV file under the Id,Label,group,calls,time header.
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(path, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(('Id', 'Label', 'group', 'calls', 'time'))
+        writer.writerows(table)
+
+def Profile_Call(path, func, *args, **kwargs):
+    #Calls func(*args, **kwargs) under cProfile, writes its call table to path and returns what func returned.
+    #The table is written even if func raises, so a failed run can still be inspected.
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        Write_Call_Table(Call_Table(profile), path)
+
+#The phase each sample is attributed to, by the outermost of these functions on the sampled stack.
+#Samples in none of them, e.g. the main loop's own bookkeeping, fall under 'other'.
+phases = {
+    'Tutorial.Setup_Lab': 'setup',
+    'Lab.Lab.__init__': 'setup',
+    'Scheduler.Scheduler.__init__': 'setup',
+    'TreeCache.Cached_Build_Tree': 'tree',
+    'Interpreter.Build_Tree': 'tree',
+    'Interpreter.Build_Shaped_Tree': 'tree',
+    'Checkpoint.Load_Checkpoint': 'checkpoint',
+    'Checkpoint.Save_Checkpoint': 'checkpoint',
+    'Scheduler.Scheduler.Quiet_Ticks': 'fast-forward',
+    'Lab.Lab.Advance_Many': 'fast-forward',
+    'Scheduler.Scheduler.Check_Node_Progress': 'progress',
+    'Scheduler.Scheduler.Advance_Node_Instructions': 'instructions',
+    'Scheduler.Scheduler.Route_Droplets': 'routing',
+    'Scheduler.Scheduler.Send_Movement_Commands': 'movement',
+    'Scheduler.Scheduler.Update_Keys': 'keys',
+    'Scheduler.Scheduler.Attach_Keys': 'keys',
+}
+
+def Code_Id(code, module, code_names):
+    #Returns the Id of a running function, as in the call table, from its code object and its module's name.
+    #code_names caches Code_Names by file, for Pythons whose code objects have no co_qualname.
+    if module == '__main__':
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    qualname = getattr(code, 'co_qualname', None)
+    if qualname is None:
+        if code.co_filename not in code_names:
+            code_names[code.co_filename] = Code_Names(code.co_filename)
+        qualname = code_names[code.co_filename].get((code.co_firstlineno, code.co_name), code.co_name)
+    return module + '.' + qualname
+
+class Sampler():
+    #Samples the stack of one thread, by default the calling one, every interval seconds from a background thread,
+    #and counts how often each stack was seen. Unlike cProfile, the sampled thread runs at full speed in between,
+    #so tiny functions that are called millions of times aren't inflated by the profiler's own overhead.
+    #The sampler can only take the interpreter lock between the sampled thread's bytecodes, so intervals
+    #below sys.getswitchinterval() (5 ms by default) are stretched to it while the sampled thread is busy.
+    #
+    #    with Sampler('run.collapsed', interval = 0.01):
+    #        Run_Scenario(1000, 5)
+    #
+    #The output is in the collapsed-stack format of flamegraph.pl and speedscope, one 'frame;frame;... count' line
+    #per distinct stack, rooted at the phase the stack belongs to (see phases above).
+    def __init__(self, path, interval = 0.01, thread_id = None):
+        self.path = path
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.counts = {}    #Stack of code objects, root first -> number of samples
+        self.modules = {}   #Code object -> the name of the module it ran in
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def Sample(self):
+        #Records the sampled thread's current stack. Code objects are stored rather than names,
+        #so a sample is just a walk up the frames and a dictionary update.
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(code)
+            if code not in self.modules:
+                self.modules[code] = frame.f_globals.get('__name__', '')
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def Run(self):
+        while not self.stopped.wait(self.interval):
+            self.Sample()
+
+    def Start(self):
+        self.thread = threading.Thread(target = self.Run, name = 'Sampler', daemon = True)
+        self.thread.start()
+
+    def Stop(self):
+        #Stops sampling and writes the collapsed stacks.
+        self.stopped.set()
+        self.thread.join()
+        self.Write()
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, *exc):
+        self.Stop()
+
+    def Collapsed(self):
+        #Returns the sampled stacks as a dictionary from 'phase;frame;frame;...' to the number of samples.
+        code_names = {}
+        ids = {code: Code_Id(code, module, code_names) for code, module in self.modules.items()}
+        collapsed = {}
+        for stack, count in self.counts.items():
+            names = [ids[code] for code in stack]
+            phase = next((phases[name] for name in names if name in phases), 'other')
+            key = ';'.join([phase] + names)
+            collapsed[key] = collapsed.get(key, 0) + count
+        return collapsed
+
+    def Phase_Counts(self):
+        #Returns the number of samples in each phase.
+        counts = {}
+        for key, count in self.Collapsed().items():
+            phase = key.split(';', 1)[0]
+            counts[phase] = counts.get(phase, 0) + count
+        return counts
+
+    def Write(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(self.path, 'w') as f:
+            for key, count in sorted(self.Collapsed().items()):
+                f.write('{} {}\n'.format(key, count))
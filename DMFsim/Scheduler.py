@@ -15,9 +15,10 @@ This is also where the AStar routing library is called.
 import time
 import random
 import numpy as np
-import matplotlib.pyplot as plt
-from AStar import Get_Route
-from Lab import Calculate_Shape, Calculate_Shell
+from AStar import Get_Route, Route_Limit_Exceeded
+from Lab import Calculate_Shape, Calculate_Shell, Collision_Group
+from Spatial import Parking_Lot, Site_Index
+from Checkpoint import Save_Checkpoint
 import time
 import copy
 from functools import reduce
@@ -27,12 +28,15 @@ class Scheduler():
     #Takes in grid data and a set of instruction nodes.
     #Turns the instructions into Lab commands. 
     
-    def __init__(self, nodes, inst_locs, pull_data, lab, perm_forbidden = [], verbose = 1):
+    def __init__(self, nodes, inst_locs, pull_data, lab, perm_forbidden = [], verbose = 1, route_budget = None):
         # random.seed(42)
         self.nodes = nodes  #This is the instruction list provided by the Interpreter and Protocol.
         self.inst_locs = inst_locs #The locations where certain instructions can be executed.
         self.pull_data = pull_data #places where droplets can be pulled
         self.current_nodes = []
+        self.outstanding = {} #Maps each parent of a current node to the number of its children that have yet to conclude
+        self.concluded = set() #The current nodes that have concluded
+        self.ready = [] #Queue of parents whose children have all concluded, waiting to become current nodes
         self.perm_forbidden = perm_forbidden
         self.time = -1
         self.time_limit = 600
@@ -45,6 +49,9 @@ class Scheduler():
         self.most_visits = 0
         self.no_progress_tracker = 0 #Tracks how long it has been since progress was made.
         self.no_progress_limit = 500 
+        self.route_budget = route_budget #The number of A* search steps that may be spent routing droplets in one time-step, if limited
+        self.deferred = [] #The droplets whose routing was put off to the next time-step because the routing budget ran out
+        self.deferred_routes = 0 #Tracks how many times a droplet's routing was deferred
         
         #for debugging
         self.debug = None
@@ -52,28 +59,83 @@ class Scheduler():
         #Identify the router's attached lab and a few subordinate values as well
         self.lab = lab
         self.grid_dim = lab.grid_dim
-        
-        #Record all the locations of interest--droplet reservoirs, gibson sites etc.
-        self.all_sites = reduce((lambda x, y: x[1:] + y[1:]), inst_locs) + [loc for key in pull_data for loc in pull_data[key]['loc']]
+        self.Index_Sites()
 
         #Record all the permanently forbidden gridpoints
         [self.lab.grid[x].Set_Forbidden(True) for x in perm_forbidden];
 
-    def Compile_Instructions(self, num = 10000, makeplot = False, saveplot = False, wait_time = 2, version = 1):
+    def Index_Sites(self):
+        #Record all the locations of interest--droplet reservoirs, gibson sites etc.
+        self.all_sites = reduce((lambda x, y: x[1:] + y[1:]), self.inst_locs) + [loc for key in self.pull_data for loc in self.pull_data[key]['loc']]
+
+        #Precompute the shunting destinations that stay clear of those locations
+        self.parking = Parking_Lot(self.grid_dim, self.all_sites)
+        
+        #Index the reaction sites and reservoirs by type for nearest-site queries
+        self.sites = Site_Index(self.grid_dim, self.inst_locs, self.pull_data)
+
+    def Compile_Instructions(self, num = 10000, makeplot = False, saveplot = False, wait_time = 2, version = 1, fast_forward = False,
+                             checkpoint_every = None, checkpoint_path = 'checkpoint-{time}.ckpt', resume = False, tick_log = None):
         #This loops over the various levels of depths in the tree, starting from the 
         #level above the bottom (since all bottom nodes are leaf nodes)
         #It runs all of the nodes at a given depth in parallel. 
+        #If fast_forward is True, stretches of time-steps in which no decisions are needed are handed to the Lab to run in bulk.
+        #If checkpoint_every is given, the full simulation state is saved to checkpoint_path every that many time-steps.
+        #The path may contain a {time} field to keep each checkpoint in its own file.
+        #If resume is True, the scheduler is assumed to have been loaded from a checkpoint and carries on where it left off.
+        #If tick_log is a Timing.Tick_Log, the time spent in each phase of every time-step is recorded in it.
+        for _ in self.Run_Instructions(num=num, makeplot=makeplot, saveplot=saveplot, wait_time=wait_time, version=version, fast_forward=fast_forward,
+                                       checkpoint_every=checkpoint_every, checkpoint_path=checkpoint_path, resume=resume, stream=False,
+                                       tick_log=tick_log):
+            pass
+        
+    def Stream_Instructions(self, num = 10000, version = 1, fast_forward = False,
+                            checkpoint_every = None, checkpoint_path = 'checkpoint-{time}.ckpt', resume = False, tick_log = None):
+        #Same as Compile_Instructions, but returns a generator that yields each compiled command dictionary as a (time, commands) pair
+        #as soon as the Lab has executed it. The simulation only moves on when the consumer asks for the next batch,
+        #so a slow consumer holds the simulation back rather than letting commands pile up.
+        #To avoid keeping every command in memory as well, create the Lab with keep_history = False.
+        return self.Run_Instructions(num=num, version=version, fast_forward=fast_forward,
+                                     checkpoint_every=checkpoint_every, checkpoint_path=checkpoint_path, resume=resume, stream=True,
+                                     tick_log=tick_log)
+        
+    def Run_Instructions(self, num = 10000, makeplot = False, saveplot = False, wait_time = 2, version = 1, fast_forward = False,
+                         checkpoint_every = None, checkpoint_path = 'checkpoint-{time}.ckpt', resume = False, stream = False, tick_log = None):
+        #The main loop behind Compile_Instructions and Stream_Instructions. Yields the compiled command batches if stream is True.
+        self.lab.outbox = [] if stream else None
+        self.lab.timing = tick_log
+        try:
+            yield from self.Main_Loop(num, makeplot, saveplot, wait_time, version, fast_forward,
+                                      checkpoint_every, checkpoint_path, resume, stream, tick_log)
+        finally:
+            #The Lab stops collecting batches and timing phases even if the loop raises or a stream is closed early
+            self.lab.outbox = None
+            self.lab.timing = None
+                
+    def Main_Loop(self, num, makeplot, saveplot, wait_time, version, fast_forward, checkpoint_every, checkpoint_path, resume, stream, tick_log):
+        #The body of Run_Instructions, which sets up and resets the Lab around it.
         ax = None
         start_time = time.time()
         if makeplot:
-            plt.ion()
-            fig, ax = plt.subplots()
+            #Only load the plotting libraries when plotting is actually requested
+            from Visualization import Start_Plot
+            ax = Start_Plot()
+            
+        if not resume:
+            #Get the non-leaf nodes
+            if version == 1:             #For the old version
+                self.current_nodes = [x for x in self.nodes[1] if not x.Is_Leaf()]
+            elif version == 2:           #For the new version
+                self.current_nodes = [node for sublist in self.nodes for node in sublist if node.Is_Leaf()] 
+                
+            #Start counting the outstanding children of the current nodes' parents
+            for node in self.current_nodes:
+                self.Track_Node(node)
             
-        #Get the non-leaf nodes
-        if version == 1:             #For the old version
-            self.current_nodes = [x for x in self.nodes[1] if not x.Is_Leaf()]
-        elif version == 2:           #For the new version
-            self.current_nodes = [node for sublist in self.nodes for node in sublist if node.Is_Leaf()] 
+        #Checkpoints are due at the multiples of checkpoint_every, so they are named after those time-steps.
+        #A fresh run starts at time -1 and a resumed one at the time-step it was saved at.
+        if checkpoint_every:
+            next_checkpoint = (max(self.time, 0)//checkpoint_every + 1)*checkpoint_every
 
         # Warning trackers
         warned_runtime_time = False
@@ -85,6 +147,8 @@ class Scheduler():
 
         #Loop until the root node has concluded or until the num limit is reached
         while not self.nodes[-1][-1].Concluded():
+            if tick_log is not None:
+                tick_log.Start(self.lab.time)
 
             # Warn for timeouts
             # Warnings will only be displayed once
@@ -105,25 +169,49 @@ class Scheduler():
             #Update the time tracker
             self.time += 1
             self.no_progress_tracker += 1
-        
-            #Check node progress
-            for node in self.current_nodes:
-                self.Check_Node_Progress(node)
-                
-            #Advance nodes to the next instruction if they're finished with the current one
-            for node in self.current_nodes:
-                self.Advance_Node_Instructions(node)
-
-            #Plan the route for each droplet that isn't currently assigned a route and isn't locked in place for a chemical process I.E. gibson
-            # self.Route_Droplets([x for x in self.lab.droplets if (x.route == []) and (not x.locked) and (not x.At_Dest())])
-            self.Route_Droplets([x for x in self.lab.droplets if (not x.Is_Routed()) and (not x.locked) and (not x.At_Dest())])
             
-            #Send one round of movement commands
-            self.Send_Movement_Commands(makeplot=makeplot, saveplot=saveplot, wait_time=wait_time, ax=ax)
+            #Find out how many time-steps can pass before any decision is needed
+            quiet = self.Quiet_Ticks() if (fast_forward and not makeplot) else 0
+            if tick_log is not None:
+                tick_log.Lap('fast-forward')
+            
+            if quiet > 0:
+                #Let the Lab run the droplets along their planned routes until the next event
+                ticks = self.lab.Advance_Many(quiet, status_update=self.verbose > 0)
+                self.time += ticks - 1
+                self.no_progress_tracker += ticks - 1
+                if tick_log is not None:
+                    tick_log.Lap('fast-forward')
+                
+            else:
+                #Check node progress
+                for node in self.current_nodes:
+                    self.Check_Node_Progress(node)
+                if tick_log is not None:
+                    tick_log.Lap('progress')
+                    
+                #Advance nodes to the next instruction if they're finished with the current one
+                for node in self.current_nodes:
+                    self.Advance_Node_Instructions(node)
+                if tick_log is not None:
+                    tick_log.Lap('instructions')
+    
+                #Plan the route for each droplet that isn't currently assigned a route and isn't locked in place for a chemical process I.E. gibson
+                # self.Route_Droplets([x for x in self.lab.droplets if (x.route == []) and (not x.locked) and (not x.At_Dest())])
+                self.Route_Droplets([x for x in self.lab.droplets if (not x.Is_Routed()) and (not x.locked) and (not x.At_Dest())])
+                if tick_log is not None:
+                    tick_log.Lap('routing')
+                
+                #Send one round of movement commands
+                self.Send_Movement_Commands(status_update=self.verbose > 0, makeplot=makeplot, saveplot=saveplot, wait_time=wait_time, ax=ax)
+                if tick_log is not None:
+                    tick_log.Lap('movement')
             
             #Update old keys and attach new ones
             self.Update_Keys()
             self.Attach_Keys()
+            if tick_log is not None:
+                tick_log.Lap('keys')
              
             #Loop over the nodes and reset the pulling_sites data
             for node in self.current_nodes:
@@ -131,29 +219,106 @@ class Scheduler():
                     if index:
                         self.lab.grid[index].pulled_by = None
             
-            #Check for sets of siblings that have all finished their work.
-            #If there are any, add their parent to the current nodes list.
-            new_nodes = []
-            for node in self.current_nodes[:]:
-                if not node.parent:
-                    continue
-                
-                #Check if this node, and all of its siblings, have concluded.
-                if all([(child.Concluded() and child in self.current_nodes) for child in node.parent.children]) and node.parent.children != []:
-                    #If so, remove all of them from the list and add their parent instead.
-                    new_nodes.append(node.parent)
-                    
-            #Add the new nodes to the current_nodes list, but avoid duplicates
-            new_nodes = set(new_nodes)
-            self.current_nodes += new_nodes
+            #Any parent whose children have all concluded replaces them in the current nodes list.
+            if self.ready:
+                finished = set()
+                while self.ready:
+                    n = self.ready.pop(0)
+                    self.current_nodes.append(n)
+                    self.Track_Node(n)
+                    for c in n.children:
+                        #The parent inherits the childrens' selected sites (i.e. shunting sites)
+                        c.Clear(grid=self.lab.grid, time=self.time, parent = n)
+                        finished.add(c)
+                        
+                #Remove the children of the new nodes from the current_nodes list
+                self.current_nodes = [node for node in self.current_nodes if node not in finished]
+                self.concluded -= finished
+            if tick_log is not None:
+                tick_log.Lap('node updates')
+                
+            #Save the state at the end of the time-step so a resumed run starts on the next one
+            if checkpoint_every and self.time >= next_checkpoint:
+                Save_Checkpoint(self, checkpoint_path.format(time = self.time))
+                next_checkpoint = (self.time//checkpoint_every + 1)*checkpoint_every
+                if tick_log is not None:
+                    tick_log.Lap('checkpoint')
+            
+            if tick_log is not None:
+                tick_log.End(self.lab.time, len(self.lab.droplets), len(self.current_nodes))
+                
+            #Hand over the command batches compiled during this time-step
+            if stream:
+                batches, self.lab.outbox = self.lab.outbox, []
+                yield from batches
+                
+    def Track_Node(self, node):
+        #Registers a newly current node with its parent's count of outstanding children.
+        if node.parent and node.parent not in self.outstanding:
+            self.outstanding[node.parent] = len(node.parent.children)
             
-            #Remove the children of the new nodes from the current_nodes listt
-            for n in new_nodes:
-                for c in n.children:
-                    #The parent inherits the childrens' selected sites (i.e. shunting sites)
-                    c.Clear(grid=self.lab.grid, time=self.time, parent = n)
-                    self.current_nodes.remove(c)            
+    def Node_Concluded(self, node):
+        #Records that a current node has concluded all of its instructions.
+        #Once the last of its siblings concludes, the parent is queued up to become a current node.
+        if node in self.concluded:
+            return
+        self.concluded.add(node)
+        
+        if node.parent:
+            self.outstanding[node.parent] -= 1
+            if self.outstanding[node.parent] == 0:
+                self.ready.append(node.parent)
 
+    def Quiet_Ticks(self):
+        #Returns the number of time-steps, starting with the current one, during which the node checks, node advances and routing
+        #would all do nothing, so the droplets simply follow their planned routes. Returns 0 if a decision is needed right now.
+        #The next decision is due when a node timer expires or a droplet finishes its route. Merges, removals and reactions
+        #are also events, but the Lab stops on its own when one of those happens.
+        horizon = []
+        
+        #Droplets without a route that aren't locked and aren't at their destinations get routed every time-step
+        for dp in self.lab.droplets:
+            if dp.Is_Routed():
+                horizon.append(len(dp.route))
+            elif not dp.locked and not dp.At_Dest():
+                return 0
+            
+        for node in self.current_nodes:
+            #Nodes that have yet to start need to collect their children's droplets
+            if node.inst_i == -1:
+                return 0
+            
+            if node.waiting:
+                #A waiting node retries its instruction every time-step. That does nothing as long as
+                #all of its species are already on hand and at least one of its droplets is still en route.
+                keys = list(node.droplets.keys())
+                inst = node.inst_list[node.inst_i]
+                if any(type(x) == int and x >= len(keys) for x in inst[1:]):
+                    return 0
+                species_list = [keys[x] if (type(x) == int) else tuple(x) for x in inst[1:]]
+                if any(key not in node.droplets or node.droplets[key] not in node.active_droplets for key in species_list):
+                    return 0
+                if all(dp.At_Dest() for dp in node.droplets.values()):
+                    return 0
+                continue
+            
+            #Droplets that have left the lab are removed from the node during the progress check
+            if any(dp.to_delete for dp in node.droplets.values()):
+                return 0
+            
+            if node.Concluded():
+                #Concluded nodes shunt any of their droplets that aren't on the move already
+                if any(not (dp.Is_Routed() or dp.shunting) for dp in node.droplets.values()):
+                    return 0
+            elif node.timer:
+                horizon.append(node.timer - self.time)
+            elif not node.In_Progress():
+                return 0
+        
+        if horizon == []:
+            return 0
+        return max(0, min(horizon))
+    
     def Check_Node_Progress(self, node):
         #Checks on the node's progress in its current instruction.
         
@@ -191,6 +356,7 @@ class Scheduler():
         
         #If has concluded all of its instructions, do nothing other than shunt its droplets away from crucial real estate
         if node.Concluded():
+            self.Node_Concluded(node)
             self.Shunt(node, exclude_active=False)
             return
         
@@ -265,8 +431,9 @@ class Scheduler():
                 #Choose a site
                 dest = self.Find_Work_Location(dps[0].Get_Loc(), inst_type[:-5], node, droplets=dps)
                 
-                #If no site viable site was found yet
+                #If no site viable site was found yet, move idle droplets off the sites so one frees up
                 if not dest:
+                    self.Shunt_Site_Holders(inst_type[:-5])
                     node.waiting = True
                     return
                 
@@ -347,45 +514,75 @@ class Scheduler():
         #The only difference in their treatment is that the current location of a droplet in the same collision group is excluded IF it is also at its destination.
         #This allows droplets that are meant to merge on the same site to come in one at a time and settle there, but they won't collide mid-route.
                 
-        #Get a set of the collision groups, but use shallow copies
-        a = [copy.copy(dp.collision_group) for dp in dps]
-        groups = []
-        [groups.append(grp) for grp in a if grp not in groups];
-        
-        #Order the groups by max distance to destination within each group, descending
-        groups.sort(key = lambda grp: max(Dist(dp.Get_Loc(), dp.Get_Dest()) for dp in grp if not dp.Is_Routed()), reverse=True)
+        #Get the distinct collision groups in order of first appearance. Groups hash by identity, so a dict collects them in one pass.
+        #The members are copied into plain lists so that sorting them below doesn't reorder the groups themselves.
+        groups = list(dict((dp.collision_group, None) for dp in dps))
+        groups = [list(grp) for grp in groups]
+        to_route = set(dps)
+        deferred_last = set(self.deferred)
+        
+        #The droplets don't move during the routing stage, so each distance to destination only needs to be computed once
+        dists = {}
+        def Dist_To_Dest(dp):
+            if dp not in dists:
+                dists[dp] = Dist(dp.Get_Loc(), dp.Get_Dest())
+            return dists[dp]
+        
+        #Order the groups by max distance to destination within each group, descending.
+        #Groups with droplets that were deferred last time-step go first so that they can't be starved of the routing budget.
+        groups.sort(key = lambda grp: (any(dp in deferred_last for dp in grp), max(Dist_To_Dest(dp) for dp in grp if not dp.Is_Routed())), reverse=True)
+        
+        #The A* search steps left in this time-step's routing budget, if there is one
+        remaining = self.route_budget
+        deferred = []
+        
+        #Cache the encoded blocks of each droplet's route and current location, since these don't change
+        #during the routing stage except when a droplet in this loop gets a new route.
+        route_codes = {}
+        loc_codes = {}
         
         for grp in groups:
             #Order the droplets in the group by distance to destination, ascending.
-            grp.sort(key = lambda dp: Dist(dp.Get_Loc(), dp.Get_Dest()))
+            grp.sort(key = Dist_To_Dest)
             
             #Loop over the droplets in the group
             for index, dp in enumerate(grp):
                 
                 #Skip droplets that don't need to be routed right now
-                if dp not in dps:
+                if dp not in to_route:
+                    continue
+                
+                #Once the routing budget has run out, put off the remaining droplets to the next time-step
+                if remaining is not None and remaining <= 0:
+                    deferred.append(dp)
                     continue
                 
                 dp.delay_amount = 0
                 first_or_2nd_route = 1
         
-                #Get all the locations blocked by the routes of other droplets
-                blocked = [(*x, odp) for odp in self.lab.droplets for step in odp.route for x in Get_Blocked(step, odp.Get_Shape(), odp.Get_Shell()) if odp is not dp]
-                
-                #Add the locations blocked by their starting locations, whether they're moving or not.
-                blocked += [(*x, odp) for odp in self.lab.droplets for x in Get_Blocked((self.time, *odp.Get_Loc()), odp.Get_Shape(), odp.Get_Shell()) if odp is not dp]
+                #Get all the locations blocked by the routes of other droplets,
+                #plus the locations blocked by their starting locations, whether they're moving or not.
+                #These are kept as arrays of encoded (time, x, y) integers, see Encode_Blocked.
+                others = [odp for odp in self.lab.droplets if odp is not dp]
+                for odp in others:
+                    if odp not in route_codes:
+                        route_codes[odp] = Get_Blocked_Codes([step[:3] for step in odp.route], odp.Get_Shape(), odp.Get_Shell(), self.grid_dim)
+                    if odp not in loc_codes:
+                        loc_codes[odp] = Get_Blocked_Codes([(self.time, *odp.Get_Loc())], odp.Get_Shape(), odp.Get_Shell(), self.grid_dim)
+                codes = np.concatenate([np.zeros(0, dtype=np.int64)] + [route_codes[odp] for odp in others] + [loc_codes[odp] for odp in others])
+                owners = np.concatenate([np.zeros(0, dtype=int)] + [np.full(len(route_codes[odp]), i) for i, odp in enumerate(others)] + [np.full(len(loc_codes[odp]), i) for i, odp in enumerate(others)])
                 
                 #Find the latest time that dp's destination is blocked by ANY other droplet.
-                try:
-                    delay_data = max([x for x in blocked if x[1:3] == dp.Get_Dest()], key = lambda x: x[0])
-                    # print("Maximum blocked time for dp number {} carrying {} is".format(dp.index, dp.species), delay)
-                except:
-                    delay_data = (0, None, None, None)
+                latest = Latest_Blocked(codes, dp.Get_Dest(), self.grid_dim)
+                if latest is None:
+                    delay_data = (0, None)
+                else:
+                    delay_data = (Decode_Time(codes[latest], self.grid_dim), others[owners[latest]])
                     
                 #Calculate a delay estimate of up to 4 + (# of steps into the future that destination is blocked) - (# of steps to destination in Manhattan distance)
                 #This means it can't possibly arrive near the destination until after it's no longer blocked. Thus it won't be loitering around the area.
                 delay = max(0, 1 + (delay_data[0] - self.time) - Dist(dp.Get_Loc(), dp.Get_Dest()))
-                dp.delayed_by = delay_data[3]
+                dp.delayed_by = delay_data[1]
                 dp.delay_amount = delay
                 
                 #Get the permanently blocked locations for droplets that may be stationary, or simply haven't yet planned their routes
@@ -408,11 +605,10 @@ class Scheduler():
                     perm_blocked += [pair for pair in Get_Blocked(odp.route[-1][1:3], shape = odp.Get_Shape(), shell = odp.Get_Shell())]
                 
                 #Convert to sets so that it is faster to check membership
-                blocked = set(blocked)
+                blocked = Blocked_Set(codes, self.grid_dim)
                 perm_blocked = set(perm_blocked)
                 
-                dp.Set_Blocks(blocked, perm_blocked) #record which droplets are doing the blocking
-                blocked = [x[0:3] for x in blocked] #Now drop the droplets
+                dp.Set_Blocks(blocked, perm_blocked) #record the blocks this droplet faces
                 
                 #If the destination is perm-blocked, just skip this droplet.
                 conglom_shape = dp.Get_Shape(True)
@@ -441,12 +637,17 @@ class Scheduler():
 
                     
                     #Now route the droplet
+                    #The search may not take more steps than the grid could reasonably call for, nor more than the routing budget has left.
+                    #The first droplet routed in each time-step is exempt from the budget, so that routes longer than the whole budget still get found.
                     limit = 2*self.lab.grid_dim[0]*self.lab.grid_dim[1]
+                    budget_limited = remaining is not None and remaining < limit and remaining < self.route_budget
                     first_or_2nd_route = 1
-                    dp.cannot_route, route1, endpoint, visit_count = Get_Route(grid_shape=self.lab.grid_dim, start=dp.Get_Loc(), end=dp.Get_Dest(), prior_radius=prior_radius, dp_radius=dp.Get_Radius(), blocked=blocked, perm_blocked=perm_blocked, start_time=self.time, delay=delay, limit=limit)
+                    dp.cannot_route, route1, endpoint, visit_count = Get_Route(grid_shape=self.lab.grid_dim, start=dp.Get_Loc(), end=dp.Get_Dest(), prior_radius=prior_radius, dp_radius=dp.Get_Radius(), blocked=blocked, perm_blocked=perm_blocked, start_time=self.time, delay=delay, limit=remaining if budget_limited else limit)
 
                     #Track some data for analysis later
                     self.astar_visits += visit_count
+                    if remaining is not None:
+                        remaining -= visit_count
                     self.most_visits = max(self.most_visits, visit_count)
                     self.astar_calls += 1
                     
@@ -467,9 +668,30 @@ class Scheduler():
                         tot_rad = np.sqrt((prior_area + dp.area))/np.pi
                         _, route2, _, visit_count = Get_Route(grid_shape=self.lab.grid_dim, start=endpoint, end=dp.Get_Dest(), prior_radius=0, dp_radius=tot_rad, blocked=blocked, perm_blocked=perm_blocked, start_time=route1[-1][0]+1, delay=0, limit=limit)
                         self.astar_visits += visit_count
+                        if remaining is not None:
+                            remaining -= visit_count
                     else:
                         route2 = [(route1[-1][0] + 1, *endpoint)]
                         
+                except Route_Limit_Exceeded as e:
+                    #The search steps spent count against the budget either way, and a first route cut short is still a call
+                    self.astar_visits += e.steps
+                    if remaining is not None:
+                        remaining -= e.steps
+                    if first_or_2nd_route == 1:
+                        self.most_visits = max(self.most_visits, e.steps)
+                        self.astar_calls += 1
+                    
+                    #If it was the routing budget that ran out, try again next time-step
+                    if budget_limited and first_or_2nd_route == 1:
+                        deferred.append(dp)
+                        continue
+                    
+                    #Otherwise the search ran past its own limit, so there is probably no easily determinable route.
+                    print("Droplet index {} carrying {} exceeded the search step limit on route number {} at time {}.".format(dp.index, dp.Get_Key(), first_or_2nd_route, self.time))
+                    self.failed_routes += 1
+                    continue
+                    
                 except AssertionError as e:
                     raise e
                     #If it failed to find a valid route, send a warning and skip it. Try to route it again next round.
@@ -480,6 +702,13 @@ class Scheduler():
                     continue
 
                 dp.Set_Route(route1 + route2, time = self.time)   
+                route_codes.pop(dp, None)
+        
+        #Report the droplets that will have to wait for next time-step's routing budget
+        self.deferred = deferred
+        self.deferred_routes += len(deferred)
+        if deferred and self.verbose > 0:
+            print("Routing budget used up at time {}. Deferring {} droplet(s) to the next round.".format(self.time, len(deferred)))
                 
     def Send_Movement_Commands(self, status_update = True, makeplot = False, saveplot = False, wait_time = 2, ax = None):
         #Collects the activation list needed to step forward all the droplets along their routes and sends it to the lab.
@@ -501,25 +730,26 @@ class Scheduler():
             # options = [x for x in self.pull_data[species[0]]['loc'] if all(not self.Forbidden_Gridpoint(indices=Z, radius=radius)[0] for Z in Get_Blocked(x, shape=shape, shell=[]))]
             if len(self.pull_data[species[0]]['loc']) == 0:
                 raise AssertionError('{} has no pull sites: {}'.format(species[0], self.pull_data[species[0]]))
-            options = [x for x in self.pull_data[species[0]]['loc'] if not self.Forbidden_Gridpoint(indices=x, radius=radius)[0]]
         else:
             raise AssertionError('Trying to pull an invalid species: {}'.format(species))
         
         # blocked = set([pair for dp in self.lab.droplets for step in dp.route for pair in Get_Blocked(step[1:3], shape = dp.Get_Shape(), shell = dp.Get_Shell())]) 
         # options = [x for x in options if x not in blocked]
         
-        if options == []:
-            # print("Cannot pull {} this round.".format(species))
-            return False
-        
         #Try to pick the closest pull option to the other droplets in the node,
         #otherwise just choose one at random. 
         if node.active_droplets != []:
-            #By default, try to pull closest to an active droplet
-            loc = min(options, key=(lambda z: Dist(z, node.active_droplets[-1].Get_Loc())))
+            #By default, try to pull closest to an active droplet.
+            #The site index only checks the reservoirs in order of distance until it finds one that isn't forbidden.
+            loc = self.sites.Nearest_Reservoir(species[0], node.active_droplets[-1].Get_Loc(), available=lambda x: not self.Forbidden_Gridpoint(indices=x, radius=radius)[0])
         else:
             #Otherwise, pick a random option
-            loc = random.choice(options)
+            options = [x for x in self.sites.Sites(species[0]) if not self.Forbidden_Gridpoint(indices=x, radius=radius)[0]]
+            loc = random.choice(options) if options else None
+        
+        if loc is None:
+            # print("Cannot pull {} this round.".format(species))
+            return False
         
         #Generate the pull command and the electrostatic command
         self.lab.Add_Commands(dict(pull_indices = [loc], keys = [species], nodes = [node]))
@@ -534,19 +764,14 @@ class Scheduler():
         tot_area = sum(dp.area for dp in droplets)
         radius = np.sqrt(tot_area/np.pi)
         
-        #Start by getting a list of all locations capable of the given instruction type.
-        options_a = [inst_loc[1:] for inst_loc in self.inst_locs if inst_loc[0] == inst_type][0]
-        
-        #Find locations that are at a safe distance from any forbidden sites
-        options_b = [pair for pair in options_a if not self.Forbidden_Gridpoint(indices = pair, allowed_droplets = droplets, node = node, radius = radius)[0]]
-                
-        #Get the location with the minimum distance to loc, unless the list is empty.
-        if options_b == []:
+        #Get the location capable of the given instruction type with the minimum distance to loc
+        #that is also at a safe distance from any forbidden sites, if there is one.
+        site = self.sites.Nearest_Work_Site(inst_type, loc, available=lambda pair: not self.Forbidden_Gridpoint(indices = pair, allowed_droplets = droplets, node = node, radius = radius)[0])
+        if site is None:
             if self.verbose > 1:
                 print("No {} site options this round!".format(inst_type))
             return False
-        else:
-            return min(options_b, key=lambda x: Dist(x, loc))
+        return site
         
     def Forbidden_Gridpoint(self, indices, droplet = None, allowed_droplets = [], node = None, radius = None):
         #Returns true if a given gridpoint or its neighbors are forbidden
@@ -567,7 +792,7 @@ class Scheduler():
         F = [x.Is_Forbidden(dp=droplet, allowed_droplets=allowed_droplets, node=node) for x in gridpoints]
         
         #Are any of them on the prescheduled paths of any droplets?
-        on_path = indices in set([pair for dp in self.lab.droplets for step in dp.route for pair in Get_Blocked(step[1:3], shape = dp.Get_Shape(), shell = dp.Get_Shell())])
+        on_path = self.lab.route_footprint.Covers(indices)
 
         #Return a boolean, plus the offending droplets if any        
         return on_path or any([x[0] for x in F]), [drop for x in F for drop in x[1] if drop is not None]
@@ -601,16 +826,7 @@ class Scheduler():
     def Generate_Active_Gridpoints(self, dp):
         #Determines which gridpoints to activate in order to move the droplet to the first position on its route.
         #If the droplet has no route, activate all its currently-occupied gridpoints, excluding edges, to hold it in place.
-
-        gp_indices = dp.Get_Shadow(region='interior', asindex=True)
-        if not dp.route:
-            return gp_indices
-        
-        #Find the direction the droplet is moving
-        target = dp.route[0][1:3]
-        X,Y = target - np.array(dp.Get_Loc())
-            
-        return [(x + X, y + Y) for (x,y) in gp_indices]
+        return dp.Get_Activation()
         
     def Merge(self, grp = []):
         #Sets the droplets in the group to merge.
@@ -626,31 +842,63 @@ class Scheduler():
     def Allow_Collisions(self, grp):
         #Sets the collision group for each droplet in the group,
         #allowing exceptions for them to collide when routing.
+        grp = Collision_Group(grp)
         for dp in grp:
             dp.Set_Collision_Group(grp)
             
     def Shunt(self, node, exclude_active = False):
-        #Shunts all the droplets in the node to random locations in the grid that aren't currently occupied
+        #Shunts all the droplets in the node to the nearest free parking slots that aren't currently occupied
         #or required for droplet pulling, gibson assembly, etc.
         
         #If the droplet is already  or is excluded because it's active, skip over it
         for dp in list(node.droplets.values()):  
             if dp.Is_Routed() or dp.shunting or (exclude_active and dp in node.active_droplets):
                 continue
+            self.Shunt_Droplet(node, dp)
             
-            #Generate a random non-forbidden location
-            rad = dp.Get_Radius()
-            options = [key for key in self.lab.grid if (2 + rad < key[0] < self.lab.grid_dim[0] - rad - 2) and (2 + rad < key[1] < self.lab.grid_dim[1] - rad - 2)]
-            choices = []
-            for i in range(50):
-                option = random.choice(options)
-                if (not self.Forbidden_Gridpoint(option, radius=dp.Get_Radius())[0]) and not any(x in self.all_sites for x in Get_Blocked(option, dp.Get_Shape(), dp.Get_Shell())):
-                    choices.append(option)
-            if choices != []:
-                dest = min(choices, key=lambda x: Dist(dp.Get_Loc(), x))
-                self.Node_Select(node, dest, dp.Get_Shape(), dp.Get_Shell())
-                dp.Set_Dest(dest, shunting = True)
-                self.dest_sets += 1
+    def Shunt_Droplet(self, node, dp):
+        #Sends one of the node's droplets to the nearest free, non-forbidden parking slot.
+        #The slots already keep clear of the reservoirs and reaction sites.
+        rad = dp.Get_Radius()
+        dest = self.parking.Find_Slot(dp.Get_Loc(), dp.area, accept=lambda x: not self.Forbidden_Gridpoint(x, radius=rad)[0])
+        if dest is not None:
+            self.parking.Park(dest, dp)
+        else:
+            #The lattice is sparse for large droplets, so if none of its slots near the droplet are usable
+            #fall back to the nearest of a few random non-forbidden locations clear of the sites
+            dest = self.Random_Shunt_Location(dp)
+            if dest is None:
+                return
+        self.Node_Select(node, dest, dp.Get_Shape(), dp.Get_Shell())
+        dp.Set_Dest(dest, shunting = True)
+        self.dest_sets += 1
+        
+    def Random_Shunt_Location(self, dp):
+        #Generate random non-forbidden locations and return the one closest to the droplet, or None
+        rad = dp.Get_Radius()
+        options = [key for key in self.lab.grid if (2 + rad < key[0] < self.lab.grid_dim[0] - rad - 2) and (2 + rad < key[1] < self.lab.grid_dim[1] - rad - 2)]
+        choices = []
+        for i in range(50):
+            option = random.choice(options)
+            if (not self.Forbidden_Gridpoint(option, radius=rad)[0]) and not any(x in self.all_sites for x in Get_Blocked(option, dp.Get_Shape(), dp.Get_Shell())):
+                choices.append(option)
+        if choices == []:
+            return None
+        return min(choices, key=lambda x: Dist(dp.Get_Loc(), x))
+            
+    def Shunt_Site_Holders(self, inst_type):
+        #Shunts the idle droplets that keep the sites of the given instruction type from being selected.
+        #A node's finished products wait wherever their last instruction left them, which is usually a work site,
+        #until the node's next instruction moves them on. If every site is held like that, the nodes waiting
+        #for a site would wait forever, so the holders are parked elsewhere instead.
+        owners = dict((dp, node) for node in self.current_nodes for dp in node.droplets.values())
+        for site in self.sites.Sites(inst_type):
+            gridpoint = self.lab.grid[tuple(site)]
+            for dp in gridpoint.droplets + gridpoint.occluded_by:
+                node = owners.get(dp)
+                if node is None or dp in node.active_droplets or dp.locked or dp.Is_Routed() or dp.shunting:
+                    continue
+                self.Shunt_Droplet(node, dp)
             
     def Node_Select(self, node, loc, shape, shell = []):
         #Records the selection of a given site and surrounding area, depending on droplet shape, for a given node.
@@ -689,6 +937,56 @@ def Get_Blocked(coords, shape, shell):
         blocked = [(coords[0] + X, coords[1] + Y) for (X, Y) in shape + shell]
     return blocked
         
+def Encode_Blocked(t, x, y, grid_dim):
+    #Encodes (time, x, y) coordinates as single integers. Works elementwise on numpy arrays as well.
+    #The spatial coordinates are padded by a full grid width on every side, which keeps the encoding one-to-one
+    #for everything near enough to the grid to matter.
+    width, height = 3*grid_dim[0], 3*grid_dim[1]
+    return (t*width + x + grid_dim[0])*height + y + grid_dim[1]
+
+def Decode_Time(code, grid_dim):
+    #Recovers the time from an encoded (time, x, y) coordinate
+    return int(code // (9*grid_dim[0]*grid_dim[1]))
+
+def Get_Blocked_Codes(steps, shape, shell, grid_dim):
+    #Vectorized version of Get_Blocked for a whole list of (time, x, y) steps at once, e.g. an entire route.
+    #Returns a numpy array of the coordinates blocked at times t-1, t and t+1, encoded with Encode_Blocked.
+    steps = np.array(steps, dtype=np.int64).reshape(-1, 3)
+    offsets = np.array(shape + shell, dtype=np.int64).reshape(-1, 2)
+    t = steps[:, 0, None, None] + np.array([0, 1, -1])[None, :, None]
+    x = steps[:, 1, None, None] + offsets[None, None, :, 0]
+    y = steps[:, 2, None, None] + offsets[None, None, :, 1]
+    t, x, y = np.broadcast_arrays(t, x, y)
+    
+    #Anything more than a grid width off the grid can't block a route, so drop it rather than let its encoding alias
+    keep = (-grid_dim[0] <= x) & (x < 2*grid_dim[0]) & (-grid_dim[1] <= y) & (y < 2*grid_dim[1])
+    return Encode_Blocked(t[keep], x[keep], y[keep], grid_dim)
+
+def Latest_Blocked(codes, loc, grid_dim):
+    #Returns the position in the codes array of the latest block at the (x, y) location loc, or None if it is never blocked.
+    #Codes at the same location sort by time, so the latest block is simply the largest code.
+    hits = np.flatnonzero(codes % (9*grid_dim[0]*grid_dim[1]) == Encode_Blocked(0, loc[0], loc[1], grid_dim))
+    if len(hits) == 0:
+        return None
+    return hits[np.argmax(codes[hits])]
+
+class Blocked_Set():
+    #Set of blocked (time, x, y) coordinates stored as encoded integers, see Encode_Blocked.
+    #Supports the membership checks that the AStar library makes without a tuple for every blocked coordinate.
+    def __init__(self, codes, grid_dim):
+        self.grid_dim = (int(grid_dim[0]), int(grid_dim[1]))
+        self.codes = set(np.unique(codes).tolist())
+        
+    def __contains__(self, coords):
+        t, x, y = coords[0], coords[1], coords[2]
+        width, height = self.grid_dim
+        if not (-width <= x < 2*width and -height <= y < 2*height):
+            return False
+        return Encode_Blocked(t, x, y, self.grid_dim) in self.codes
+    
+    def __len__(self):
+        return len(self.codes)
+        
 def Get_Occupied(indices, shape, grid_dim):
     x,y = indices
     return [(x + X, y + Y) for (X, Y) in shape if 0 <= (x + X) < grid_dim[0] and 0 <= (y + Y) < grid_dim[1]]
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial lookup structures used by the Scheduler.
+
+The Bucket_Index sorts a fixed set of gridpoint locations into square buckets so that the nearest
+location satisfying some condition can be found by searching outward from the query point one ring
+of buckets at a time, rather than by scanning every location.
+
+The Parking_Lot uses Bucket_Indexes to hand out shunting destinations. For each droplet size it precomputes
+a lattice of parking slots that keep clear of the reservoirs and reaction sites, and tracks which of them are
+currently claimed by a shunted droplet.
+
+The Site_Index keeps a Bucket_Index for each type of reaction site and for each species' reservoirs,
+so the nearest available site of a given type can be found without checking every site of that type.
+
+"""
+import heapq
+import numpy as np
+from Lab import Calculate_Shape, Calculate_Shell
+
+class Bucket_Index():
+    #A grid-bucketed spatial index over a fixed list of (x, y) locations.
+    #Answers nearest-location queries in Manhattan distance by expanding outward ring by ring.
+    #Ties in distance go to the location that was added first, the same as taking the min over the original list.
+
+    def __init__(self, locs, bucket_size = 8):
+        self.bucket_size = bucket_size
+        self.buckets = {}   #Maps bucket coordinates to the list of (insertion order, location) pairs inside that bucket
+        self.bounds = None  #The lowest and highest bucket coordinates in use, (min_x, min_y, max_x, max_y)
+        self.size = 0
+        for loc in locs:
+            self.Add(loc)
+
+    def Add(self, loc):
+        #Adds a location to the index.
+        key = self.Bucket(loc)
+        self.buckets.setdefault(key, []).append((self.size, tuple(loc)))
+        self.size += 1
+        if self.bounds is None:
+            self.bounds = (*key, *key)
+        else:
+            self.bounds = (min(self.bounds[0], key[0]), min(self.bounds[1], key[1]), max(self.bounds[2], key[0]), max(self.bounds[3], key[1]))
+
+    def Bucket(self, loc):
+        #Returns the coordinates of the bucket holding the given location
+        return (loc[0] // self.bucket_size, loc[1] // self.bucket_size)
+
+    def Ring(self, center, r):
+        #Returns the keys of the non-empty buckets in the square ring of radius r around the center bucket.
+        cx, cy = center
+        if r == 0:
+            keys = [center]
+        else:
+            keys = [(cx + X, cy + Y) for X in range(-r, r + 1) for Y in (-r, r)]
+            keys += [(cx + X, cy + Y) for X in (-r, r) for Y in range(-r + 1, r)]
+        return [key for key in keys if key in self.buckets]
+
+    def Nearest(self, loc, accept = None, trials = None):
+        #Returns the location closest to loc for which accept(location) is True, or None if there is none.
+        #The candidates are tested in order of increasing distance. If trials is given, give up after that many rejections.
+        if self.size == 0:
+            return None
+
+        center = self.Bucket(loc)
+        min_x, min_y, max_x, max_y = self.bounds
+        max_ring = max(center[0] - min_x, max_x - center[0], center[1] - min_y, max_y - center[1])
+        heap = []
+        rejected = 0
+
+        for r in range(max_ring + 2):
+            #Every location in ring r or beyond is at least this far away, so anything in the heap
+            #that is closer than this can be tested now without missing a closer or earlier-added option.
+            bound = (r - 1)*self.bucket_size + 1 if r > 0 else 0
+            while heap and (heap[0][0] < bound or r > max_ring):
+                dist, order, candidate = heapq.heappop(heap)
+                if accept is None or accept(candidate):
+                    return candidate
+                rejected += 1
+                if trials is not None and rejected >= trials:
+                    return None
+
+            if r <= max_ring:
+                for key in self.Ring(center, r):
+                    for order, candidate in self.buckets[key]:
+                        heapq.heappush(heap, (Dist(candidate, loc), order, candidate))
+        return None
+
+class Parking_Lot():
+    #Precomputed shunting destinations, grouped by droplet area.
+    #Slots sit on a lattice spaced widely enough that parked droplets leave corridors between them,
+    #and no slot's footprint touches a reservoir or reaction site.
+
+    def __init__(self, grid_dim, avoid, bucket_size = 8):
+        self.grid_dim = grid_dim
+        self.avoid = set(avoid)     #Locations that no parked droplet may cover, i.e. pull sites and reaction sites
+        self.bucket_size = bucket_size
+        self.lots = {}      #Maps droplet area to a Bucket_Index of parking slots for that area
+        self.parked = {}    #Maps a claimed slot to the droplet that claimed it
+
+    def Get_Lot(self, area):
+        #Returns the slot index for droplets of the given area, building it the first time it is needed.
+        if area not in self.lots:
+            self.lots[area] = Bucket_Index(self.Calculate_Slots(area), bucket_size = self.bucket_size)
+        return self.lots[area]
+
+    def Calculate_Slots(self, area):
+        #Lays out a lattice of slots for droplets of the given area.
+        rad = np.sqrt(area/np.pi)
+        footprint = Calculate_Shape(area) + Calculate_Shell(area)
+        extent = max(max(abs(X), abs(Y)) for (X, Y) in footprint)
+        spacing = 2*extent + 3
+
+        #Keep the same margin from the edge of the grid that the old random shunting used
+        low = int(np.floor(2 + rad)) + 1
+        high = [int(np.ceil(self.grid_dim[i] - rad - 2)) for i in range(2)]
+        #Center the lattice so that the leftover margin is split between both edges
+        start = [low + ((high[i] - 1 - low) % spacing)//2 for i in range(2)]
+        slots = []
+        for x in range(start[0], high[0], spacing):
+            for y in range(start[1], high[1], spacing):
+                if not any((x + X, y + Y) in self.avoid for (X, Y) in footprint):
+                    slots.append((x, y))
+        return slots
+
+    def Is_Free(self, slot):
+        #A slot is free unless the droplet that claimed it still exists and is still headed for it
+        dp = self.parked.get(slot)
+        if dp is None:
+            return True
+        if dp.to_delete or not dp.shunting or dp.dest != slot:
+            del self.parked[slot]
+            return True
+        return False
+
+    def Find_Slot(self, loc, area, accept = None, trials = 50):
+        #Returns the free slot nearest to loc that also passes the accept check, or None.
+        return self.Get_Lot(area).Nearest(loc, accept = lambda slot: self.Is_Free(slot) and (accept is None or accept(slot)), trials = trials)
+
+    def Park(self, slot, dp):
+        #Records that the droplet has claimed the slot.
+        self.parked[slot] = dp
+
+class Site_Index():
+    #Spatial indexes over the lab's reaction sites, grouped by instruction type, and over its reservoirs, grouped by species.
+    #Whether a site is available changes every time-step, so availability is passed in as a check that is only
+    #run on candidate sites in order of increasing distance, stopping at the first available one.
+
+    def __init__(self, grid_dim, inst_locs, pull_data):
+        self.grid_dim = grid_dim
+        self.work_sites = {}    #Maps each instruction type to a Bucket_Index of the sites that can execute it
+        self.reservoirs = {}    #Maps each species to a Bucket_Index of the reservoirs it can be pulled from
+        self.locs = {}          #Maps each instruction type or species to its sites in their original order
+        for inst_loc in inst_locs:
+            self.work_sites[inst_loc[0]] = self.Build(inst_loc[1:])
+            self.locs[inst_loc[0]] = list(inst_loc[1:])
+        for species in pull_data:
+            self.reservoirs[species] = self.Build(pull_data[species]['loc'])
+            self.locs[species] = list(pull_data[species]['loc'])
+
+    def Build(self, locs):
+        #Returns a Bucket_Index over the given sites. The buckets are sized so that there is roughly one site per bucket
+        #if the sites were spread evenly, which keeps the ring search short for both a handful of sites and many of them.
+        bucket_size = max(8, int(np.ceil(max(self.grid_dim)/np.sqrt(max(len(locs), 1)))))
+        return Bucket_Index(locs, bucket_size = bucket_size)
+
+    def Sites(self, site_type):
+        #Returns all the sites of the given instruction type or species, in their original order.
+        return self.locs.get(site_type, [])
+
+    def Nearest_Work_Site(self, inst_type, loc, available = None):
+        #Returns the site for the given instruction type closest to loc that passes the available check, or None.
+        if inst_type not in self.work_sites:
+            return None
+        return self.work_sites[inst_type].Nearest(loc, accept = available)
+
+    def Nearest_Reservoir(self, species, loc, available = None):
+        #Returns the reservoir of the given species closest to loc that passes the available check, or None.
+        if species not in self.reservoirs:
+            return None
+        return self.reservoirs[species].Nearest(loc, accept = available)
+
+def Dist(a, b):
+    #Manhattan distance between two coordinate pairs.
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Per-tick timing of the Scheduler's main loop.
+
+A Tick_Log passed to Scheduler.Compile_Instructions (or Stream_Instructions) records where the wall time of every
+pass through the main loop went. The Scheduler and its Lab mark the end of each phase with Lap(phase), which
+adds the time since the previous lap to that phase. The phases are exclusive, so they add up to the pass's total:
+
+    progress        Scheduler.Check_Node_Progress
+    instructions    Scheduler.Advance_Node_Instructions
+    routing         Scheduler.Route_Droplets
+    movement        building and combining the movement commands
+    lab potentials  Lab.Advance: resetting and setting gridpoint potentials and instructions
+    lab pulls       Lab.Advance: pulling droplets from reservoirs
+    lab moves       Lab.Advance: moving the droplets
+    lab reactions   Lab.Advance: running the gridpoint processes
+    lab cleanup     Lab.Advance: deleting droplets and updating the step trackers
+    lab congestion  Lab.Advance: recording the congestion
+    status          the Lab's status updates and plots
+    fast-forward    finding and running stretches of quiet time-steps, besides the lab work above
+    keys            Scheduler.Update_Keys and Attach_Keys
+    node updates    resetting pulling sites and promoting finished nodes' parents
+    checkpoint      saving checkpoints
+    other           everything else in the pass
+
+With fast_forward, one pass can run several lab time-steps, which the ticks column counts. The log is kept as
+one compact array per column rather than one record per pass, so even very long runs cost little memory.
+Without a Tick_Log the Scheduler and Lab skip all of this.
+
+    log = Tick_Log()
+    sch.Compile_Instructions(tick_log = log)
+    log.Write('ticks.csv')
+
+"""
+import csv
+import os
+import time
+from array import array
+
+phases = ['progress', 'instructions', 'routing', 'movement', 'lab potentials', 'lab pulls', 'lab moves', 'lab reactions',
+          'lab cleanup', 'lab congestion', 'status', 'fast-forward', 'keys', 'node updates', 'checkpoint', 'other']
+counts = ['time', 'ticks', 'droplets', 'nodes']
+
+class Tick_Log():
+    #Columnar log of the time each pass through the Scheduler's main loop spent in each phase, in seconds.
+
+    def __init__(self):
+        self.columns = dict([(name, array('q')) for name in counts] + [(phase, array('d')) for phase in phases])
+        self.laps = dict.fromkeys(phases, 0.0)  #The phase times of the current pass
+        self.last = None    #The time of the last lap
+        self.lab_time = None    #The lab's time at the start of the current pass
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def Start(self, lab_time):
+        #Starts timing a pass through the main loop.
+        self.laps = dict.fromkeys(phases, 0.0)
+        self.lab_time = lab_time
+        self.last = time.perf_counter()
+
+    def Lap(self, phase):
+        #Adds the time since the previous lap to the given phase.
+        now = time.perf_counter()
+        self.laps[phase] += now - self.last
+        self.last = now
+
+    def End(self, lab_time, droplets, nodes):
+        #Finishes the pass, putting the time since the last lap under 'other', and appends its row.
+        self.Lap('other')
+        columns = self.columns
+        columns['time'].append(lab_time)
+        columns['ticks'].append(lab_time - self.lab_time)
+        columns['droplets'].append(droplets)
+        columns['nodes'].append(nodes)
+        for phase, elapsed in self.laps.items():
+            columns[phase].append(elapsed)
+
+    def Totals(self):
+        #Returns the total time spent in each phase over the whole run.
+        return dict((phase, sum(self.columns[phase])) for phase in phases)
+
+    def Write(self, path):
+        #Writes the log to a CSV file, one row per pass.
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        names = counts + phases
+        with open(path, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            for row in zip(*[self.columns[name] for name in names]):
+                writer.writerow(row[:len(counts)] + tuple('{:.7f}'.format(x) for x in row[len(counts):]))
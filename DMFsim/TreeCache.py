@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+An on-disk cache of assembly trees built by the Interpreter.
+
+Building the tree only depends on the gene data, the Gibson limit and the number of linkers, so repeated runs
+of the same scenario (benchmark rounds, or the same seed across machines) build the same tree every time.
+Cached_Build_Tree looks the tree up in a cache directory before building it, with either of the Interpreter's
+builders. The cache is content-addressed: each tree is stored under a hash of the Interpreter's source code,
+the cache format and the tree's inputs, so a changed input or any edit to the Interpreter simply misses the
+cache rather than loading a stale tree.
+
+The cached files are gzipped pickles of the root node and the node list, including every node's instruction
+list. Files are written under a temporary name and moved into place, so several processes, e.g. the workers
+of an ensemble run, can share one cache directory.
+
+    root, nodes = Cached_Build_Tree(data, 3, linkernum = 50, cache_dir = 'tree-cache')
+
+"""
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import Interpreter as Int
+
+#Bump this when the layout of the cached files changes.
+format_version = 2
+
+def Source_Hash(module):
+    #Returns a hash of a module's source file. Line endings are normalized, so a checkout with CRLF and one with LF agree.
+    with open(module.__file__, 'rb') as f:
+        return hashlib.sha256(f.read().replace(b'\r\n', b'\n')).hexdigest()
+
+#The trees, and the Node objects they are made of, are whatever the Interpreter's code makes them,
+#so any change to that code gets new keys.
+interpreter_hash = Source_Hash(Int)
+
+def Tree_Key(data, n, linkernum = None, sites = None, durations = None):
+    #Returns the hash that identifies the tree for the given inputs.
+    key = json.dumps([interpreter_hash, format_version, list(data), n, linkernum, sites, durations], sort_keys = True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def Tree_Path(cache_dir, key):
+    return os.path.join(cache_dir, key + '.tree')
+
+def Save_Tree(root, nodes, path):
+    #Writes the tree to the given path. Like checkpoints, it is written to a temporary file first,
+    #and the temporary name is unique so that concurrent writers never clobber each other's partial files.
+    fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(path) or '.', suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wb', compresslevel = 1) as f, Int.Collection_Paused():
+            pickle.dump((root, nodes), f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def Load_Tree(path):
+    #Reads a tree written by Save_Tree and returns the root node and the node list.
+    #As in Build_Tree, collection is paused while the many node objects are recreated.
+    with gzip.open(path, 'rb') as f, Int.Collection_Paused():
+        root, nodes = pickle.load(f)
+    return root, nodes
+
+def Build(data, n, linkernum = None, sites = None, durations = None):
+    #Builds the tree with Build_Tree, or with Build_Shaped_Tree if the number of reaction sites is given.
+    if sites is None:
+        return Int.Build_Tree(data, n, linkernum = linkernum)
+    return Int.Build_Shaped_Tree(data, n, sites = sites, durations = durations, linkernum = linkernum)
+
+def Cached_Build_Tree(data, n, linkernum = None, cache_dir = None, sites = None, durations = None):
+    #Drop-in replacement for Interpreter.Build_Tree, or Build_Shaped_Tree if sites is given,
+    #that consults the cache directory first. Without a cache directory, this just builds the tree.
+    if cache_dir is None:
+        return Build(data, n, linkernum, sites, durations)
+
+    path = Tree_Path(cache_dir, Tree_Key(data, n, linkernum, sites, durations))
+    if os.path.exists(path):
+        try:
+            return Load_Tree(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass    #An unreadable file is rebuilt and overwritten below
+
+    root, nodes = Build(data, n, linkernum, sites, durations)
+    os.makedirs(cache_dir, exist_ok = True)
+    Save_Tree(root, nodes, path)
+    return root, nodes
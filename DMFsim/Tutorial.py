@@ -25,20 +25,23 @@ It also makes a sequence of figures so you can watch the droplets moving in "rea
 In order to see the complete sequence of all lab commands in the proper order, print out
 the lab's history variable. It's going to be rather a rather lengthy list of dictionaries.
 The order index corresponds to the time at which that command dictionary was executed.
+To process the commands as they are produced instead, iterate over Scheduler.Stream_Instructions(), which yields
+(time, commands) pairs one time-step at a time. Create the Lab with keep_history = False to skip the history.
 
 """
 
 #Import the libraries. 
-from tkinter import W
 import Interpreter as Int
 from Scheduler import *
 from Lab import *
+from Checkpoint import Load_Checkpoint
+from TreeCache import Cached_Build_Tree
 import copy
 import random
 import sys
-import pandas
 import argparse
 import os
+import time
 
 
 #########################################################
@@ -47,17 +50,19 @@ import os
 #########################################################
 
 #A function to check if the lab output matches the input data
-def Check(lab, data):
+def Check(lab, data, verbose = True):
     if len(lab.droplets) != 1:
         return False
     checkdata = ''.join(''.join(data).split('_')[1::2])
     lab_output = ''.join(str(lab.droplets[0].species).split('_')[1::2])
     
     if checkdata == lab_output:
-        print('\nSuccess!')
+        if verbose:
+            print('\nSuccess!')
         return True
     else:
-        print('\nFailure.')
+        if verbose:
+            print('\nFailure.')
         return False
         
 #Generator for the coordinates around the boundary of the grid
@@ -97,87 +102,68 @@ def linker_ends():
 #and reservoirs from which you can pull droplets of the various symbols, linkers, etc.
 #No routing takes place here, this is all just setup.
 #########################################################
-random.seed(42)
-
-### Initialization stage ###
-
-#Set the gene's symbol length (The number of symbols to be assembled into a single gene)
-#and the lab grid width
-parser = argparse.ArgumentParser()
-parser.add_argument("--gridsize", type=int, default=50, help="the simulation's gridsize")
-parser.add_argument("--gene-length", type=int, default=5, help="the simulation's gene-length")
-parser.add_argument("--host-string", type=str, help="the machine's host name (used for exporting congestion data)")
-parser.add_argument("--round", type=int, help="the benchmarking round (used for exporting congestion data)")
-parser.add_argument("--gui", action='store_true', help="displays the GUI")
-args = parser.parse_args()
-
-width = args.gridsize
-datalen = args.gene_length
-host_string = args.host_string
-b_round = args.round
-gui = args.gui
-
-# Check if PCR and Purify sites can be allocated
-if int(width/16 - 1) == 0:
-    print('WARNING! PCR and Purify pull sites cannot be created if the gridsize is less than 32!')
-
-
-#Get a list of the interior grid coordinates.
-#This is where the reaction sites *could* be placed.
-coords = [(x,y) for x in range(4,width-4,4) for y in range(4,width-4,4)]
-
-num_gibson_sites = 5
-num_PCR_sites = 5
-num_purify_sites = 5
-gibson_limit = 3 #Assume 3 strands can be attached at a time, no more.
+def Setup_Lab(width, num_gibson_sites = 5, num_purify_sites = 5, num_PCR_sites = 5):
+    #Returns the instruction locations and pull data for a lab of the given width,
+    #plus the lists of symbol and linker names.
+    
+    # Check if PCR and Purify sites can be allocated
+    if int(width/16 - 1) == 0:
+        print('WARNING! PCR and Purify pull sites cannot be created if the gridsize is less than 32!')
+    
+    
+    #Get a list of the interior grid coordinates.
+    #This is where the reaction sites *could* be placed.
+    coords = [(x,y) for x in range(4,width-4,4) for y in range(4,width-4,4)]
+            
+    #Randomly select some points to act as gibson, purify and PCR sites.
+    # gibson += [(), (), ()]   #Your entries here  
+    # purify += [(), (), ()]   #Your entries here  
+    # PCR += [(), (), ()]   #Your entries here  
+    gibson = ['Gibson']
+    gibson += [coords.pop(random.randint(0, len(coords) - 1)) for i in range(num_gibson_sites)]
+    purify = ['Purify']
+    purify += [coords.pop(random.randint(0, len(coords) - 1)) for i in range(num_purify_sites)]
+    PCR = ['PCR']
+    PCR += [coords.pop(random.randint(0, len(coords) - 1)) for i in range(num_PCR_sites)]
+    
+    #Collect the instruction locations
+    inst_locs = [gibson, purify, PCR]
+    
+    #Define the base DNA species dictionary
+    #All symbols will have a left overhanging 'A' and right overhanging 'G'. 
+    base_dict = {'type':'DNA', 'ends':['A','G'], 'loc':[(0,0)], 'area':1}
+    
+    #Generate the symbols and their pull locations
+    gen = coordgen(width)
+    symbols = []
+    symbol_dicts = []
+    num_symbols = int(width/2) #This number is arbitrary
+    for i in range(num_symbols):
+        symbols.append('_S' + str(i) + '_')
+        d = copy.copy(base_dict)
+        d['loc'] = [next(gen)]
+        symbol_dicts.append(d)
         
-#Randomly select some points to act as gibson, purify and PCR sites.
-# gibson += [(), (), ()]   #Your entries here  
-# purify += [(), (), ()]   #Your entries here  
-# PCR += [(), (), ()]   #Your entries here  
-gibson = ['Gibson']
-gibson += [coords.pop(random.randint(0, len(coords) - 1)) for i in range(num_gibson_sites)]
-purify = ['Purify']
-purify += [coords.pop(random.randint(0, len(coords) - 1)) for i in range(num_purify_sites)]
-PCR = ['PCR']
-PCR += [coords.pop(random.randint(0, len(coords) - 1)) for i in range(num_PCR_sites)]
-
-#Collect the instruction locations
-inst_locs = [gibson, purify, PCR]
-
-#Define the base DNA species dictionary
-#All symbols will have a left overhanging 'A' and right overhanging 'G'. 
-base_dict = {'type':'DNA', 'ends':['A','G'], 'loc':[(0,0)], 'area':1}
-
-#Generate the symbols and their pull locations
-gen = coordgen(width)
-symbols = []
-symbol_dicts = []
-num_symbols = int(width/2) #This number is arbitrary
-for i in range(num_symbols):
-    symbols.append('_S' + str(i) + '_')
-    d = copy.copy(base_dict)
-    d['loc'] = [next(gen)]
-    symbol_dicts.append(d)
-    
-#Generate the linkers and their pull locations
-ends = linker_ends()
-linkers = []
-linker_dicts = []
-num_linkers = width #This is arbitrary
-for i in range(num_linkers):
-    linkers.append('L' + str(i))
-    d = copy.copy(base_dict)
-    d['loc'] = [next(gen)]
-    d['ends'] = next(ends)
-    linker_dicts.append(d)
-
-#Compile the pull data dictionary
-pull_data = dict(zip(symbols,symbol_dicts))
-pull_data.update(dict(zip(linkers,linker_dicts)))
-pull_data.update({'gibson_mix':{'type':'reagent', 'loc':[next(gen) for i in range(int(width/8 - 2))], 'area':1}})
-pull_data.update({'purify_mix':{'type':'reagent', 'loc':[next(gen) for i in range(int(width/16 - 1))], 'area':1}})
-pull_data.update({'PCR_mix':{'type':'reagent', 'loc':[next(gen) for i in range(int(width/16 - 1))], 'area':1}})
+    #Generate the linkers and their pull locations
+    ends = linker_ends()
+    linkers = []
+    linker_dicts = []
+    num_linkers = width #This is arbitrary
+    for i in range(num_linkers):
+        linkers.append('L' + str(i))
+        d = copy.copy(base_dict)
+        d['loc'] = [next(gen)]
+        d['ends'] = next(ends)
+        linker_dicts.append(d)
+    
+    #Compile the pull data dictionary
+    pull_data = dict(zip(symbols,symbol_dicts))
+    pull_data.update(dict(zip(linkers,linker_dicts)))
+    pull_data.update({'gibson_mix':{'type':'reagent', 'loc':[next(gen) for i in range(int(width/8 - 2))], 'area':1}})
+    pull_data.update({'purify_mix':{'type':'reagent', 'loc':[next(gen) for i in range(int(width/16 - 1))], 'area':1}})
+    pull_data.update({'PCR_mix':{'type':'reagent', 'loc':[next(gen) for i in range(int(width/16 - 1))], 'area':1}})
+    
+    return inst_locs, pull_data, symbols, linkers
 
 #########################################################
 #SECTION 3
@@ -185,55 +171,179 @@ pull_data.update({'PCR_mix':{'type':'reagent', 'loc':[next(gen) for i in range(i
 #This is where all the routing takes place.
 #########################################################
 
-#Generate the gene
-#Alternatively, you could manually enter the data as strings: ['_S0_', '_S4_', ...]
-data = [random.choice(symbols) for i in range(datalen)]  
-# data = ['','',''] #Your input here
-grid_dim = np.array([width, width])
-
-
-#This line calls the Interpreter and generates an assembly tree.
-#The assembly tree is a trinary tree structure that contains information
-#about the operations needed to assemble the given data, as well as the
-#ordering and which operations are parallelizable.
-root, nodes = Int.Build_Tree(data, gibson_limit, linkernum = len(linkers))
-
-#This line instantiates the virtual Lab object and all of its electrostatic gridpoints.
-#All commands that the router generates will be sent to the Lab for execution, and
-#the Lab will generate new results for the Router to use.
-grid_spacing = 1
-lab = Lab(grid_dim, grid_spacing, inst_locs, pull_data, record_congestion=True, verbose=True)
-
-# This line instantiates the Router, which reads in data concerning both the Lab
-#and the Interpreter's assembly tree.
-sch = Scheduler(nodes, inst_locs, pull_data, lab)
-
-#Finally, this line runs the routing function.
-#The Router moves one time-step at a time, directing droplets towards their destinations
-#and setting new destinations when they arrive.
-#One time-step corresponds to the time it takes a droplet to move one gridspace.
-sch.Compile_Instructions(makeplot=gui, wait_time=0.025, version=Int.version)
-# sch.Compile_Instructions(makeplot=False, wait_time=0.025, version=Int.version)
-
-#Check if it succeeded in generating the symbols you asked for.
-if Check(lab, data):
-    # export droplet count
-    if host_string is not None and b_round is not None:
-        total_droplets, max_droplet_count = lab.Get_Droplet_Counts()
-        congestion_history = lab.Get_Congestion_History()
-
-        gene_length_data_path = f'raw-data/{host_string}/'
-
-        # create data dir if necessary
-        if not os.path.isdir(gene_length_data_path):
-            os.makedirs(gene_length_data_path)
-
-        gene_length_data = [
-            ('total droplets', 'max droplets', 'max congestion'),
-            (total_droplets, max_droplet_count, max(congestion_history))
-        ]
-        pandas.DataFrame(tuple(gene_length_data)).to_csv(
-            f'{gene_length_data_path}cg-{datalen}-{b_round}.csv',
-            index=False,
-            header=False
-        )
+def Simulate(width = 50, datalen = 5, seed = 42, gui = False, fast_forward = False, verbose = True, record_congestion = True,
+             checkpoint_every = None, checkpoint_path = 'checkpoint-{time}.ckpt', resume_from = None, route_budget = None, keep_history = True,
+             tree_cache = None, shaped_tree = False, symbolic_chemistry = False, tick_log = None):
+    #Sets up a lab, builds the assembly tree for a random gene and runs the Scheduler on it.
+    #If resume_from names a checkpoint, the lab and scheduler are loaded from it instead and the run carries on from there.
+    #The gene is still generated from the seed, so the gridsize, gene length and seed must match the checkpointed run.
+    #If tree_cache names a directory, the assembly tree is looked up there before being built.
+    #If shaped_tree is True, the tree is shaped for the lab's number of reaction sites with Interpreter.Build_Shaped_Tree.
+    #If symbolic_chemistry is True, the lab looks reaction outcomes up in the assembly tree instead of working out the DNA chemistry.
+    #If tick_log is a Timing.Tick_Log, the time spent in each phase of every time-step is recorded in it.
+    #Returns the lab, the scheduler and the gene data.
+    random.seed(seed)
+    
+    #Set up the lab's reaction sites and reservoirs
+    inst_locs, pull_data, symbols, linkers = Setup_Lab(width)
+    gibson_limit = 3 #Assume 3 strands can be attached at a time, no more.
+    
+    #Generate the gene
+    #Alternatively, you could manually enter the data as strings: ['_S0_', '_S4_', ...]
+    data = [random.choice(symbols) for i in range(datalen)]  
+    # data = ['','',''] #Your input here
+    grid_dim = np.array([width, width])
+    
+    
+    #This line calls the Interpreter and generates an assembly tree.
+    #The assembly tree is a trinary tree structure that contains information
+    #about the operations needed to assemble the given data, as well as the
+    #ordering and which operations are parallelizable.
+    sites = min(len(locs) - 1 for locs in inst_locs) if shaped_tree else None
+    root, nodes = Cached_Build_Tree(data, gibson_limit, linkernum = len(linkers), cache_dir = tree_cache, sites = sites)
+    
+    #This line instantiates the virtual Lab object and all of its electrostatic gridpoints.
+    #All commands that the router generates will be sent to the Lab for execution, and
+    #the Lab will generate new results for the Router to use.
+    grid_spacing = 1
+    if resume_from is None:
+        reactions = Int.Reaction_Table(nodes) if symbolic_chemistry else None
+        lab = Lab(grid_dim, grid_spacing, inst_locs, pull_data, record_congestion=record_congestion, verbose=verbose, keep_history=keep_history,
+                  reactions=reactions)
+    
+        # This line instantiates the Router, which reads in data concerning both the Lab
+        #and the Interpreter's assembly tree.
+        sch = Scheduler(nodes, inst_locs, pull_data, lab, verbose=int(verbose), route_budget=route_budget)
+    else:
+        #Pick up the lab and Router exactly as they were when the checkpoint was saved
+        sch = Load_Checkpoint(resume_from)
+        lab = sch.lab
+        if tuple(lab.grid_dim) != tuple(grid_dim):
+            raise ValueError('Checkpoint {} is for a {} grid, not {}.'.format(resume_from, tuple(lab.grid_dim), tuple(grid_dim)))
+    
+    #Finally, this line runs the routing function.
+    #The Router moves one time-step at a time, directing droplets towards their destinations
+    #and setting new destinations when they arrive.
+    #One time-step corresponds to the time it takes a droplet to move one gridspace.
+    sch.Compile_Instructions(makeplot=gui, wait_time=0.025, version=Int.version, fast_forward=fast_forward,
+                             checkpoint_every=checkpoint_every, checkpoint_path=checkpoint_path, resume=resume_from is not None, tick_log=tick_log)
+    # sch.Compile_Instructions(makeplot=False, wait_time=0.025, version=Int.version)
+    
+    return lab, sch, data
+
+#The results that a symbolic chemistry run must share with the full chemistry run of the same scenario
+verified_fields = ['success', 'lab time', 'total droplets', 'max droplets', 'astar calls', 'astar visits', 'failed routes', 'deferred routes']
+
+def Run_Scenario(gridsize = 50, gene_length = 5, seed = 42, verify = False, **options):
+    #Library entry point: runs one scenario and returns a dictionary summarizing the outcome.
+    #The options are passed along to Simulate. Everything in the summary is plain data, so it can be
+    #sent back from a worker process.
+    #If verify is True and the scenario uses symbolic chemistry, it is run a second time with the full chemistry,
+    #and the summary's 'verified' entry says whether both runs came out the same.
+    if verify and options.get('symbolic_chemistry'):
+        results = Run_Scenario(gridsize, gene_length, seed, **options)
+        check = Run_Scenario(gridsize, gene_length, seed, **dict(options, symbolic_chemistry = False, tick_log = None))
+        results['verified'] = all(results[field] == check[field] for field in verified_fields)
+        return results
+    
+    start_time = time.time()
+    start_cpu = time.process_time()
+    lab, sch, data = Simulate(gridsize, gene_length, seed = seed, **options)
+    
+    total_droplets, max_droplet_count = lab.Get_Droplet_Counts()
+    congestion_history = lab.Get_Congestion_History()
+    return {
+        'gridsize': gridsize,
+        'gene length': gene_length,
+        'seed': seed,
+        'success': Check(lab, data, verbose = options.get('verbose', True)),
+        'lab time': lab.time,
+        'wall time': time.time() - start_time,
+        'cpu time': time.process_time() - start_cpu,
+        'total droplets': total_droplets,
+        'max droplets': max_droplet_count,
+        'max congestion': max(congestion_history) if congestion_history else None,
+        'astar calls': sch.astar_calls,
+        'astar visits': sch.astar_visits,
+        'failed routes': sch.failed_routes,
+        'deferred routes': sch.deferred_routes,
+    }
+
+if __name__ == '__main__':
+    ### Initialization stage ###
+    
+    #Set the gene's symbol length (The number of symbols to be assembled into a single gene)
+    #and the lab grid width
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gridsize", type=int, default=50, help="the simulation's gridsize")
+    parser.add_argument("--gene-length", type=int, default=5, help="the simulation's gene-length")
+    parser.add_argument("--seed", type=int, default=42, help="the seed for the random lab layout and gene")
+    parser.add_argument("--host-string", type=str, help="the machine's host name (used for exporting congestion data)")
+    parser.add_argument("--round", type=int, help="the benchmarking round (used for exporting congestion data)")
+    parser.add_argument("--gui", action='store_true', help="displays the GUI")
+    parser.add_argument("--fast-forward", action='store_true', help="lets the lab run through time-steps that need no scheduling decisions in bulk")
+    parser.add_argument("--checkpoint-every", type=int, help="saves the full simulation state every this many time-steps")
+    parser.add_argument("--checkpoint-path", type=str, default='checkpoint-{time}.ckpt', help="where to save checkpoints, {time} is replaced by the time-step")
+    parser.add_argument("--resume", type=str, help="resumes the run from the given checkpoint")
+    parser.add_argument("--route-budget", type=int, help="the number of A* search steps allowed for routing in each time-step")
+    parser.add_argument("--no-history", action='store_true', help="doesn't keep the lab's command history in memory")
+    parser.add_argument("--tree-cache", type=str, help="a directory in which to cache assembly trees between runs")
+    parser.add_argument("--shaped-tree", action='store_true', help="shapes the assembly tree for the number of reaction sites to finish sooner")
+    parser.add_argument("--symbolic-chemistry", action='store_true', help="looks reaction outcomes up in the assembly tree instead of simulating the DNA")
+    parser.add_argument("--verify", action='store_true', help="reruns a symbolic chemistry scenario with the full chemistry and checks that both runs agree")
+    parser.add_argument("--profile", type=str, help="runs under cProfile and writes the time spent in each function to the given CSV file")
+    parser.add_argument("--sample", type=str, help="samples the running stack and writes collapsed stacks for flame graphs to the given file")
+    parser.add_argument("--sample-interval", type=float, default=0.01, help="the time in seconds between stack samples")
+    parser.add_argument("--tick-log", type=str, help="times the phases of every time-step and writes them to the given CSV file")
+    args = parser.parse_args()
+    
+    datalen = args.gene_length
+    host_string = args.host_string
+    b_round = args.round
+    
+    options = dict(seed=args.seed, gui=args.gui, fast_forward=args.fast_forward,
+                   checkpoint_every=args.checkpoint_every, checkpoint_path=args.checkpoint_path, resume_from=args.resume,
+                   route_budget=args.route_budget, keep_history=not args.no_history, tree_cache=args.tree_cache, shaped_tree=args.shaped_tree,
+                   symbolic_chemistry=args.symbolic_chemistry, verify=args.verify)
+    if args.tick_log is not None:
+        from Timing import Tick_Log
+        options['tick_log'] = Tick_Log()
+    #The sampler writes its stacks on the way out of the with block, even if the run fails
+    if args.sample is not None:
+        from Profiling import Sampler
+        sampling = Sampler(args.sample, interval=args.sample_interval)
+    else:
+        from contextlib import nullcontext
+        sampling = nullcontext()
+    with sampling:
+        if args.profile is None:
+            results = Run_Scenario(args.gridsize, datalen, **options)
+        else:
+            from Profiling import Profile_Call
+            results = Profile_Call(args.profile, Run_Scenario, args.gridsize, datalen, **options)
+    if args.tick_log is not None:
+        options['tick_log'].Write(args.tick_log)
+    if 'verified' in results:
+        print('Symbolic chemistry run {} the full chemistry run.'.format('matches' if results['verified'] else 'DOES NOT match'))
+    
+    #Check if it succeeded in generating the symbols you asked for.
+    if results['success']:
+        # export droplet count
+        if host_string is not None and b_round is not None:
+            import pandas
+            
+            gene_length_data_path = f'raw-data/{host_string}/'
+    
+            # create data dir if necessary
+            if not os.path.isdir(gene_length_data_path):
+                os.makedirs(gene_length_data_path)
+    
+            gene_length_data = [
+                ('total droplets', 'max droplets', 'max congestion'),
+                (results['total droplets'], results['max droplets'], results['max congestion'])
+            ]
+            pandas.DataFrame(tuple(gene_length_data)).to_csv(
+                f'{gene_length_data_path}cg-{datalen}-{b_round}.csv',
+                index=False,
+                header=False
+            )
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Plotting for the virtual lab-on-a-chip.
+
+This is kept apart from the Lab and Scheduler so that headless runs, such as the benchmarks, never have to
+load matplotlib. The Lab and Scheduler only import this module once plotting has actually been requested.
+
+Droplets are drawn as circles, with their occupied and occluded gridpoints, planned routes and destinations
+drawn underneath as colored squares.
+
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+
+def Start_Plot():
+    #Turns on interactive mode and returns a fresh axes object to draw the lab on.
+    plt.ion()
+    fig, ax = plt.subplots()
+    return ax
+
+def Get_Circle(dp, zorder = 10):
+    #Returns a matplotlib Circle artist representing the droplet.
+    circ = plt.Circle(dp.coords, dp.Get_Radius(), edgecolor = (0,0,0), zorder = zorder)
+    if dp.shunting or (dp.route != [] and dp.route[-1][1:] != dp.Get_Dest()):
+        circ.set_color((0.3, 0.05, 0.65))
+    return circ
+
+def Get_Square(gp, color = (0, 0, 1), zorder = 1):
+    #Returns a pyplot Rectangle object representing the gridpoint. Default color is blue.
+    center = np.array(gp.coords) - 2*[float(gp.gridpoint_size)/2]
+    square = plt.Rectangle(center, gp.gridpoint_size, gp.gridpoint_size, fc = color, ec = 'black', zorder = zorder)
+    return square
+
+def Plot_Droplets(lab, ax=None, wait_time = 0, step=None, saveplot = False, name_str = 'Fig'):
+    if ax == None:
+        fig, ax = plt.subplots()
+
+    ax.clear() #Clear the axes object, then we'll repopulate it
+    ax.set_xlim([0, lab.grid_dim[0]])
+    ax.set_ylim([0, lab.grid_dim[1]])
+
+    if step is not None:
+        ax.set_title(f'Lab time: {step}, Congestion: {round(lab.Get_Congestion(0, 0), 3)}')
+
+    #Loop through the droplets and plot all the occlusion boxes
+    for dp in lab.droplets:
+        #Add a circle representing the droplet itself
+        ax.add_artist(Get_Circle(dp, zorder = 20))
+        x,y = dp.coords
+        ax.text(x-0.5,y+0.7,dp.species,color='red', zorder = 100)
+
+        #Add the droplet's route in gray boxes
+        if dp.Is_Routed():
+            [ax.add_artist(Get_Square(lab.grid[x[1:3]], color=(0.5, 0.5, 0.5), zorder=1)) for x in dp.route]
+
+        #Add the occupied and occluded gridpoints as yellow and blue boxes, respectively.
+        [ax.add_artist(Get_Square(gp, color = (1,1,0), zorder = 10)) for gp in dp.gridpoints];
+        [ax.add_artist(Get_Square(gp, zorder = 15)) for gp in dp.occluded];
+
+        #If it has a destination, draw that as a red box and an arrow pointing to it.
+        if dp.Get_Dest():
+            ax.add_artist(Get_Square(lab.grid[dp.Get_Dest()], color=(1,0,0), zorder = 1))
+            ax.add_artist(plt.arrow(*dp.coords, *(np.array(dp.Get_Dest()) - dp.Get_Loc()), zorder = 25))
+
+    #For any active gridpoints, color them orange.
+    for gp in lab.grid.values():
+        if gp.is_forbidden:
+            ax.add_artist(Get_Square(gp, color=(0,0,0), zorder=30))
+            continue
+        if gp.potential > 0:
+            # ax.add_artist(Get_Square(gp, color=(1, 0.64, 0), zorder = 18))
+            # ax.add_artist(Get_Square(gp, color=(1, 0.64, 0), zorder = 50))
+            pass
+
+
+    if saveplot:
+        plt.savefig('Figures/' + name_str + str(step) + '.png')
+
+    if wait_time > 0:
+        plt.pause(wait_time)
+    return ax
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""
+Shared setup for the tests.
+
+The simulation modules import each other by their top-level names, the same as when Tutorial.py is run
+as a script, so their directories are put on the path before any test module imports them.
+
+"""
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'DMFsim'))
+sys.path.insert(0, os.path.join(root, 'DMFsim-benchmarking'))
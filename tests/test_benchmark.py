@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the benchmarker's results store: which runs the formatters read, and importing legacy csvs.
+
+"""
+import os
+import importlib
+from contextlib import closing
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope = 'module')
+def Benchmark():
+    #The benchmarker reads config.ini from the working directory when it is imported
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        return importlib.import_module('Benchmark')
+    finally:
+        os.chdir(cwd)
+
+@pytest.fixture
+def store(Benchmark, tmp_path):
+    with closing(Benchmark.open_store(str(tmp_path / 'runs.sqlite'))) as store:
+        yield store
+
+def Write_Csv(path, header, rows, mtime):
+    with open(path, 'w') as f:
+        f.write(','.join(header) + '\n')
+        for row in rows:
+            f.write(','.join(str(x) for x in row) + '\n')
+    os.utime(path, (mtime, mtime))
+
+def test_latest_runs(Benchmark, store):
+    run_ids = {}
+    for value, j, runtime in [(45, 0, 1.0), (40, 0, 2.0), (45, 1, 3.0), (40, 0, 4.0), (45, 0, 5.0)]:
+        run_ids[value, j, runtime] = Benchmark.store_run(store, ('vm', 'gridsize', value, j), 'cmd', runtime)
+    Benchmark.store_run(store, ('other', 'gridsize', 40, 0), 'cmd', 6.0)
+    Benchmark.store_run(store, ('vm', 'gene-length', 40, 0), 'cmd', 7.0)
+
+    #Later runs of the same value and round supersede earlier ones, and the values sort numerically
+    assert Benchmark.latest_runs(store, 'gridsize', 'vm') == [
+        ('40-0', run_ids[40, 0, 4.0], 4.0),
+        ('45-0', run_ids[45, 0, 5.0], 5.0),
+        ('45-1', run_ids[45, 1, 3.0], 3.0),
+    ]
+    assert [label for label, _, _ in Benchmark.latest_runs(store, 'gridsize')] == ['40-0', '40-0', '45-0', '45-1']
+
+    Benchmark.store_run(store, ('vm', 'hardware', None, 1), 'cmd', 8.0)
+    Benchmark.store_run(store, ('other', 'hardware', None, 0), 'cmd', 9.0)
+    assert [(label, runtime) for label, _, runtime in Benchmark.latest_runs(store, 'hardware')] == [('other-0', 9.0), ('vm-1', 8.0)]
+
+def test_import_raw_data(Benchmark, store, tmp_path):
+    raw_data_path = tmp_path / 'raw-data'
+    (raw_data_path / 'vm').mkdir(parents = True)
+    header = ['time+', 'res', '%cpu', 'core', 'concurrency', 'total-runtime']
+    Write_Csv(raw_data_path / 'vm' / 'gl-3-0.csv', header, [(0.0, 0.006, 0.0, 0, 1, 0.5), (0.05, 0.021, 73.4, 0, 1, '')], 1000)
+    Write_Csv(raw_data_path / 'vm' / 'cg-3-0.csv', ['total droplets', 'max droplets', 'max congestion'], [(13, 5, 8.375)], 1000)
+    Write_Csv(raw_data_path / 'vm' / 'gs-40-1.csv', header, [(0.0, 0.003, 0.0, 0, 1, 0.7)], 1000)
+    Write_Csv(raw_data_path / 'vm' / 'ps-40-2-0.csv', ['Id', 'group', 'calls', 'time'], [('Lab.Advance', 'lab', 10, 0.25)], 1000)
+
+    #A run made after the csvs were written is newer than any of them
+    newer = Benchmark.store_run(store, ('vm', 'gene-length', 3, 0), 'cmd', 2.0)
+
+    assert Benchmark.import_raw_data(store, str(raw_data_path)) == 3
+    assert Benchmark.import_raw_data(store, str(raw_data_path)) == 0
+
+    assert Benchmark.latest_runs(store, 'gene-length', 'vm') == [('3-0', newer, 2.0)]
+    (label, run_id, runtime), = Benchmark.latest_runs(store, 'gridsize', 'vm')
+    assert (label, runtime) == ('40-1', 0.7)
+    assert store.execute('SELECT "time+", res FROM pings WHERE run = ? ORDER BY seq', (run_id, )).fetchall() == [(0.0, 0.003)]
+    assert store.execute('SELECT max_droplets FROM congestion').fetchall() == [(5, )]
+    (label, run_id, runtime), = Benchmark.latest_runs(store, 'problem-size', 'vm')
+    assert label == '40-2-0'
+    assert store.execute('SELECT id, calls FROM calls WHERE run = ?', (run_id, )).fetchall() == [('Lab.Advance', 10)]
+
+def test_open_store_adds_source_column(Benchmark, tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    with closing(Benchmark.sqlite3.connect(path)) as old, old:
+        old.execute('CREATE TABLE runs (id INTEGER PRIMARY KEY, host TEXT, variable TEXT, value, round INTEGER, '
+                    'config_hash TEXT, command TEXT, finished REAL, total_runtime REAL)')
+    with closing(Benchmark.open_store(path)) as store:
+        assert 'source' in [column[1] for column in store.execute('PRAGMA table_info(runs)')]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the routing bookkeeping: the route footprint counters behind the on-path checks,
+the encoded blocked coordinates and the per-time-step routing budget.
+
+"""
+import random
+
+import numpy as np
+
+from Lab import Lab, Droplet, Calculate_Shape, Calculate_Shell
+from Scheduler import Get_Blocked, Get_Blocked_Codes, Blocked_Set, Encode_Blocked, Decode_Time, Latest_Blocked
+import Tutorial
+
+def Random_Route(rng, start, length, time = 0):
+    #A route of unit steps from start, as (time, x, y) triples, that may wander off the grid
+    x, y = start
+    route = []
+    for t in range(time + 1, time + length + 1):
+        X, Y = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1), (0, 0)])
+        x, y = x + X, y + Y
+        route.append((t, x, y))
+    return route
+
+def Scanned_On_Path(lab, indices):
+    #The on-path check as the Scheduler used to make it, from every planned step of every droplet
+    return indices in set([pair for dp in lab.droplets for step in dp.route for pair in Get_Blocked(step[1:3], shape = dp.Get_Shape(), shell = dp.Get_Shell())])
+
+def test_footprint_covers_matches_scan():
+    rng = random.Random(5)
+    lab = Lab(np.array([20, 20]), 1, [], {})
+    for i, area in enumerate([1, 4, 9, 30]):
+        loc = (rng.randrange(20), rng.randrange(20))
+        dp = Droplet(np.array(loc) + 0.5, 'X{}'.format(i), area, [], i, footprint = lab.route_footprint)
+        lab.droplets.append(dp)
+        dp.Set_Route(Random_Route(rng, loc, 12), time = 0)
+
+    for change in range(30):
+        for indices in lab.grid:
+            assert lab.route_footprint.Covers(indices) == Scanned_On_Path(lab, indices)
+
+        #Step the droplets along, replan some and clear others, the way the Scheduler and Lab do
+        dp = rng.choice(lab.droplets)
+        if dp.route and rng.random() < 0.6:
+            dp.Pop_Step()
+        elif rng.random() < 0.5:
+            dp.Set_Route(Random_Route(rng, dp.route[-1][1:] if dp.route else (10, 10), rng.randrange(1, 10)), time = change)
+        else:
+            dp.route = []
+            dp.Clear_Footprint()
+
+    #Off-grid queries are never on a path
+    assert not lab.route_footprint.Covers((-1, 5))
+    assert not lab.route_footprint.Covers((5, 20))
+
+def test_blocked_codes_match_tuples():
+    rng = random.Random(11)
+    grid_dim = (15, 12)
+    for area in [1, 5, 20]:
+        shape, shell = Calculate_Shape(area), Calculate_Shell(area)
+        steps = Random_Route(rng, (rng.randrange(15), rng.randrange(12)), 8, time = 3)
+        codes = Get_Blocked_Codes(steps, shape, shell, grid_dim)
+        blocked = Blocked_Set(codes, grid_dim)
+        expected = set(coords for step in steps for coords in Get_Blocked(step, shape, shell))
+        assert len(blocked) == len(expected)
+        for t in range(0, 15):
+            for x in range(-15, 30):
+                for y in range(-12, 24):
+                    assert ((t, x, y) in blocked) == ((t, x, y) in expected)
+        #Far off the grid nothing is blocked, even where the encoding would otherwise alias
+        assert (5, 3*15, 0) not in blocked and (5, 0, -13) not in blocked
+
+def test_blocked_code_times():
+    grid_dim = (10, 10)
+    for t, x, y in [(0, 0, 0), (7, -10, 19), (123, 19, -10), (4, 5, 5)]:
+        assert Decode_Time(Encode_Blocked(t, x, y, grid_dim), grid_dim) == t
+
+    #The latest block at a location is the one with the largest time
+    codes = np.array([Encode_Blocked(t, x, y, grid_dim) for t, x, y in [(3, 4, 4), (9, 4, 4), (12, 4, 5), (6, 4, 4)]])
+    assert Decode_Time(codes[Latest_Blocked(codes, (4, 4), grid_dim)], grid_dim) == 9
+    assert Latest_Blocked(codes, (5, 4), grid_dim) is None
+
+def test_route_budget_defers_and_finishes():
+    #With a tight budget, some droplets have to wait for the next time-step, but the assembly still completes
+    lab, sch, data = Tutorial.Simulate(40, 3, seed = 42, verbose = False, route_budget = 50)
+    assert sch.deferred_routes > 0
+    assert Tutorial.Check(lab, data, verbose = False)
+    assert sch.deferred == []
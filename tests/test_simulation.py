@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end tests that run whole assemblies on small grids.
+
+"""
+import re
+
+import pytest
+
+from Checkpoint import Load_Checkpoint
+import Tutorial
+
+def History(lab):
+    #The lab's command history with object addresses left out, so that two runs can be compared
+    return re.sub(r' at 0x[0-9a-f]+', '', repr(lab.history))
+
+@pytest.fixture(scope = 'module')
+def default_run():
+    return Tutorial.Simulate(40, 3, seed = 42, verbose = False)
+
+def test_known_outcome(default_run):
+    lab, sch, data = default_run
+    assert Tutorial.Check(lab, data, verbose = False)
+    assert lab.time == 234
+    assert lab.Get_Droplet_Counts() == (13, 5)
+
+def test_fast_forward_matches_default(default_run):
+    lab, sch, data = default_run
+    fast_lab, fast_sch, fast_data = Tutorial.Simulate(40, 3, seed = 42, verbose = False, fast_forward = True)
+    assert fast_data == data
+    assert fast_lab.time == lab.time
+    assert History(fast_lab) == History(lab)
+    assert (fast_sch.astar_calls, fast_sch.astar_visits) == (sch.astar_calls, sch.astar_visits)
+
+def test_resume_from_checkpoint(default_run, tmp_path):
+    lab, sch, data = default_run
+    path = str(tmp_path / 'run-{time}.ckpt')
+    Tutorial.Simulate(40, 3, seed = 42, verbose = False, checkpoint_every = 100, checkpoint_path = path)
+
+    #The checkpoint leaves out the per-time-step routing blocks, which are rebuilt before they are next needed
+    resumed = Load_Checkpoint(path.format(time = 100))
+    assert all(dp.blocked == [] and dp.footprint is resumed.lab.route_footprint for dp in resumed.lab.droplets)
+
+    resumed_lab, resumed_sch, resumed_data = Tutorial.Simulate(40, 3, seed = 42, verbose = False, resume_from = path.format(time = 100))
+    assert Tutorial.Check(resumed_lab, resumed_data, verbose = False)
+    assert resumed_lab.time == lab.time
+    assert History(resumed_lab) == History(lab)
+    assert resumed_sch.astar_visits == sch.astar_visits
+
+def test_symbolic_chemistry_verifies():
+    results = Tutorial.Run_Scenario(40, 3, seed = 42, verbose = False, symbolic_chemistry = True, verify = True)
+    assert results['success']
+    assert results['verified']
+    assert results['lab time'] == 234
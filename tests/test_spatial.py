@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the spatial indexes in Spatial.py, checked against plain scans over the same locations.
+
+"""
+import random
+
+import numpy as np
+import pytest
+
+from Lab import Calculate_Shape, Calculate_Shell
+from Spatial import Bucket_Index, Parking_Lot, Site_Index, Dist
+import Tutorial
+
+def Scan_Nearest(locs, loc, accept = None):
+    #The closest location by a scan over the list. Ties go to the earlier location, like Bucket_Index.
+    options = [tuple(x) for x in locs if accept is None or accept(tuple(x))]
+    return min(options, key = lambda x: Dist(x, loc)) if options else None
+
+@pytest.mark.parametrize('bucket_size', [1, 3, 8, 64])
+def test_nearest_matches_scan(bucket_size):
+    rng = random.Random(bucket_size)
+    locs = [(rng.randrange(60), rng.randrange(60)) for i in range(150)]
+    index = Bucket_Index(locs, bucket_size = bucket_size)
+    accept = lambda x: (x[0] + 2*x[1]) % 3 != 0
+    for i in range(200):
+        #Include queries well off the grid, where the ring search starts outside the buckets in use
+        loc = (rng.randrange(-20, 80), rng.randrange(-20, 80))
+        assert index.Nearest(loc) == Scan_Nearest(locs, loc)
+        assert index.Nearest(loc, accept = accept) == Scan_Nearest(locs, loc, accept)
+
+def test_nearest_breaks_ties_by_insertion_order():
+    index = Bucket_Index([(10, 12), (12, 10), (8, 10), (10, 8)], bucket_size = 4)
+    assert index.Nearest((10, 10)) == (10, 12)
+    assert index.Nearest((10, 10), accept = lambda x: x != (10, 12)) == (12, 10)
+
+def test_nearest_gives_up_after_trials():
+    locs = [(x, y) for x in range(10) for y in range(10)]
+    index = Bucket_Index(locs)
+    tested = []
+    def accept(x):
+        tested.append(x)
+        return False
+    assert index.Nearest((5, 5), accept = accept, trials = 7) is None
+    assert len(tested) == 7
+    #The rejected candidates are still the closest ones
+    assert max(Dist(x, (5, 5)) for x in tested) <= 2
+
+def test_nearest_without_locations():
+    assert Bucket_Index([]).Nearest((3, 3)) is None
+    assert Bucket_Index([(1, 1)]).Nearest((3, 3), accept = lambda x: False) is None
+
+def test_site_index_matches_scan():
+    random.seed(7)
+    inst_locs, pull_data, symbols, linkers = Tutorial.Setup_Lab(60)
+    sites = Site_Index(np.array([60, 60]), inst_locs, pull_data)
+    rng = random.Random(3)
+    busy = set(rng.sample([loc for inst_loc in inst_locs for loc in inst_loc[1:]], 6))
+    available = lambda x: x not in busy
+    for i in range(50):
+        loc = (rng.randrange(60), rng.randrange(60))
+        for inst_loc in inst_locs:
+            assert sites.Sites(inst_loc[0]) == inst_loc[1:]
+            assert sites.Nearest_Work_Site(inst_loc[0], loc) == Scan_Nearest(inst_loc[1:], loc)
+            assert sites.Nearest_Work_Site(inst_loc[0], loc, available) == Scan_Nearest(inst_loc[1:], loc, available)
+        for species in ['gibson_mix', 'L0', symbols[0]]:
+            assert sites.Nearest_Reservoir(species, loc) == Scan_Nearest(pull_data[species]['loc'], loc)
+    assert sites.Nearest_Work_Site('Ligate', (0, 0)) is None
+    assert sites.Nearest_Reservoir('no such species', (0, 0)) is None
+    assert sites.Sites('Ligate') == []
+
+@pytest.mark.parametrize('area', [1, 4, 13, 49])
+def test_parking_slots_keep_clear_of_sites(area):
+    avoid = [(0, 10), (20, 20), (33, 5), (44, 40)]
+    parking = Parking_Lot((50, 50), avoid)
+    slots = [slot for bucket in parking.Get_Lot(area).buckets.values() for _, slot in bucket]
+    footprint = Calculate_Shape(area) + Calculate_Shell(area)
+    rad = np.sqrt(area/np.pi)
+    assert slots
+    for (x, y) in slots:
+        assert not any((x + X, y + Y) in avoid for (X, Y) in footprint)
+        assert 2 + rad < x < 50 - rad - 2 and 2 + rad < y < 50 - rad - 2
+
+def test_parking_claims():
+    class Shunted():
+        def __init__(self, dest):
+            self.dest = dest
+            self.shunting = True
+            self.to_delete = False
+
+    parking = Parking_Lot((50, 50), [])
+    first = parking.Find_Slot((25, 25), 1)
+    assert first == Scan_Nearest([slot for bucket in parking.Get_Lot(1).buckets.values() for _, slot in bucket], (25, 25))
+    dp = Shunted(first)
+    parking.Park(first, dp)
+    assert not parking.Is_Free(first)
+    assert parking.Find_Slot((25, 25), 1) != first
+
+    #The claim lapses once the droplet heads somewhere else
+    dp.shunting = False
+    assert parking.Is_Free(first)
+    assert parking.Find_Slot((25, 25), 1) == first
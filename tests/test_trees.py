@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for building assembly trees: the shaped tree's fallback to Build_Tree and the on-disk tree cache.
+
+"""
+import os
+import re
+
+import Interpreter as Int
+import TreeCache
+
+def Signature(nodes):
+    #Everything the Scheduler reads from a tree, level by level
+    return [[(str(node.data), str(node.inst_list)) for node in level] for level in nodes]
+
+data = ['_S{}_'.format(i) for i in range(10)]
+
+def test_shaped_tree_when_predicted_sooner():
+    #For ten symbols on five sites a shallower tree is predicted to finish sooner than the default one
+    shaped_root, shaped = Int.Build_Shaped_Tree(data, 3, sites = 5, linkernum = 50)
+    root, default = Int.Build_Tree(data, 3, linkernum = 50)
+    assert Signature(shaped) != Signature(default)
+    #The linkers differ, but the same symbols are assembled in the same order
+    assert re.sub(r'L\d+', '', shaped_root.data[0]) == re.sub(r'L\d+', '', root.data[0]) == ''.join(data)
+
+def test_shaped_tree_falls_back_to_default(monkeypatch):
+    root, default = Int.Build_Tree(data, 3, linkernum = 50)
+
+    #Seven symbols gain nothing from reshaping, so the default tree is built
+    assert Signature(Int.Build_Shaped_Tree(data[:7], 3, sites = 5, linkernum = 50)[1]) == Signature(Int.Build_Tree(data[:7], 3, linkernum = 50)[1])
+
+    #Nor is anything built that isn't predicted to beat the default tree
+    monkeypatch.setattr(Int, 'Estimate_Default_Makespan', lambda *args: 0)
+    assert Signature(Int.Build_Shaped_Tree(data, 3, sites = 5, linkernum = 50)[1]) == Signature(default)
+
+def test_cache_hits_and_misses(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    built = []
+    build = TreeCache.Build
+    monkeypatch.setattr(TreeCache, 'Build', lambda *args: built.append(args) or build(*args))
+
+    root, nodes = TreeCache.Cached_Build_Tree(data, 3, linkernum = 50, cache_dir = cache_dir)
+    cached_root, cached = TreeCache.Cached_Build_Tree(data, 3, linkernum = 50, cache_dir = cache_dir)
+    assert len(built) == 1
+    assert Signature(cached) == Signature(nodes)
+    assert len(os.listdir(cache_dir)) == 1
+
+    #Different inputs get their own trees
+    TreeCache.Cached_Build_Tree(data, 3, linkernum = 50, cache_dir = cache_dir, sites = 5)
+    TreeCache.Cached_Build_Tree(data[:9], 3, linkernum = 50, cache_dir = cache_dir)
+    assert len(built) == 3
+
+def test_cache_misses_after_interpreter_changes(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    key = TreeCache.Tree_Key(data, 3, 50)
+    TreeCache.Cached_Build_Tree(data, 3, linkernum = 50, cache_dir = cache_dir)
+
+    #Any edit to the Interpreter's source gives a new hash, and so new keys
+    monkeypatch.setattr(TreeCache, 'interpreter_hash', TreeCache.Source_Hash(TreeCache))
+    assert TreeCache.Tree_Key(data, 3, 50) != key
+    built = []
+    build = TreeCache.Build
+    monkeypatch.setattr(TreeCache, 'Build', lambda *args: built.append(args) or build(*args))
+    TreeCache.Cached_Build_Tree(data, 3, linkernum = 50, cache_dir = cache_dir)
+    assert len(built) == 1
+    assert len(os.listdir(cache_dir)) == 2
+
+def test_source_hash_ignores_line_endings(tmp_path):
+    class Module():
+        pass
+    lf, crlf = Module(), Module()
+    lf.__file__, crlf.__file__ = str(tmp_path / 'lf.py'), str(tmp_path / 'crlf.py')
+    with open(lf.__file__, 'wb') as f:
+        f.write(b'x = 1\ny = 2\n')
+    with open(crlf.__file__, 'wb') as f:
+        f.write(b'x = 1\r\ny = 2\r\n')
+    assert TreeCache.Source_Hash(lf) == TreeCache.Source_Hash(crlf)